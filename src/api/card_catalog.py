@@ -0,0 +1,138 @@
+import asyncio
+from typing import Iterable, NamedTuple
+from fastapi import Request
+from neo4j import AsyncDriver
+from codetiming import Timer
+
+
+class CatalogSnapshot(NamedTuple):
+    """ One consistent version of the catalog. It is never modified once published """
+    fields: tuple[str, ...]
+    records: list[tuple]
+    by_id: dict[str, int]
+    by_name: dict[str, int]
+    version: int | None = None
+
+
+class CardCatalog:
+    """
+    Read-through in-memory copy of the Card nodes, indexed by scryfall_id and name_front.
+
+    Cards only change when the Scryfall ingest runs, which bumps the `IngestVersion` marker in the graph.
+    Each card is stored as a tuple of its property values, in the order of `fields`.
+
+    The catalog is published as a single `CatalogSnapshot` attribute, so a lookup sees a whole snapshot, never a mix.
+    `load` builds the snapshot in a worker thread but publishes it on the event loop, where `add_many` also copies
+    and publishes the current one, so a reload and a read-through add are never interleaved and neither is lost.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._snapshot = CatalogSnapshot((), [], {}, {})
+
+    def __len__(self) -> int:
+        return len(self._snapshot.records)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return self._snapshot.fields
+
+    @staticmethod
+    def build_snapshot(nodes: list[dict], version=None) -> CatalogSnapshot:
+        """ Builds a snapshot of the given card nodes, without publishing it """
+        fields = tuple(sorted({key for node in nodes for key in node}))
+        records = [tuple(node.get(field) for field in fields) for node in nodes]
+        by_id = {node["scryfall_id"]: i for i, node in enumerate(nodes)}
+        by_name = {node["name_front"]: i for i, node in enumerate(nodes)}
+        return CatalogSnapshot(fields, records, by_id, by_name, version)
+
+    def publish(self, snapshot: CatalogSnapshot) -> None:
+        self._snapshot = snapshot
+        self.ready = True
+
+    def build(self, nodes: list[dict], version=None) -> None:
+        """ Replaces the catalog with the given card nodes """
+        self.publish(self.build_snapshot(nodes, version))
+
+    def add_many(self, nodes: Iterable[dict]) -> None:
+        """ Adds the cards read through to the database, publishing a single copy of the current snapshot """
+        snapshot = self._snapshot
+        new_nodes = {}
+        for node in nodes:
+            if node["scryfall_id"] not in snapshot.by_id:
+                new_nodes[node["scryfall_id"]] = node
+        if not new_nodes:
+            return
+
+        # Older records are shorter than the new fields, which zip() in `_node` treats as missing properties
+        fields = snapshot.fields + tuple(sorted({key for node in new_nodes.values() for key in node} - set(snapshot.fields)))
+        records = snapshot.records + [tuple(node.get(field) for field in fields) for node in new_nodes.values()]
+        by_id, by_name = dict(snapshot.by_id), dict(snapshot.by_name)
+        for i, node in enumerate(new_nodes.values(), start=len(snapshot.records)):
+            by_id[node["scryfall_id"]] = by_name[node["name_front"]] = i
+        self._snapshot = snapshot._replace(fields=fields, records=records, by_id=by_id, by_name=by_name)
+
+    def add(self, node: dict) -> None:
+        self.add_many([node])
+
+    @staticmethod
+    def _node(snapshot: CatalogSnapshot, i: int | None) -> dict | None:
+        if i is None:
+            return None
+        return {field: value for field, value in zip(snapshot.fields, snapshot.records[i]) if value is not None}
+
+    def get_by_id(self, scryfall_id: str) -> dict | None:
+        snapshot = self._snapshot
+        return self._node(snapshot, snapshot.by_id.get(scryfall_id))
+
+    def get_by_name(self, name_front: str) -> dict | None:
+        """ Looks up a card by its formatted front name, see `utils.card.get_formatted_card` """
+        snapshot = self._snapshot
+        return self._node(snapshot, snapshot.by_name.get(name_front))
+
+    async def get_version(self, driver: AsyncDriver):
+        query = """
+        OPTIONAL MATCH (v:IngestVersion {name: 'cards'})
+        RETURN v.version AS version
+        """
+        async with driver.session(database="neo4j") as session:
+            result = await session.run(query)
+            record = await result.single()
+            return record["version"]
+
+    async def load(self, driver: AsyncDriver, version=None) -> None:
+        """ Loads every card node from Neo4j """
+        query = """
+        MATCH (c:Card)
+        RETURN c as node
+        """
+        with Timer(name="card catalog load", text="Loaded card catalog in {:.2f}s"):
+            async with driver.session(database="neo4j") as session:
+                result = await session.run(query)
+                nodes = [dict(record["node"]) async for record in result]
+            snapshot = await asyncio.to_thread(self.build_snapshot, nodes, version)
+            self.publish(snapshot)
+
+    async def refresh(self, driver: AsyncDriver) -> None:
+        """ Reloads the catalog if it was never loaded or the cards were ingested again since """
+        version = await self.get_version(driver)
+        if not self.ready or version != self.version:
+            await self.load(driver, version)
+
+
+async def refresh_card_catalog(catalog: CardCatalog, driver: AsyncDriver, interval: float) -> None:
+    """ Keeps the catalog in sync with the ingest version marker. Card lookups read through to Neo4j until it is loaded """
+    while True:
+        try:
+            await catalog.refresh(driver)
+        except Exception as e:
+            print(f"{e}: Failed to refresh card catalog")
+        await asyncio.sleep(interval)
+
+
+def get_card_catalog(request: Request) -> CardCatalog | None:
+    return request.app.card_catalog
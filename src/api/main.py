@@ -1,12 +1,18 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import firebase_admin
 from firebase_admin import credentials
-from api.routers import collection, pool, suggestions, user
+from api.routers import batch, collection, metrics, pool, suggestions, user
 from contextlib import asynccontextmanager
 from collections.abc import AsyncGenerator
 from config.settings import get_settings
-from neo4j import AsyncGraphDatabase
+from config.database import create_driver, create_schema
+from api.suggestion_engine import SuggestionEngine, refresh_suggestion_engine
+from api.suggestion_cache import SuggestionCache
+from api.card_catalog import CardCatalog, refresh_card_catalog
+from api.token_cache import TokenCache, refresh_token_keys
+from api.metrics import Metrics, MetricsMiddleware
 
 # Check if the default app is already initialized
 if not firebase_admin._apps:
@@ -16,16 +22,31 @@ if not firebase_admin._apps:
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    """Async context manager for MongoDB connection."""
+    """Async context manager for the Neo4j driver. Requests open their own sessions from its pool."""
     settings = get_settings()
-    URI = f"bolt://{settings.SERVER_HOST}:7687"
-    AUTH = (settings.NEO4J_USER, settings.NEO4J_PASSWORD)
-    async with AsyncGraphDatabase.driver(URI, auth=AUTH) as driver:
-        async with driver.session(database="neo4j") as session:
-            app.session = session
-            print("Successfully connected to Neo4j DB")
-            yield
-            print("Successfully closed Neo4j connection")
+    async with create_driver(settings) as driver:
+        app.driver = driver
+        print("Successfully connected to Neo4j DB")
+
+        app.suggestion_cache = SuggestionCache(settings.SUGGESTION_CACHE_SIZE, settings.SUGGESTION_CACHE_TTL)
+        app.engine = SuggestionEngine()
+        app.card_catalog = CardCatalog() if settings.CARD_CATALOG_ENABLED else None
+        app.token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+        background_tasks = [
+            asyncio.create_task(create_schema(driver)),
+            asyncio.create_task(refresh_token_keys(app.token_cache, settings.TOKEN_KEYS_REFRESH_SECONDS)),
+        ]
+        if settings.SUGGESTION_ENGINE_ENABLED:
+            background_tasks.append(asyncio.create_task(refresh_suggestion_engine(app.engine, driver, settings.SUGGESTION_ENGINE_REFRESH_SECONDS)))
+        if app.card_catalog:
+            background_tasks.append(asyncio.create_task(refresh_card_catalog(app.card_catalog, driver, settings.CARD_CATALOG_REFRESH_SECONDS)))
+
+        yield
+
+        for task in background_tasks:
+            task.cancel()
+        print("Successfully closed Neo4j connection")
 
 
 app = FastAPI(
@@ -34,6 +55,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.metrics = Metrics(get_settings().METRICS_ENABLED)
+if app.metrics.enabled:
+    app.add_middleware(MetricsMiddleware, metrics=app.metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=get_settings().ALLOW_ORIGINS.split(','),
@@ -51,4 +76,6 @@ async def root():
 app.include_router(user.router, prefix="/user", tags=["user"])
 app.include_router(pool.router, prefix="/pool", tags=["pool"])
 app.include_router(collection.router, prefix="/collection", tags=["collection"])
-app.include_router(suggestions.router, prefix="/suggestions", tags=["suggestions"])
\ No newline at end of file
+app.include_router(suggestions.router, prefix="/suggestions", tags=["suggestions"])
+app.include_router(batch.router, prefix="/batch", tags=["batch"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
\ No newline at end of file
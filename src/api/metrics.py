@@ -0,0 +1,204 @@
+import time
+from bisect import bisect_left
+from fastapi import Request
+from neo4j import AsyncManagedTransaction, AsyncResult, AsyncSession
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECORD_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, le: str | None = None) -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        labels.append(f'le="{le}"')
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Histogram:
+    """ Prometheus histogram with a fixed set of label names. Buckets are counted per label values and made cumulative when rendered """
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket, with a last +Inf bucket], sum
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, bound)} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    In-process metrics of the API, rendered in the Prometheus text format by the /metrics endpoint.
+
+    When disabled, neither the middleware nor the session wrapper is installed, so requests and queries
+    run exactly as without metrics.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.request_duration = Histogram("http_request_duration_seconds", "Latency of HTTP requests by route", ("method", "route", "status"))
+        self.query_duration = Histogram("neo4j_query_duration_seconds", "Time from running a query to consuming its result", ("query",))
+        self.query_records = Histogram("neo4j_query_records", "Number of records returned by a query", ("query",), RECORD_BUCKETS)
+        self.session_wait = Histogram("neo4j_session_wait_seconds", "Time a transaction function waited for a pooled connection and its transaction to begin", ())
+
+    def render(self) -> str:
+        histograms = (self.request_duration, self.query_duration, self.query_records, self.session_wait)
+        return "\n".join(line for histogram in histograms for line in histogram.render()) + "\n"
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording the latency of every request, labeled with its route template rather than its path """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI sets the matched route on the scope while routing
+            route = scope.get("route")
+            self.metrics.request_duration.observe(time.perf_counter() - start, scope["method"], getattr(route, "path", "unmatched"), status)
+
+
+class InstrumentedResult:
+    """ Wraps a query result to record its duration and size once it is consumed """
+
+    def __init__(self, result: AsyncResult, metrics: Metrics, name: str, start: float):
+        self._result = result
+        self._metrics = metrics
+        self._name = name
+        self._start = start
+        self._records = 0
+        self._recorded = False
+
+    def _record(self, records: int) -> None:
+        if not self._recorded:
+            self._recorded = True
+            self._metrics.query_duration.observe(time.perf_counter() - self._start, self._name)
+            self._metrics.query_records.observe(records, self._name)
+
+    async def data(self, *keys):
+        data = await self._result.data(*keys)
+        self._record(len(data))
+        return data
+
+    async def single(self, strict: bool = False):
+        record = await self._result.single(strict)
+        self._record(int(record is not None))
+        return record
+
+    async def consume(self):
+        summary = await self._result.consume()
+        self._record(self._records)
+        return summary
+
+    async def __aiter__(self):
+        async for record in self._result:
+            self._records += 1
+            yield record
+        self._record(self._records)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+
+class InstrumentedTransaction:
+    """ Wraps a managed transaction to time each query under the name it is run with """
+
+    def __init__(self, tx: AsyncManagedTransaction, metrics: Metrics):
+        self._tx = tx
+        self._metrics = metrics
+
+    async def run(self, query, parameters=None, query_name: str = "unnamed", **kwparameters):
+        start = time.perf_counter()
+        result = await self._tx.run(query, parameters, **kwparameters)
+        return InstrumentedResult(result, self._metrics, query_name, start)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+async def run_query(tx: AsyncManagedTransaction, query_name: str, query: str, *args, **kwargs):
+    """
+    Runs a query in a transaction function, recorded under `query_name` when metrics are enabled.
+    Without metrics the transaction is the driver's own, so the name is not sent along as a query parameter
+    """
+    if isinstance(tx, InstrumentedTransaction):
+        return await tx.run(query, *args, query_name=query_name, **kwargs)
+    return await tx.run(query, *args, **kwargs)
+
+
+class InstrumentedSession:
+    """ Wraps a request session so every transaction function gets an `InstrumentedTransaction` """
+
+    def __init__(self, session: AsyncSession, metrics: Metrics):
+        self._session = session
+        self._metrics = metrics
+
+    def _wrap(self, transaction_function):
+        start = time.perf_counter()
+        attempts = 0
+
+        async def instrumented(tx, *args, **kwargs):
+            nonlocal attempts
+            # The transaction function starts once a connection is checked out of the pool and BEGIN succeeded.
+            # Retries of the function would also count the failed attempts, so only the first one is recorded
+            attempts += 1
+            if attempts == 1:
+                self._metrics.session_wait.observe(time.perf_counter() - start)
+            return await transaction_function(InstrumentedTransaction(tx, self._metrics), *args, **kwargs)
+        return instrumented
+
+    async def execute_read(self, transaction_function, *args, **kwargs):
+        return await self._session.execute_read(self._wrap(transaction_function), *args, **kwargs)
+
+    async def execute_write(self, transaction_function, *args, **kwargs):
+        return await self._session.execute_write(self._wrap(transaction_function), *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def get_metrics(request: Request) -> Metrics:
+    return request.app.metrics
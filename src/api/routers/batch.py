@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends
+from neo4j import AsyncSession
+
+from typing import Annotated
+from config.database import get_session
+from config.settings import get_firebase_user_from_token
+from api.service import batch as service
+from api.card_catalog import CardCatalog, get_card_catalog
+from api.suggestion_cache import SuggestionCache, get_suggestion_cache
+from schemas.api.batch import BatchUpdateCollection, RequestBatchOperation, ResponseBatchOperation
+
+router = APIRouter()
+
+
+@router.post("/")
+async def run_batch(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    user: Annotated[dict, Depends(get_firebase_user_from_token)],
+    cache: Annotated[SuggestionCache, Depends(get_suggestion_cache)],
+    catalog: Annotated[CardCatalog | None, Depends(get_card_catalog)],
+    operations: list[RequestBatchOperation]
+) -> list[ResponseBatchOperation]:
+    """runs an ordered list of collection and pool mutations in a single transaction"""
+    result = await session.execute_write(service.run_batch, user["uid"], operations, catalog)
+
+    if any(isinstance(operation, BatchUpdateCollection) for operation in operations):
+        cache.invalidate_user(user["uid"])
+    for pool_id in {operation.pool_id for operation in operations if not isinstance(operation, BatchUpdateCollection)}:
+        cache.invalidate_pool(pool_id)
+    return result
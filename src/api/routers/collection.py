@@ -1,30 +1,57 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from neo4j import AsyncSession
 
-from typing import Annotated
+from typing import Annotated, Literal
+from config.database import get_session
 from config.settings import get_firebase_user_from_token
 from api.service import collection as service
+from api.card_catalog import CardCatalog, get_card_catalog
+from api.suggestion_cache import SuggestionCache, get_suggestion_cache
 from schemas.api.mtg_card import RequestUpdateCardCount, ResponseCardInCollection
+from utils.collection_import import iter_lines
 
 router = APIRouter()
 
 
 @router.get("/")
 async def get_collection(
-    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
     user: Annotated[dict, Depends(get_firebase_user_from_token)]
 ) -> list[ResponseCardInCollection]:
     """returns the user's collection"""
-    session = request.app.session
     result = await session.execute_read(service.get_collection, user["uid"])
     return result
 
 @router.post("/")
 async def update_cards_in_collection(
-    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
     user: Annotated[dict, Depends(get_firebase_user_from_token)],
+    cache: Annotated[SuggestionCache, Depends(get_suggestion_cache)],
+    catalog: Annotated[CardCatalog | None, Depends(get_card_catalog)],
     cards: list[RequestUpdateCardCount]
 ) -> list[ResponseCardInCollection]:
     """updates the number of cards in the user collection"""
-    session = request.app.session
-    result = await session.execute_write(service.update_number_of_cards_in_collection, user["uid"], cards)
-    return result
\ No newline at end of file
+    result = await session.execute_write(service.update_number_of_cards_in_collection, user["uid"], cards, catalog)
+    cache.invalidate_user(user["uid"])
+    return result
+
+@router.post("/import")
+async def import_collection(
+    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    user: Annotated[dict, Depends(get_firebase_user_from_token)],
+    cache: Annotated[SuggestionCache, Depends(get_suggestion_cache)],
+    catalog: Annotated[CardCatalog | None, Depends(get_card_catalog)],
+    format: Literal["csv", "text"] = Query("text", description="a CSV collection export, or an MTGO/Arena text decklist"),
+    set_quantity: bool = Query(False, description="set the number owned of each card instead of adding to it"),
+    chunksize: int = Query(500, ge=1, le=5000, description="number of distinct cards written per transaction"),
+):
+    """imports a collection from the raw request body, writing it in chunks as it is uploaded"""
+    # The body is read as a stream rather than a JSON list, so it is never held in memory or validated as a whole
+    try:
+        result = await service.import_collection(session, user["uid"], iter_lines(request.stream()), format, set_quantity, chunksize, catalog)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        cache.invalidate_user(user["uid"])
+    return result
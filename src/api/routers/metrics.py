@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from typing import Annotated
+from api.metrics import Metrics, get_metrics
+
+router = APIRouter()
+
+@router.get("", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics_text(
+    metrics: Annotated[Metrics, Depends(get_metrics)]
+):
+    """gets the request and query metrics in the Prometheus text format"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return metrics.render()
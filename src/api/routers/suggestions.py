@@ -1,25 +1,42 @@
-from fastapi import APIRouter, Depends, Query, Request
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from neo4j import AsyncDriver, AsyncSession
 from typing import Annotated, List, Optional
-from config.settings import get_firebase_user_from_token
+from config.database import get_driver, get_session, stream_ndjson
+from config.settings import get_firebase_user_from_token, get_settings
 from api.service import suggestions as service
+from api.suggestion_engine import SuggestionEngine, get_suggestion_engine
+from api.suggestion_cache import SuggestionCache, get_suggestion_cache
+from api.card_catalog import CardCatalog, get_card_catalog
 from schemas.api.pool_suggestions import CardFilters, RequestCardSuggestions
 
 router = APIRouter()
 
 @router.get("/pool/{pool_id}")
 async def get_card_suggestions(
-    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
     user: Annotated[dict, Depends(get_firebase_user_from_token)],
+    engine: Annotated[SuggestionEngine | None, Depends(get_suggestion_engine)],
+    cache: Annotated[SuggestionCache, Depends(get_suggestion_cache)],
+    catalog: Annotated[CardCatalog | None, Depends(get_card_catalog)],
+    driver: Annotated[AsyncDriver, Depends(get_driver)],
     pool_id: str,
     from_collection: bool = Query(True),
     max_price: Optional[float] = Query(None),
     ignore_basic_lands: bool = Query(True),
     preserve_colors: bool = Query(True),
-    legalities: Optional[str] = Query('')
+    legalities: Optional[str] = Query(''),
+    limit: int = Query(200, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    compact: bool = Query(False, description="only return scryfall_id, name, img_uri and sync_score"),
+    stream: bool = Query(False, description="stream the suggestions as NDJSON"),
 ):
     """gets card suggestions for a pool"""
     params = RequestCardSuggestions(
         from_collection= from_collection,
+        limit=limit,
+        offset=offset,
+        compact=compact,
         filters = CardFilters(
             max_price=max_price,
             legalities=legalities.split(',') if legalities else [],
@@ -28,17 +45,28 @@ async def get_card_suggestions(
         )
     )
 
-    session = request.app.session
-    result = await session.execute_read(service.get_card_suggestions, user["uid"], pool_id, params)
+    if stream:
+        query, parameters = await session.execute_read(service.get_card_suggestions_stream_query, user["uid"], pool_id, params, engine)
+        return StreamingResponse(stream_ndjson(driver, query, parameters), media_type="application/x-ndjson")
+
+    result = await session.execute_read(service.get_card_suggestions, user["uid"], pool_id, params, engine, cache, catalog, get_settings().SUGGESTION_PROFILE_ENABLED)
     return result
 
 
+@router.get("/cache-stats")
+async def get_suggestion_cache_stats(
+    user: Annotated[dict, Depends(get_firebase_user_from_token)],
+    cache: Annotated[SuggestionCache, Depends(get_suggestion_cache)]
+):
+    """gets the hit and miss counters of the suggestion cache"""
+    return cache.stats()
+
+
 @router.get("/collection-clusters")
 async def get_card_clusters_from_collection(
-    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
     user: Annotated[dict, Depends(get_firebase_user_from_token)]
 ):
     """gets card clusters from user's collection"""
-    session = request.app.session
     result = await session.execute_read(service.get_card_clusters_from_collection, user["uid"])
     return result
\ No newline at end of file
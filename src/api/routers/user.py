@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends
+from neo4j import AsyncSession
 
 from typing import Annotated
+from config.database import get_session
 from config.settings import get_firebase_user_from_token
 from api.service import user as service
 
@@ -13,8 +15,7 @@ async def get_userid(user: Annotated[dict, Depends(get_firebase_user_from_token)
 
 
 @router.post("/")
-async def add_user(request: Request, user: Annotated[dict, Depends(get_firebase_user_from_token)]):
+async def add_user(session: Annotated[AsyncSession, Depends(get_session)], user: Annotated[dict, Depends(get_firebase_user_from_token)]):
     """adds a user to the database, if the user does not already exist"""
-    session = request.app.session
     result = await session.execute_write(service.add_user, user["uid"])
     return result
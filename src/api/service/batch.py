@@ -0,0 +1,38 @@
+from uuid import UUID
+from neo4j import AsyncManagedTransaction
+from api.card_catalog import CardCatalog
+from api.service.card import get_cards
+from api.service.collection import set_cards_in_collection
+from api.service.pool import add_card_ids_to_pool, ignore_cards_in_pool, remove_cards_from_pool
+from schemas.api.batch import BatchAddCardsToPool, BatchIgnoreCardsInPool, BatchRemoveCardsFromPool, BatchUpdateCollection, RequestBatchOperation
+
+
+async def run_batch(tx: AsyncManagedTransaction, uid: UUID, operations: list[RequestBatchOperation], catalog: CardCatalog | None = None) -> list[dict]:
+    """
+    Runs pool and collection mutations in order, in the caller's transaction, so the whole batch is applied or none of it is.
+    Cards referenced by name or id are resolved in a single `get_cards` pass. Each pool operation checks ownership
+    in its own mutation query, and a pool the user does not own raises, rolling back the operations before it
+    """
+    resolved_operations = [operation for operation in operations if isinstance(operation, (BatchUpdateCollection, BatchAddCardsToPool))]
+    card_nodes = await get_cards(tx, [card for operation in resolved_operations for card in operation.cards], catalog)
+
+    # Hand each operation back its slice of the resolved cards
+    resolved = {}
+    start = 0
+    for operation in resolved_operations:
+        resolved[id(operation)] = card_nodes[start:start + len(operation.cards)]
+        start += len(operation.cards)
+
+    results = []
+    for operation in operations:
+        if isinstance(operation, BatchUpdateCollection):
+            cards = await set_cards_in_collection(tx, uid, resolved[id(operation)])
+        elif isinstance(operation, BatchAddCardsToPool):
+            card_ids = [card["node"]["scryfall_id"] for card in resolved[id(operation)]]
+            cards = await add_card_ids_to_pool(tx, uid, operation.pool_id, card_ids)
+        elif isinstance(operation, BatchIgnoreCardsInPool):
+            cards = await ignore_cards_in_pool(tx, uid, operation.pool_id, operation.cards)
+        elif isinstance(operation, BatchRemoveCardsFromPool):
+            cards = await remove_cards_from_pool(tx, uid, operation.pool_id, operation.cards)
+        results.append({"op": operation.op, "pool_id": getattr(operation, "pool_id", None), "cards": cards})
+    return results
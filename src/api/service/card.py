@@ -1,11 +1,13 @@
 from fastapi import HTTPException
 from neo4j import AsyncManagedTransaction
+from api.card_catalog import CardCatalog
+from api.metrics import run_query
 from schemas.api.mtg_card import RequestUpdateCard, RequestUpdateCardCountResponse
 from utils.card import get_formatted_card
 
 
-async def get_cards(tx: AsyncManagedTransaction, cards: list[RequestUpdateCard]) -> list[RequestUpdateCardCountResponse]:
-    """ Returns a list of card nodes by name or id. Raise HTTPException if any card is not found """
+async def get_cards(tx: AsyncManagedTransaction, cards: list[RequestUpdateCard], catalog: CardCatalog | None = None, raise_missing: bool = True) -> list[RequestUpdateCardCountResponse]:
+    """ Returns a list of card nodes by name or id. Raise HTTPException if any card is not found, unless `raise_missing` is False, then their node is None """
 
     dump = [card.model_dump() for card in cards]
 
@@ -18,33 +20,57 @@ async def get_cards(tx: AsyncManagedTransaction, cards: list[RequestUpdateCard])
         } for card in dump
     ]
 
-    """ Returns a list of cards by name. Raise HTTPException if any card is not found """
-    query = """
-    UNWIND $cards AS card
-        MATCH (c:Card)
-            WHERE (card.scryfall_id IS NOT NULL AND c.scryfall_id = card.scryfall_id)
-            OR (card.name_front IS NOT NULL AND c.name_front = card.name_front)
-    RETURN c as node
-    """
-    response = await tx.run(query, cards=formatted_cards)
-    matching_cards = await response.data()
-    
+    # Look up ids and names in separate batches, so both are index seeks on the unique constraints
+    scryfall_ids = list({card["scryfall_id"] for card in formatted_cards if card["scryfall_id"]})
+    names = list({card["name_front"] for card in formatted_cards if card["name_front"]})
+
+    nodes_by_id = {}
+    nodes_by_name = {}
+
+    # Serve what we can from the catalog and only read the remaining cards through to the database
+    if catalog is not None:
+        nodes_by_id = {i: node for i in scryfall_ids if (node := catalog.get_by_id(i))}
+        nodes_by_name = {name: node for name in names if (node := catalog.get_by_name(name))}
+        scryfall_ids = [i for i in scryfall_ids if i not in nodes_by_id]
+        names = [name for name in names if name not in nodes_by_name]
+
+    if scryfall_ids:
+        query = """
+        UNWIND $scryfall_ids AS scryfall_id
+        MATCH (c:Card {scryfall_id: scryfall_id})
+        RETURN c as node
+        """
+        response = await run_query(tx, "get_cards_by_id", query, scryfall_ids=scryfall_ids)
+        read_through = {record["node"]["scryfall_id"]: record["node"] for record in await response.data()}
+        nodes_by_id |= read_through
+        if catalog is not None:
+            catalog.add_many(read_through.values())
+
+    if names:
+        query = """
+        UNWIND $names AS name
+        MATCH (c:Card {name_front: name})
+        RETURN c as node
+        """
+        response = await run_query(tx, "get_cards_by_name", query, names=names)
+        read_through = {record["node"]["name_front"]: record["node"] for record in await response.data()}
+        nodes_by_name |= read_through
+        if catalog is not None:
+            catalog.add_many(read_through.values())
+
     missing_cards = []
 
     for card in formatted_cards:
-        #add the card node to formatted_cards
-        node = None
-        for c in matching_cards:
-            _n = c['node']
-            if _n['scryfall_id'] == card["scryfall_id"] or _n["name_front"] == card["name_front"]:
-                node = _n
-                break
-        card["node"] = node
-
-        if not node:
+        # add the card node to formatted_cards
+        if card["scryfall_id"]:
+            card["node"] = nodes_by_id.get(card["scryfall_id"])
+        else:
+            card["node"] = nodes_by_name.get(card["name_front"])
+
+        if not card["node"]:
             missing_cards.append(card)
 
-    if missing_cards:
+    if missing_cards and raise_missing:
         raise HTTPException(status_code=404, detail={"error": "Card not found", "missing_cards": list(missing_cards)})
     
-    return formatted_cards
\ No newline at end of file
+    return formatted_cards
@@ -1,7 +1,14 @@
+from collections.abc import AsyncIterable
 from uuid import UUID
-from neo4j import AsyncManagedTransaction
-from schemas.api.mtg_card import RequestUpdateCardCount, ResponseCardInCollection
+from neo4j import AsyncManagedTransaction, AsyncSession
+from pydantic import ValidationError
+from schemas.api.mtg_card import RequestUpdateCardCount, RequestUpdateCardCountResponse, ResponseCardInCollection
+from api.card_catalog import CardCatalog
+from api.metrics import run_query
 from api.service.card import get_cards
+from utils.card import get_formatted_card
+from utils.collection_import import InvalidLine, get_line_parser
+from utils.db_processing import chunk_iterable
 
 async def get_collection(tx: AsyncManagedTransaction, uid: UUID) -> list[ResponseCardInCollection]:
     """ Returns the user's collection """
@@ -9,16 +16,24 @@ async def get_collection(tx: AsyncManagedTransaction, uid: UUID) -> list[Respons
     MATCH (u:User {uid: $uid})-[r:OWNS]->(c:Card)
     RETURN c as node, r.quantity as number_owned
     """
-    response = await tx.run(query, uid=uid)
+    response = await run_query(tx, "get_collection", query, uid=uid)
     return await response.data()
 
 
-async def update_number_of_cards_in_collection(tx: AsyncManagedTransaction, uid: UUID, cards: list[RequestUpdateCardCount]) -> list[ResponseCardInCollection]:
-    card_nodes = await get_cards(tx, cards)
-
+async def update_number_of_cards_in_collection(tx: AsyncManagedTransaction, uid: UUID, cards: list[RequestUpdateCardCount], catalog: CardCatalog | None = None) -> list[ResponseCardInCollection]:
     """ Adds or removes cards from the user's collection """
+    card_nodes = await get_cards(tx, cards, catalog)
+    return await set_cards_in_collection(tx, uid, card_nodes)
+
+
+async def set_cards_in_collection(tx: AsyncManagedTransaction, uid: UUID, card_nodes: list[RequestUpdateCardCountResponse]) -> list[ResponseCardInCollection]:
+    """ Applies the quantities of cards already resolved by `get_cards` to the user's collection """
     query = """
     MATCH (u:User {uid: $uid})
+
+    // Bump the collection version so cached suggestions for the user's pools are no longer served
+    SET u.collection_version = COALESCE(u.collection_version, 0) + 1
+    WITH u
     UNWIND $cards AS card
     MATCH (c:Card {scryfall_id: card.node.scryfall_id})
     
@@ -41,5 +56,73 @@ async def update_number_of_cards_in_collection(tx: AsyncManagedTransaction, uid:
     CASE WHEN quantity <= 0 THEN 0 ELSE r.quantity END AS number_owned
     """
 
-    response = await tx.run(query, uid=uid, cards=card_nodes)
+    response = await run_query(tx, "set_cards_in_collection", query, uid=uid, cards=card_nodes)
     return await response.data()
+
+
+async def import_cards_into_collection(tx: AsyncManagedTransaction, uid: UUID, cards: list[RequestUpdateCardCount], catalog: CardCatalog | None = None) -> dict:
+    """ Applies one chunk of an import to the user's collection. Cards that are not found are skipped and reported instead of failing the chunk """
+    card_nodes = await get_cards(tx, cards, catalog, raise_missing=False)
+
+    found = [card for card in card_nodes if card["node"]]
+    if found:
+        await set_cards_in_collection(tx, uid, found)
+    return {
+        "imported": sum(card["update_amount"] or card["number_owned"] or 0 for card in found),
+        "missing_cards": [card["scryfall_id"] or card["name_front"] for card in card_nodes if not card["node"]],
+    }
+
+
+async def import_collection(
+    session: AsyncSession,
+    uid: UUID,
+    lines: AsyncIterable[str],
+    format: str,
+    set_quantity: bool = False,
+    chunksize: int = 500,
+    catalog: CardCatalog | None = None,
+) -> dict:
+    """
+    Imports a CSV or MTGO/Arena text collection as its lines arrive, see `utils.collection_import`.
+    Quantities of the same card are summed, and every `chunksize` distinct cards are written in their own transaction.
+    When setting quantities, a card can appear anywhere in the file, so the cards are only written once it is read in full
+    """
+    parse_line = get_line_parser(format)
+    quantity_field = "number_owned" if set_quantity else "update_amount"
+    summary = {"lines": 0, "imported": 0, "chunks": 0, "missing_cards": [], "invalid_lines": []}
+    pending = {}
+
+    async def flush(entries: dict):
+        cards = []
+        for (key, value), quantity in entries.items():
+            try:
+                cards.append(RequestUpdateCardCount(**{key: value, quantity_field: quantity}))
+            except ValidationError:
+                # Not a valid Scryfall id, so there is no card to find
+                summary["missing_cards"].append(value)
+
+        if cards:
+            result = await session.execute_write(import_cards_into_collection, uid, cards, catalog)
+            summary["imported"] += result["imported"]
+            summary["missing_cards"] += result["missing_cards"]
+            summary["chunks"] += 1
+
+    async for line in lines:
+        summary["lines"] += 1
+        try:
+            entry = parse_line(line)
+        except InvalidLine:
+            summary["invalid_lines"].append(summary["lines"])
+            continue
+        if not entry:
+            continue
+
+        key = ("scryfall_id", entry["scryfall_id"].lower()) if "scryfall_id" in entry else ("name", get_formatted_card(entry["name"])[0])
+        pending[key] = pending.get(key, 0) + entry["quantity"]
+        if len(pending) >= chunksize and not set_quantity:
+            await flush(pending)
+            pending = {}
+
+    for chunk in chunk_iterable(pending.items(), chunksize):
+        await flush(dict(chunk))
+    return summary
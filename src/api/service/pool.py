@@ -1,38 +1,40 @@
 from uuid import UUID
 from fastapi import HTTPException
 from neo4j import AsyncManagedTransaction
+from api.card_catalog import CardCatalog
+from api.metrics import run_query
 from api.service.card import get_cards
 from schemas import UUID4str
 from schemas.api.mtg_card import RequestUpdateCard, RequestUpdateCardCount, ResponseCardNode
 from schemas.api.pool import RequestCreatePool
 
 
-async def check_if_user_has_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID) -> bool:
-    """ Checks if a user owns a pool """
+async def run_on_owned_pool(tx: AsyncManagedTransaction, query_name: str, uid: UUID, pool_id: UUID, subquery: str, **parameters) -> list[ResponseCardNode]:
+    """
+    Runs `subquery` on the pool only if the user owns it, checking ownership in the same query and round trip.
+    The subquery gets the pool as `p` and must return `nodes`, and its metrics are recorded under `query_name`.
+    Raises HTTPException if the user does not own the pool
+    """
+    # The OPTIONAL MATCH always yields one row, so an unowned pool is told apart from a pool with no matching cards
     query = """
-    MATCH (u:User {uid: $uid})-[:HAS]->(p:Pool {pool_id: $pool_id})
-    RETURN p
+    OPTIONAL MATCH (:User {uid: $uid})-[:HAS]->(p:Pool {pool_id: $pool_id})
+    WITH p, p IS NOT NULL AS owned
+    CALL {
+        WITH p
+        WITH p WHERE p IS NOT NULL
+    """ + subquery + """
+    }
+    RETURN owned, nodes
     """
-    response = await tx.run(query, uid=uid, pool_id=pool_id)
+    response = await run_query(tx, query_name, query, uid=uid, pool_id=pool_id, **parameters)
     data = await response.data()
 
-    if not data:
+    if not data or not data[0]["owned"]:
         raise HTTPException(status_code=401, detail="User does not own pool")
-    
+    return [{"node": node} for node in data[0]["nodes"]]
 
-async def get_pool_card_colors(tx: AsyncManagedTransaction, pool_id: UUID) -> list[str]:
-    """ Gets all the colors of the cards in a pool """
-    query = """
-    MATCH (p:Pool {pool_id: $pool_id})-[:CONTAINS]->(c:Card)
-    UNWIND c.colors AS color
-    WITH DISTINCT color
-    RETURN COLLECT(color) AS unique_colors
-    """
-    response = await tx.run(query, pool_id=pool_id)
-    data = await response.data()
-    return data[0]['unique_colors']
 
-async def create_pool(tx: AsyncManagedTransaction, uid: UUID, pool: RequestCreatePool):
+async def create_pool(tx: AsyncManagedTransaction, uid: UUID, pool: RequestCreatePool, catalog: CardCatalog | None = None):
     """ Creates a pool of cards """
     query = """
     MATCH (u:User {uid: $uid})
@@ -41,11 +43,11 @@ async def create_pool(tx: AsyncManagedTransaction, uid: UUID, pool: RequestCreat
     RETURN p
     """
 
-    response = await tx.run(query, uid=uid, pool=pool)
+    response = await run_query(tx, "create_pool", query, uid=uid, pool=pool)
     data = await response.data()
     if 'cards' in pool:
         cards = [RequestUpdateCard(**card) for card in pool['cards']]
-        await add_cards_to_pool(tx, uid, data[0]['p']['pool_id'], cards)
+        await add_cards_to_pool(tx, uid, data[0]['p']['pool_id'], cards, catalog)
     return data[0]['p']
 
 async def get_pools(tx: AsyncManagedTransaction, uid: UUID):
@@ -54,65 +56,60 @@ async def get_pools(tx: AsyncManagedTransaction, uid: UUID):
     MATCH (u:User {uid: $uid})-[:HAS]->(p:Pool)
     RETURN p
     """
-    response = await tx.run(query, uid=uid)
+    response = await run_query(tx, "get_pools", query, uid=uid)
     return await response.data()
 
 async def delete_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID):
-    await check_if_user_has_pool(tx, uid, pool_id)
-
     """ Deletes a pool of cards """
-    query = """
-    MATCH (p:Pool {pool_id: $pool_id})
+    subquery = """
     DETACH DELETE p
+    RETURN [] AS nodes
     """
-    response = await tx.run(query, uid=uid, pool_id=pool_id)
-    return await response.data()
-
-async def update_cards_in_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, card_ids: list[UUID4str], merge_query=str) -> list[ResponseCardNode]:
-    check_if_user_has_pool(tx, uid, pool_id)
-
-    query = """
-    MATCH (p:Pool {pool_id: $pool_id})
+    await run_on_owned_pool(tx, "delete_pool", uid, pool_id, subquery)
+    return []
+
+async def update_cards_in_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, card_ids: list[UUID4str], merge_query: str, query_name: str) -> list[ResponseCardNode]:
+    # Bump the pool version so cached suggestions for it are no longer served
+    subquery = """
+    SET p.version = COALESCE(p.version, 0) + 1
+    WITH p
     UNWIND $card_ids AS card_id
     MATCH (c:Card {scryfall_id: card_id})
     """
 
-    query += merge_query
+    subquery += merge_query
 
-    query += """
-    RETURN c as node
+    subquery += """
+    RETURN COLLECT(c) AS nodes
     """
 
-    response = await tx.run(query, uid=uid, pool_id=pool_id, card_ids=card_ids)
-    return await response.data()
+    return await run_on_owned_pool(tx, query_name, uid, pool_id, subquery, card_ids=card_ids)
 
-async def add_cards_to_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, cards: list[RequestUpdateCard]) -> list[ResponseCardNode] :
-    card_nodes = await get_cards(tx, cards)
+async def add_cards_to_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, cards: list[RequestUpdateCard], catalog: CardCatalog | None = None) -> list[ResponseCardNode] :
+    card_nodes = await get_cards(tx, cards, catalog)
     card_ids = [card["node"]["scryfall_id"] for card in card_nodes]
+    return await add_card_ids_to_pool(tx, uid, pool_id, card_ids)
 
+async def add_card_ids_to_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, card_ids: list[UUID4str]) -> list[ResponseCardNode]:
     merge_query = """MERGE (p)-[r:CONTAINS]->(c)"""
-    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query)
+    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query, "add_card_ids_to_pool")
 
 async def ignore_cards_in_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, card_ids: list[UUID4str]) -> list[ResponseCardNode]:
     merge_query = "MERGE (p)-[r:IGNORE]->(c)"
-    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query)
+    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query, "ignore_cards_in_pool")
     
 async def remove_cards_from_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, card_ids: list[UUID4str]) -> None:
     merge_query = """
     MATCH (p)-[r:CONTAINS]->(c) 
     DELETE r
     """
-    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query)
+    return await update_cards_in_pool(tx, uid, pool_id, card_ids, merge_query, "remove_cards_from_pool")
 
 
 async def get_cards_in_pool(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID) -> list[ResponseCardNode]:
-    await check_if_user_has_pool(tx, uid, pool_id)
-
     """ Gets all the cards in a pool """
-    query = """
-    MATCH (p:Pool {pool_id: $pool_id})-[:CONTAINS]->(c:Card)
-    RETURN c as node
+    subquery = """
+    MATCH (p)-[:CONTAINS]->(c:Card)
+    RETURN COLLECT(c) AS nodes
     """
-
-    response = await tx.run(query, uid=uid, pool_id=pool_id)
-    return await response.data()
\ No newline at end of file
+    return await run_on_owned_pool(tx, "get_cards_in_pool", uid, pool_id, subquery)
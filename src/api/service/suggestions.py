@@ -1,74 +1,260 @@
+import numpy as np
 from uuid import UUID
+from fastapi import HTTPException
 from neo4j import AsyncManagedTransaction
-from api.service.pool import check_if_user_has_pool, get_pool_card_colors
+from api.card_catalog import CardCatalog
+from api.metrics import run_query
+from api.suggestion_cache import SuggestionCache
+from api.suggestion_engine import SuggestionEngine
 from schemas.api.pool_suggestions import RequestCardSuggestions
+from utils.card import ALL_COLORS_MASK, BASIC_LANDS, get_legality_mask
 
-async def get_card_suggestions(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, params: RequestCardSuggestions):
-    await check_if_user_has_pool(tx, uid, pool_id)
-    
-    pool_colors = []
-    filter_queries = []
 
-    base_query = """
+async def get_pool_versions(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID) -> dict:
+    """ Gets the mutation versions of a pool and of its owner's collection. Raises HTTPException if the user does not own the pool """
+    query = """
+    MATCH (u:User {uid: $uid})-[:HAS]->(p:Pool {pool_id: $pool_id})
+    RETURN COALESCE(p.version, 0) AS pool_version, COALESCE(u.collection_version, 0) AS collection_version
+    """
+    response = await run_query(tx, "get_pool_versions", query, uid=uid, pool_id=pool_id)
+    data = await response.data()
+
+    if not data:
+        raise HTTPException(status_code=401, detail="User does not own pool")
+    return data[0]
+
+
+async def get_pool_card_sets(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID) -> dict:
+    """ Gets the scryfall ids of the cards in the pool, ignored by the pool and owned by the user """
+    query = """
+    MATCH (p:Pool {pool_id: $pool_id})
+    OPTIONAL MATCH (p)-[:CONTAINS]->(pc:Card)
+    WITH p, COLLECT(pc.scryfall_id) AS pool_cards
+    OPTIONAL MATCH (p)-[:IGNORE]->(ic:Card)
+    WITH pool_cards, COLLECT(ic.scryfall_id) AS ignore_cards
+    OPTIONAL MATCH (:User {uid: $uid})-[:OWNS]->(cc:Card)
+    RETURN pool_cards, ignore_cards, COLLECT(cc.scryfall_id) AS collection_cards
+    """
+    response = await run_query(tx, "get_pool_card_sets", query, uid=uid, pool_id=pool_id)
+    data = await response.data()
+    return data[0] if data else {"pool_cards": [], "ignore_cards": [], "collection_cards": []}
+
+
+# What each suggestion record returns: the full card node, or only what a card list needs to render
+SUGGESTION_PROJECTIONS = {
+    False: "c as node, sync_score",
+    True: "c.scryfall_id AS scryfall_id, c.full_name AS name, c.img_uris_normal[0] AS img_uri, sync_score",
+}
+
+# Every filter is a parameter that disables its own clause, so each projection has a single query text,
+# which Neo4j plans once and serves from its plan cache whatever filters are requested
+CYPHER_SUGGESTIONS_QUERY = """
     MATCH (p:Pool {pool_id: $pool_id})
     OPTIONAL MATCH (p:Pool) - [:CONTAINS] -> (pc:Card)
     OPTIONAL MATCH (p:Pool) - [:IGNORE] -> (ic:Card)
     OPTIONAL MATCH (u:User) - [:OWNS] -> (cc:Card)
     WHERE u.uid = $uid
-    WITH COALESCE(COLLECT(DISTINCT pc), []) AS pool_cards, 
-         COALESCE(COLLECT(DISTINCT cc), []) AS collection_cards, 
+    WITH COALESCE(COLLECT(DISTINCT pc), []) AS pool_cards,
+         COALESCE(COLLECT(DISTINCT cc), []) AS collection_cards,
          COALESCE(COLLECT(DISTINCT ic), []) AS ignore_cards
+    WITH pool_cards, collection_cards, ignore_cards,
+         REDUCE(mask = 0, pc IN pool_cards | apoc.bitwise.op(mask, '|', COALESCE(pc.color_mask, 0))) AS pool_color_mask
     MATCH (c:Card)-[r:CONNECTED]-(b:Card)
     WHERE b IN pool_cards
       AND NOT c IN pool_cards
       AND NOT c IN ignore_cards
+      AND (c IN collection_cards) = $from_collection
+      AND ($max_price IS NULL OR c.price_usd <= $max_price)
+      AND ($legality_mask = 0 OR apoc.bitwise.op(c.legality_mask, '&', $legality_mask) = $legality_mask)
+      AND NOT ($ignore_basic_lands AND c.name_front IN $basic_lands)
+      AND NOT ($preserve_colors AND apoc.bitwise.op(c.color_mask, '&', $all_colors_mask - pool_color_mask) <> 0)
+    WITH c, COALESCE(SUM(r.dynamicWeight), 0) AS sync_score
+"""
+
+CYPHER_SUGGESTIONS_QUERIES = {
+    compact: CYPHER_SUGGESTIONS_QUERY + f"""
+    RETURN {projection}
+    ORDER BY sync_score DESC
+    SKIP $offset
+    LIMIT $limit
     """
+    for compact, projection in SUGGESTION_PROJECTIONS.items()
+}
 
-    if params.from_collection:
-        filter_queries.append("AND c IN collection_cards ")
-    else:
-        filter_queries.append("AND NOT c IN collection_cards ")
+ENGINE_SUGGESTIONS_QUERIES = {
+    compact: f"""
+    UNWIND $suggestions AS suggestion
+    MATCH (c:Card {{scryfall_id: suggestion.scryfall_id}})
+    WITH c, suggestion.sync_score AS sync_score
+    RETURN {projection}
+    ORDER BY sync_score DESC
+    """
+    for compact, projection in SUGGESTION_PROJECTIONS.items()
+}
 
-    if params.filters.max_price:
-        filter_queries.append("AND c.price_usd <= $body.filters.max_price ")
+# Names the fixed query texts in the PROFILE logs and the query metrics
+QUERY_SHAPES = {
+    **{query: "cypher compact" if compact else "cypher" for compact, query in CYPHER_SUGGESTIONS_QUERIES.items()},
+    **{query: "engine compact" if compact else "engine" for compact, query in ENGINE_SUGGESTIONS_QUERIES.items()},
+}
 
-    if params.filters.legalities:
-        legality_filters = " ".join([f"AND c.legality_{legality} = True " for legality in params.filters.legalities])
-        filter_queries.append(legality_filters)
 
-    if params.filters.ignore_basic_lands:
-        filter_queries.append("AND NOT c.name_front IN ['PLAINS', 'ISLAND', 'SWAMP', 'MOUNTAIN', 'FOREST'] ")
+async def rank_engine_card_suggestions(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, params: RequestCardSuggestions, engine: SuggestionEngine) -> list[tuple[str, float]]:
+    """ Ranks the requested page of suggestions with the in-memory engine """
+    card_sets = await get_pool_card_sets(tx, uid, pool_id)
+    return engine.suggest(
+        card_sets["pool_cards"],
+        card_sets["ignore_cards"],
+        card_sets["collection_cards"],
+        params.from_collection,
+        params.filters,
+        limit=params.offset + params.limit,
+    )[params.offset:]
 
-    if params.filters.preserve_colors:
-        pool_colors = await get_pool_card_colors(tx, pool_id)
-        filter_queries.append("""
-        AND NONE(color IN c.colors WHERE NOT color IN $pool_colors)
-        """)
 
-    final_query = base_query + "".join(filter_queries) + """
-        WITH c, COALESCE(SUM(r.dynamicWeight), 0) AS sync_score
-        RETURN c as node, sync_score
-        ORDER BY sync_score DESC
-        LIMIT 200
-    """
+def get_engine_card_suggestions_query(ranked: list[tuple[str, float]], params: RequestCardSuggestions) -> tuple[str, dict]:
+    """ Returns the query that fetches the ranked cards """
+    suggestions = [{"scryfall_id": scryfall_id, "sync_score": sync_score} for scryfall_id, sync_score in ranked]
+    return ENGINE_SUGGESTIONS_QUERIES[params.compact], {"suggestions": suggestions}
+
+
+def hydrate_card_suggestions(ranked: list[tuple[str, float]], params: RequestCardSuggestions, catalog: CardCatalog) -> list[dict] | None:
+    """ Builds the suggestion records from the card catalog. Returns None if a card is missing from it """
+    result = []
+    for scryfall_id, sync_score in ranked:
+        node = catalog.get_by_id(scryfall_id)
+        if not node:
+            return None
+
+        if params.compact:
+            result.append({"scryfall_id": scryfall_id, "name": node.get("full_name"), "img_uri": (node.get("img_uris_normal") or [None])[0], "sync_score": sync_score})
+        else:
+            result.append({"node": node, "sync_score": sync_score})
+    return result
+
+
+async def get_cypher_card_suggestions_query(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, params: RequestCardSuggestions) -> tuple[str, dict]:
+    """ Returns the query that ranks suggestions with a Cypher aggregation over the CONNECTED edges of the pool """
+    filters = params.filters
+    parameters = {
+        "uid": uid,
+        "pool_id": pool_id,
+        "from_collection": params.from_collection,
+        "max_price": filters.max_price or None,
+        "legality_mask": get_legality_mask(filters.legalities),
+        "ignore_basic_lands": bool(filters.ignore_basic_lands),
+        "preserve_colors": bool(filters.preserve_colors),
+        "all_colors_mask": ALL_COLORS_MASK,
+        "basic_lands": BASIC_LANDS,
+        "offset": params.offset,
+        "limit": params.limit,
+    }
+    return CYPHER_SUGGESTIONS_QUERIES[params.compact], parameters
+
+
+async def get_card_suggestions_query(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, params: RequestCardSuggestions, engine: SuggestionEngine | None = None) -> tuple[str, dict]:
+    """ Returns the query and parameters that produce the ranked suggestions, ranking with the engine when it is loaded """
+    if engine:
+        ranked = await rank_engine_card_suggestions(tx, uid, pool_id, params, engine)
+        return get_engine_card_suggestions_query(ranked, params)
+    return await get_cypher_card_suggestions_query(tx, uid, pool_id, params)
+
+
+async def get_card_suggestions_stream_query(tx: AsyncManagedTransaction, uid: UUID, pool_id: UUID, params: RequestCardSuggestions, engine: SuggestionEngine | None = None) -> tuple[str, dict]:
+    """ Checks pool ownership and returns the suggestions query, to be streamed outside this transaction """
+    await get_pool_versions(tx, uid, pool_id)
+    return await get_card_suggestions_query(tx, uid, pool_id, params, engine)
+
+
+def get_db_hits(profile: dict) -> int:
+    """ Sums the db hits of every operator of a PROFILE plan """
+    return profile.get("dbHits", 0) + sum(get_db_hits(child) for child in profile.get("children", []))
+
+
+async def run_suggestions_query(tx: AsyncManagedTransaction, query: str, parameters: dict, profile: bool = False) -> list[dict]:
+    """ Runs a suggestions query, named by its shape. With `profile`, it runs under PROFILE and logs its db hits for regression tracking """
+    shape = QUERY_SHAPES.get(query, "unknown")
+    query_name = "suggestions " + shape
+    if not profile:
+        response = await run_query(tx, query_name, query, parameters)
+        return await response.data()
+
+    response = await run_query(tx, query_name, "PROFILE " + query, parameters)
+    data = await response.data()
+    summary = await response.consume()
+    print(f"PROFILE {shape}: {get_db_hits(summary.profile or {})} db hits, {len(data)} rows in {summary.result_available_after}ms")
+    return data
+
+
+async def get_card_suggestions(
+    tx: AsyncManagedTransaction,
+    uid: UUID,
+    pool_id: UUID,
+    params: RequestCardSuggestions,
+    engine: SuggestionEngine | None = None,
+    cache: SuggestionCache | None = None,
+    catalog: CardCatalog | None = None,
+    profile: bool = False,
+):
+    """ Gets card suggestions for a pool, served from the cache while the pool and collection are unchanged """
+    # The versions are read in the same transaction as the suggestions, so a cached result always matches them
+    versions = await get_pool_versions(tx, uid, pool_id)
+
+    if cache:
+        key = cache.key(uid, pool_id, versions, params)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    result = None
+    if engine and catalog:
+        ranked = await rank_engine_card_suggestions(tx, uid, pool_id, params, engine)
+        result = hydrate_card_suggestions(ranked, params, catalog)
+        if result is None:
+            query, parameters = get_engine_card_suggestions_query(ranked, params)
+    else:
+        query, parameters = await get_card_suggestions_query(tx, uid, pool_id, params, engine)
+
+    if result is None:
+        result = await run_suggestions_query(tx, query, parameters, profile)
+
+    if cache:
+        cache.set(key, result)
+    return result
+
 
-    response = await tx.run(final_query, uid=uid, pool_id=pool_id, body=params.model_dump(), pool_colors=pool_colors)
-    return await response.data()
+def get_average_synergy(community: dict, owned: set[str]) -> float | None:
+    """ Averages the dynamicWeight of the precomputed community edges whose cards are both owned """
+    if not community["edge_weights"]:
+        return None
+    is_owned = np.fromiter((card_id in owned for card_id in community["card_ids"]), dtype=bool, count=len(community["card_ids"]))
+    inner = is_owned[community["edge_src"]] & is_owned[community["edge_dst"]]
+    if not inner.any():
+        return None
+    return float(np.asarray(community["edge_weights"])[inner].mean())
 
 
 async def get_card_clusters_from_collection(tx: AsyncManagedTransaction, uid: UUID):
+    """ Gets the communities the user owns more than 5 cards of, ranked by the average synergy between the owned cards """
+    # The inner edges of each community are stored on it by `db_processing.create_clusters`, so no CONNECTED edge is scanned here
     query ="""
     MATCH (u:User {uid: $uid})-[:OWNS]->(card:Card)-[:BELONGS_TO]->(community:CardCommunity)
     WITH community, collect(card) as communityCards
     WHERE size(communityCards) > 5
-    MATCH (c1:Card)-[r:CONNECTED]->(c2:Card)
-    WHERE c1 IN communityCards AND c2 IN communityCards
-    RETURN 
+    RETURN
         community.id as community_id,
         communityCards as nodes,
-        avg(r.dynamicWeight) as average_synergy
-    ORDER BY average_synergy DESC;
+        COALESCE(community.card_ids, []) as card_ids,
+        COALESCE(community.edge_src, []) as edge_src,
+        COALESCE(community.edge_dst, []) as edge_dst,
+        COALESCE(community.edge_weights, []) as edge_weights
     """
 
-    response = await tx.run(query, uid=uid)
-    return await response.data()
+    response = await run_query(tx, "get_card_clusters_from_collection", query, uid=uid)
+    result = []
+    for community in await response.data():
+        owned = {node["scryfall_id"] for node in community["nodes"]}
+        average_synergy = get_average_synergy(community, owned)
+        if average_synergy is not None:
+            result.append({"community_id": community["community_id"], "nodes": community["nodes"], "average_synergy": average_synergy})
+    return sorted(result, key=lambda community: community["average_synergy"], reverse=True)
@@ -1,5 +1,6 @@
 from uuid import UUID
 from neo4j import AsyncManagedTransaction
+from api.metrics import run_query
 
 async def add_user(tx: AsyncManagedTransaction, uid: UUID):
     """ Adds a user to the database if they do not already exist """
@@ -9,5 +10,5 @@ async def add_user(tx: AsyncManagedTransaction, uid: UUID):
     ON CREATE SET u.created_at = datetime()
     RETURN u
     """
-    response = await tx.run(query, uid=uid)
+    response = await run_query(tx, "add_user", query, uid=uid)
     return await response.data()
\ No newline at end of file
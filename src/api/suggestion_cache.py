@@ -0,0 +1,60 @@
+from cachetools import TTLCache
+from fastapi import Request
+from schemas.api.pool_suggestions import RequestCardSuggestions
+
+
+class SuggestionCache:
+    """
+    TTL + LRU cache of suggestion results.
+
+    Entries are keyed by the pool's and the owner's mutation versions, which every write bumps inside its
+    own transaction, so a result computed before a mutation can never be served after it. Routers also
+    invalidate entries after a write to free them early.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(uid: str, pool_id: str, versions: dict, params: RequestCardSuggestions) -> tuple:
+        return (uid, pool_id, versions["pool_version"], versions["collection_version"], params.model_dump_json())
+
+    def get(self, key: tuple) -> list | None:
+        result = self._cache.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, key: tuple, result: list) -> None:
+        self._cache[key] = result
+
+    def _invalidate(self, position: int, value: str) -> None:
+        for key in [key for key in self._cache.keys() if key[position] == value]:
+            self._cache.pop(key, None)
+            self.invalidations += 1
+
+    def invalidate_pool(self, pool_id: str) -> None:
+        """ Drops the cached suggestions of a pool """
+        self._invalidate(1, pool_id)
+
+    def invalidate_user(self, uid: str) -> None:
+        """ Drops the cached suggestions of every pool owned by a user """
+        self._invalidate(0, uid)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": self._cache.currsize,
+            "maxsize": self._cache.maxsize,
+        }
+
+
+def get_suggestion_cache(request: Request) -> SuggestionCache:
+    return request.app.suggestion_cache
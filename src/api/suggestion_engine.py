@@ -0,0 +1,196 @@
+import asyncio
+from typing import NamedTuple
+import numpy as np
+from fastapi import Request
+from neo4j import AsyncDriver
+from codetiming import Timer
+from schemas.api.pool_suggestions import CardFilters
+from utils.card import BASIC_LANDS, get_legality_mask
+
+
+class SuggestionGraph(NamedTuple):
+    """ One consistent version of the engine's arrays. It is never modified once published """
+    ids: list[str]
+    index: dict[str, int]
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+    price: np.ndarray
+    is_basic_land: np.ndarray
+    colors: np.ndarray
+    legalities: np.ndarray
+    version: tuple | None = None
+
+
+# The ingest markers of everything the engine copies: the cards, the decklist edges and their dynamicWeights
+SOURCE_MARKERS = ["cards", "decklists", "relationships"]
+
+
+class SuggestionEngine:
+    """
+    In-memory copy of the CONNECTED graph used to rank card suggestions.
+
+    The adjacency is stored in CSR form: the neighbors of card `i` are `indices[indptr[i]:indptr[i + 1]]`
+    with the matching `dynamicWeight`s in `weights`. Every edge is stored in both directions.
+
+    Like the card catalog, the arrays are built in a worker thread and published on the event loop as a single
+    `SuggestionGraph`, and `refresh` rebuilds them when one of the ingest markers changes.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._graph: SuggestionGraph | None = None
+
+    @property
+    def version(self) -> tuple | None:
+        return self._graph.version if self._graph else None
+
+    @staticmethod
+    def build_graph(cards: list[dict], edges: list[tuple[str, str, float | None]], version: tuple | None = None) -> SuggestionGraph:
+        """ Builds the arrays from card records and (scryfall_id, scryfall_id, dynamicWeight) edges, without publishing them """
+        ids = [card["scryfall_id"] for card in cards]
+        index = {scryfall_id: i for i, scryfall_id in enumerate(ids)}
+        n = len(ids)
+
+        price = np.array([card["price_usd"] if card["price_usd"] is not None else np.nan for card in cards], dtype=np.float64)
+        is_basic_land = np.array([card["name_front"] in BASIC_LANDS for card in cards], dtype=bool)
+        colors = np.array([card["color_mask"] for card in cards], dtype=np.uint8)
+        legalities = np.array([card["legality_mask"] for card in cards], dtype=np.uint32)
+
+        edges = [(index[a], index[b], weight or 0.0) for a, b, weight in edges if a in index and b in index]
+        src = np.array([edge[0] for edge in edges], dtype=np.int32)
+        dst = np.array([edge[1] for edge in edges], dtype=np.int32)
+        weight = np.array([edge[2] for edge in edges], dtype=np.float32)
+
+        # Store each undirected edge in both directions, sorted by source card
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+        weight = np.concatenate([weight, weight])
+        order = np.argsort(src, kind="stable")
+
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))]).astype(np.int64)
+        return SuggestionGraph(ids, index, indptr, dst[order], weight[order], price, is_basic_land, colors, legalities, version)
+
+    def publish(self, graph: SuggestionGraph) -> None:
+        self._graph = graph
+        self.ready = True
+
+    def build(self, cards: list[dict], edges: list[tuple[str, str, float | None]], version: tuple | None = None) -> None:
+        """ Replaces the engine's arrays with ones built from card records and edges """
+        self.publish(self.build_graph(cards, edges, version))
+
+    async def get_version(self, driver: AsyncDriver) -> tuple:
+        query = """
+        UNWIND $names AS name
+        OPTIONAL MATCH (v:IngestVersion {name: name})
+        RETURN v.version AS version
+        """
+        async with driver.session(database="neo4j") as session:
+            result = await session.run(query, names=SOURCE_MARKERS)
+            return tuple(record["version"] for record in await result.data())
+
+    async def load(self, driver: AsyncDriver, version: tuple | None = None) -> None:
+        """ Loads every card and CONNECTED edge from Neo4j """
+        cards_query = """
+        MATCH (c:Card)
+        RETURN c.scryfall_id AS scryfall_id, c.name_front AS name_front, c.price_usd AS price_usd,
+            COALESCE(c.color_mask, 0) AS color_mask, COALESCE(c.legality_mask, 0) AS legality_mask
+        """
+        edges_query = """
+        MATCH (a:Card)-[r:CONNECTED]->(b:Card)
+        RETURN a.scryfall_id AS a, b.scryfall_id AS b, r.dynamicWeight AS weight
+        """
+        with Timer(name="suggestion engine load", text="Loaded suggestion engine in {:.2f}s"):
+            async with driver.session(database="neo4j") as session:
+                result = await session.run(cards_query)
+                cards = await result.data()
+
+                result = await session.run(edges_query)
+                edges = [(record["a"], record["b"], record["weight"]) async for record in result]
+
+            # Building the CSR arrays is CPU bound, keep it off the event loop. Publishing stays on it
+            graph = await asyncio.to_thread(self.build_graph, cards, edges, version)
+            self.publish(graph)
+
+    async def refresh(self, driver: AsyncDriver) -> None:
+        """ Reloads the engine if it was never loaded or the cards, edges or weights changed since """
+        version = await self.get_version(driver)
+        if not self.ready or version != self.version:
+            await self.load(driver, version)
+
+    @staticmethod
+    def _rows(graph: SuggestionGraph, scryfall_ids: list[str]) -> np.ndarray:
+        return np.array([graph.index[i] for i in scryfall_ids if i in graph.index], dtype=np.int64)
+
+    def suggest(
+        self,
+        pool_cards: list[str],
+        ignore_cards: list[str],
+        collection_cards: list[str],
+        from_collection: bool,
+        filters: CardFilters,
+        limit: int = 200,
+    ) -> list[tuple[str, float]]:
+        """ Returns up to `limit` (scryfall_id, sync_score) pairs, ranked by the summed weight of their edges into the pool """
+        # Read the published arrays once, a refresh may replace them while this ranks
+        graph = self._graph
+        pool_rows = self._rows(graph, pool_cards)
+        if len(pool_rows) < len(pool_cards):
+            # Cards ingested since the last refresh have no edges in the engine yet
+            print(f"Suggestion engine does not know {len(pool_cards) - len(pool_rows)} of {len(pool_cards)} pool cards")
+        if not pool_rows.size:
+            return []
+
+        # Gather the neighbor slices of every pool card in one go
+        starts = graph.indptr[pool_rows]
+        lengths = graph.indptr[pool_rows + 1] - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        neighbors = graph.indices[positions]
+        neighbor_weights = graph.weights[positions]
+
+        n = len(graph.ids)
+        scores = np.bincount(neighbors, weights=neighbor_weights, minlength=n)
+        candidates = np.bincount(neighbors, minlength=n) > 0
+
+        candidates[pool_rows] = False
+        candidates[self._rows(graph, ignore_cards)] = False
+
+        in_collection = np.zeros(n, dtype=bool)
+        in_collection[self._rows(graph, collection_cards)] = True
+        candidates &= in_collection if from_collection else ~in_collection
+
+        if filters.max_price:
+            candidates &= graph.price <= filters.max_price
+
+        if filters.legalities:
+            legality_mask = get_legality_mask(filters.legalities)
+            candidates &= (graph.legalities & legality_mask) == legality_mask
+
+        if filters.ignore_basic_lands:
+            candidates &= ~graph.is_basic_land
+
+        if filters.preserve_colors:
+            pool_colors = np.bitwise_or.reduce(graph.colors[pool_rows])
+            candidates &= (graph.colors & ~pool_colors) == 0
+
+        rows = np.flatnonzero(candidates)
+        if rows.size > limit:
+            rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+
+        return [(graph.ids[row], float(scores[row])) for row in rows]
+
+
+async def refresh_suggestion_engine(engine: SuggestionEngine, driver: AsyncDriver, interval: float) -> None:
+    """ Keeps the engine in sync with the ingest markers. Suggestions use the Cypher query until it is first loaded """
+    while True:
+        try:
+            await engine.refresh(driver)
+        except Exception as e:
+            print(f"{e}: Failed to refresh suggestion engine")
+        await asyncio.sleep(interval)
+
+
+def get_suggestion_engine(request: Request) -> SuggestionEngine | None:
+    """ Returns the engine once it has finished loading, otherwise None """
+    engine = getattr(request.app, "engine", None)
+    return engine if engine and engine.ready else None
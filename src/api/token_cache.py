@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import time
+from collections.abc import Callable
+from cachetools import TLRUCache
+from fastapi import Request
+from firebase_admin import auth
+from google.oauth2 import id_token
+
+try:
+    from firebase_admin._token_gen import ID_TOKEN_CERT_URI
+except ImportError:
+    ID_TOKEN_CERT_URI = None
+
+
+def fetch_firebase_keys() -> dict | None:
+    """
+    Fetches the public keys Firebase ID tokens are signed with, through the HTTP cache of the token verifier.
+
+    That cache keeps the keys until the max-age Google serves them with, so a fetch only reaches Google once they
+    expired. Polling on an interval takes most of those refetches off the request path, but a token verified between
+    the expiry and the next poll still waits on the fetch.
+
+    The verifier's HTTP session is only reachable through private firebase_admin APIs. When they are not available,
+    nothing is fetched and `auth.verify_id_token` fetches the keys itself as usual. Returns None in that case
+    """
+    try:
+        request = auth._get_client(None)._token_verifier.request
+        fetch_certs = id_token._fetch_certs
+    except AttributeError as e:
+        print(f"{e}: Cannot reach the token verifier, signing keys are fetched on verification")
+        return None
+    if ID_TOKEN_CERT_URI is None:
+        print("No ID token certificate URI in firebase_admin, signing keys are fetched on verification")
+        return None
+    return fetch_certs(request, ID_TOKEN_CERT_URI)
+
+
+class TokenCache:
+    """
+    LRU cache of verified ID token claims, keyed by the sha256 of the token so tokens are never kept in memory.
+
+    An entry expires with the `exp` claim of its token, or after `max_ttl` seconds if that comes first,
+    so a token is never accepted longer than its signature allows. Failed verifications are not cached.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        max_ttl: float,
+        verify: Callable[[str], dict] = auth.verify_id_token,
+        fetch_keys: Callable[[], dict] = fetch_firebase_keys,
+        timer: Callable[[], float] = time.time,
+    ):
+        self._verify = verify
+        self._fetch_keys = fetch_keys
+        self.max_ttl = max_ttl
+        # `exp` is a unix timestamp, so entries expire on wall clock time rather than the default monotonic timer
+        self._cache = TLRUCache(maxsize=maxsize, ttu=self._ttu, timer=timer)
+        self.hits = 0
+        self.misses = 0
+        self.key_fetches = 0
+
+    def _ttu(self, key: str, claims: dict, now: float) -> float:
+        return min(claims["exp"], now + self.max_ttl)
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        claims = self._cache.get(self.key(token))
+        if claims is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return claims
+
+    def verify(self, token: str) -> dict:
+        """ Verifies the signature and claims of a token, then caches its claims. Raises like `auth.verify_id_token` """
+        claims = self._verify(token)
+        self._cache[self.key(token)] = claims
+        return claims
+
+    async def get_user(self, token: str) -> dict:
+        """ Returns the claims of a token, verifying it in the threadpool only when it is not cached """
+        claims = self.get(token)
+        if claims is None:
+            claims = await asyncio.to_thread(self.verify, token)
+        return claims
+
+    async def prefetch_keys(self) -> None:
+        if await asyncio.to_thread(self._fetch_keys) is not None:
+            self.key_fetches += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "key_fetches": self.key_fetches,
+            "size": self._cache.currsize,
+            "maxsize": self._cache.maxsize,
+        }
+
+
+async def refresh_token_keys(cache: TokenCache, interval: float) -> None:
+    """ Polls the token signing keys, so they are usually refetched before a token verification needs them """
+    while True:
+        try:
+            await cache.prefetch_keys()
+        except Exception as e:
+            print(f"{e}: Failed to fetch token signing keys")
+        await asyncio.sleep(interval)
+
+
+def get_token_cache(request: Request) -> TokenCache:
+    return request.app.token_cache
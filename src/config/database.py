@@ -0,0 +1,48 @@
+import json
+from collections.abc import AsyncGenerator
+from fastapi import Request
+from neo4j import AsyncDriver, AsyncGraphDatabase, AsyncSession
+from config.settings import Settings
+from api.metrics import InstrumentedSession
+from utils.schema import apply_schema
+
+
+def create_driver(settings: Settings) -> AsyncDriver:
+    """Creates the Neo4j driver and its connection pool, shared by every request."""
+    return AsyncGraphDatabase.driver(
+        f"bolt://{settings.SERVER_HOST}:7687",
+        auth=(settings.NEO4J_USER, settings.NEO4J_PASSWORD),
+        max_connection_pool_size=settings.NEO4J_MAX_CONNECTION_POOL_SIZE,
+        connection_acquisition_timeout=settings.NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+        max_connection_lifetime=settings.NEO4J_MAX_CONNECTION_LIFETIME,
+    )
+
+
+async def create_schema(driver: AsyncDriver) -> None:
+    """Applies the constraints and indexes of `utils.schema`, which make the API's anchor lookups index seeks rather than label scans."""
+    try:
+        await apply_schema(driver)
+    except Exception as e:
+        print(f"{e}: Failed to apply schema")
+
+
+async def get_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """Opens a short-lived session for a single request. Sessions are not safe for concurrent use."""
+    async with request.app.driver.session(database="neo4j") as session:
+        # Only wrap the session when metrics are enabled, so they cost nothing otherwise
+        yield InstrumentedSession(session, request.app.metrics) if request.app.metrics.enabled else session
+
+
+def get_driver(request: Request) -> AsyncDriver:
+    return request.app.driver
+
+
+async def stream_ndjson(driver: AsyncDriver, query: str, parameters: dict) -> AsyncGenerator[str, None]:
+    """
+    Runs a read query in its own session and yields each record as a line of JSON as soon as the driver receives it.
+    Request sessions are closed before a streaming response is sent, so the stream cannot use them.
+    """
+    async with driver.session(database="neo4j", default_access_mode="READ") as session:
+        result = await session.run(query, parameters)
+        async for record in result:
+            yield json.dumps(record.data(), default=str) + "\n"
@@ -3,7 +3,7 @@ from functools import lru_cache
 from typing import Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth
+from api.token_cache import TokenCache, get_token_cache
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -20,6 +20,34 @@ class Settings(BaseSettings):
     FRONTEND_URL: str
     ALLOW_ORIGINS: str
 
+    # Neo4j driver connection pool
+    NEO4J_MAX_CONNECTION_POOL_SIZE: int = 100
+    NEO4J_CONNECTION_ACQUISITION_TIMEOUT: float = 60.0
+    NEO4J_MAX_CONNECTION_LIFETIME: float = 3600.0
+
+    # Rank suggestions in-process instead of with a Cypher aggregation, reloaded when an ingest version marker changes
+    SUGGESTION_ENGINE_ENABLED: bool = True
+    SUGGESTION_ENGINE_REFRESH_SECONDS: float = 300.0
+
+    # Suggestion result cache
+    SUGGESTION_CACHE_SIZE: int = 1024
+    SUGGESTION_CACHE_TTL: float = 300.0
+
+    # Run suggestion queries under PROFILE and log their db hits
+    SUGGESTION_PROFILE_ENABLED: bool = False
+
+    # In-process card catalog, reloaded when the ingest version marker changes
+    CARD_CATALOG_ENABLED: bool = True
+    CARD_CATALOG_REFRESH_SECONDS: float = 300.0
+
+    # Verified ID token cache. Entries never outlive the token's exp claim
+    TOKEN_CACHE_SIZE: int = 10_000
+    TOKEN_CACHE_TTL: float = 600.0
+    TOKEN_KEYS_REFRESH_SECONDS: float = 3600.0
+
+    # Request latency and Neo4j query metrics, served at /metrics
+    METRICS_ENABLED: bool = False
+
 @lru_cache()
 def get_settings() -> Settings:
     # Use lru_cache to avoid loading .env file for every request
@@ -27,17 +55,18 @@ def get_settings() -> Settings:
 
 
 bearer_scheme = HTTPBearer(auto_error=False)
-def get_firebase_user_from_token(
-    token: Annotated[HTTPAuthorizationCredentials | None, Depends(bearer_scheme)]
+async def get_firebase_user_from_token(
+    token: Annotated[HTTPAuthorizationCredentials | None, Depends(bearer_scheme)],
+    cache: Annotated[TokenCache, Depends(get_token_cache)],
 ) -> dict | None:
-    """Uses bearer token to identify Firebase user ID."""
+    """Uses bearer token to identify Firebase user ID. Tokens verified before are served from the cache without leaving the event loop."""
 
     try:
         if not token:
             raise ValueError("No token")
 
         # ✅ Check if credentials are loaded
-        user = auth.verify_id_token(token.credentials)
+        user = await cache.get_user(token.credentials)
         return user
 
     except Exception as e:
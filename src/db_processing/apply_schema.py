@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+from neo4j import AsyncGraphDatabase
+from utils.db_processing import get_settings
+from utils.schema import SCHEMA_VERSION, apply_schema, check_label_scans
+
+
+async def main(force: bool, check: bool) -> None:
+    async with AsyncGraphDatabase.driver(URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+        if not await apply_schema(driver, force):
+            print(f"Schema is already at version {SCHEMA_VERSION}")
+
+        if check:
+            flagged = await check_label_scans(driver)
+            for name, scans in flagged.items():
+                print(f"{name}: {', '.join(scans)}")
+            print(f"{len(flagged)} queries would fall back to label scans")
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser("Create the constraints and indexes the API and the ingest scripts rely on")
+    parser.add_argument("--force", action="store_true", help="Run every schema statement even if the database is already at the current schema version")
+    parser.add_argument("--check", action="store_true", help="EXPLAIN the anchor lookups of the API and report the ones planned as label scans")
+    args = vars(parser.parse_args())
+    # fmt: on
+
+    # # Neo4j
+    settings = get_settings()
+    URI = f"bolt://{settings.SERVER_HOST}:7687"
+    NEO4J_USER = settings.NEO4J_USER
+    NEO4J_PASSWORD = settings.NEO4J_PASSWORD
+
+    asyncio.run(main(args["force"], args["check"]))
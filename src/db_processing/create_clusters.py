@@ -1,6 +1,11 @@
 
-from utils.db_processing import get_settings
-from neo4j import GraphDatabase, ManagedTransaction
+import argparse
+import numpy as np
+from utils.db_processing import chunk_iterable, get_settings
+from utils.louvain import build_csr, louvain, modularity
+from utils.schema import apply_schema_sync
+from neo4j import Driver, GraphDatabase, ManagedTransaction, Session
+from codetiming import Timer
 
 
 def clear_clusters(tx: ManagedTransaction):
@@ -70,7 +75,183 @@ def handle_clusters(tx: ManagedTransaction):
 
 
 
+# --- Offline backend, without the GDS plugin ---
+
+
+def export_graph(session: Session) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """ Exports every CONNECTED edge once, returning the card ids and the (src, dst, dynamicWeight) arrays indexing them """
+    query = """
+    MATCH (a:Card)-[r:CONNECTED]->(b:Card)
+    RETURN a.scryfall_id AS a, b.scryfall_id AS b, r.dynamicWeight AS weight
+    """
+    index = {}
+    src, dst, weights = [], [], []
+    for record in session.run(query):
+        src.append(index.setdefault(record["a"], len(index)))
+        dst.append(index.setdefault(record["b"], len(index)))
+        weights.append(record["weight"] or 0.0)
+    return list(index), np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64), np.array(weights, dtype=np.float64)
+
+
+def clear_communities(session: Session):
+    """ Deletes the previous communities in batches of their own transactions """
+    for query in [
+        "MATCH (c:CardCommunity) CALL { WITH c DETACH DELETE c } IN TRANSACTIONS OF 10000 ROWS",
+        "MATCH (c:Card) WHERE c.communityId IS NOT NULL CALL { WITH c REMOVE c.communityId } IN TRANSACTIONS OF 10000 ROWS",
+    ]:
+        session.run(query).consume()
+
+
+def write_communities(tx: ManagedTransaction, community_ids: list[int]):
+    query = """
+    UNWIND $community_ids AS community_id
+    CREATE (:CardCommunity {id: community_id})
+    """
+    tx.run(query, community_ids=community_ids).consume()
+
+
+def write_memberships(tx: ManagedTransaction, cards: list[list]):
+    """ Writes the communityId and BELONGS_TO edge of each [scryfall_id, community_id] pair """
+    query = """
+    UNWIND $cards AS card
+    MATCH (c:Card {scryfall_id: card[0]})
+    MATCH (community:CardCommunity {id: card[1]})
+    SET c.communityId = card[1]
+    CREATE (c)-[:BELONGS_TO]->(community)
+    """
+    tx.run(query, cards=cards).consume()
+
+
+# Each community carries its edge lists, so only a few of them are written per transaction
+COMMUNITY_EDGES_BATCH_SIZE = 100
+
+
+def get_community_edges(ids: list[str], src: np.ndarray, dst: np.ndarray, weights: np.ndarray, labels: np.ndarray) -> list[dict]:
+    """
+    Groups the edges inside each community labeled 0 to k - 1. Every community gets its `label`, its member `card_ids`,
+    and its edges as positions into them in `edge_src` and `edge_dst` with the matching `edge_weights`.
+    Communities without inner edges are skipped
+    """
+    n = len(ids)
+    k = int(labels.max()) + 1 if n else 0
+    # Position of each card within its community
+    members = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=k))]).astype(np.int64)
+    local = np.empty(n, dtype=np.int64)
+    local[members] = np.arange(n) - starts[labels[members]]
+
+    inner = labels[src] == labels[dst]
+    src, dst, weights = src[inner], dst[inner], weights[inner]
+    order = np.argsort(labels[src], kind="stable")
+    src, dst, weights = src[order], dst[order], weights[order]
+    edge_starts = np.concatenate([[0], np.cumsum(np.bincount(labels[src], minlength=k))]).astype(np.int64)
+
+    communities = []
+    for label in range(k):
+        edges = slice(edge_starts[label], edge_starts[label + 1])
+        if edges.start == edges.stop:
+            continue
+        communities.append({
+            "label": label,
+            "card_ids": [ids[i] for i in members[starts[label]:starts[label + 1]]],
+            "edge_src": local[src[edges]].tolist(),
+            "edge_dst": local[dst[edges]].tolist(),
+            "edge_weights": weights[edges].tolist(),
+        })
+    return communities
+
+
+def write_community_edges(tx: ManagedTransaction, communities: list[dict]):
+    """ Stores the inner edges of each community on its node, for `api.service.suggestions.get_card_clusters_from_collection` """
+    query = """
+    UNWIND $communities AS community
+    MATCH (c:CardCommunity {id: community.id})
+    SET c.card_ids = community.card_ids,
+        c.edge_src = community.edge_src,
+        c.edge_dst = community.edge_dst,
+        c.edge_weights = community.edge_weights
+    """
+    tx.run(query, communities=communities).consume()
+
+
+def export_memberships(session: Session) -> dict:
+    query = """
+    MATCH (c:Card)-[:BELONGS_TO]->(community:CardCommunity)
+    RETURN c.scryfall_id AS scryfall_id, community.id AS community_id
+    """
+    return {record["scryfall_id"]: record["community_id"] for record in session.run(query)}
+
+
+def _hashable(community_id):
+    return tuple(community_id) if isinstance(community_id, list) else community_id
+
+
+def precompute_community_edges(driver: Driver) -> int:
+    """ Stores the inner edges of the communities already written to the graph, e.g. by the GDS backend """
+    with driver.session(database="neo4j") as session:
+        ids, src, dst, weights = export_graph(session)
+        memberships = export_memberships(session)
+
+        # GDS writes intermediate communities as lists, which are not hashable. Cards without a community share the None label
+        index = {}
+        labels = np.array([index.setdefault(_hashable(memberships.get(scryfall_id)), len(index)) for scryfall_id in ids], dtype=np.int64)
+        community_ids = [list(key) if isinstance(key, tuple) else key for key in index]
+
+        communities = get_community_edges(ids, src, dst, weights, labels)
+        for community in communities:
+            community["id"] = community_ids[community.pop("label")]
+        communities = [community for community in communities if community["id"] is not None]
+
+        for batch in chunk_iterable(communities, COMMUNITY_EDGES_BATCH_SIZE):
+            session.execute_write(write_community_edges, batch)
+    return len(communities)
+
+
+def create_clusters_offline(driver: Driver, batch_size: int = 10_000, resolution: float = 1.0) -> dict:
+    """ Runs Louvain in-process on the exported CONNECTED graph and writes the communities back in batches """
+    with driver.session(database="neo4j") as session:
+        with Timer(name="export graph", text="Exported graph in {:.2f}s"):
+            ids, src, dst, weights = export_graph(session)
+        print(f"Exported {len(ids)} cards and {len(weights)} edges")
+
+        with Timer(name="louvain", text="Ran Louvain in {:.2f}s"):
+            indptr, indices, csr_weights = build_csr(len(ids), src, dst, weights)
+            labels = louvain(indptr, indices, csr_weights, resolution=resolution)
+        stats = {
+            "cards": len(ids),
+            "communities": int(labels.max()) + 1 if len(ids) else 0,
+            "modularity": modularity(indptr, indices, csr_weights, labels, resolution) if len(ids) else 0.0,
+        }
+        print(f"Found {stats['communities']} communities, modularity {stats['modularity']:.4f}")
+
+        with Timer(name="write communities", text="Wrote communities in {:.2f}s"):
+            clear_communities(session)
+            for batch in chunk_iterable(range(stats["communities"]), batch_size):
+                session.execute_write(write_communities, batch)
+            cards = ([scryfall_id, int(label)] for scryfall_id, label in zip(ids, labels))
+            for idx, batch in enumerate(chunk_iterable(cards, batch_size)):
+                session.execute_write(write_memberships, batch)
+                print(f"Wrote memberships of batch #{idx + 1}")
+
+        with Timer(name="write community edges", text="Wrote community edges in {:.2f}s"):
+            communities = get_community_edges(ids, src, dst, weights, labels)
+            for community in communities:
+                community["id"] = community.pop("label")
+            for batch in chunk_iterable(communities, COMMUNITY_EDGES_BATCH_SIZE):
+                session.execute_write(write_community_edges, batch)
+
+    return stats
+
+
 if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser("Cluster cards into communities with the Louvain algorithm")
+    parser.add_argument("--backend", choices=["gds", "offline"], default="gds", help="Run Louvain with the Neo4j GDS plugin, or in-process on an export of the graph")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Number of cards written per transaction by the offline backend")
+    parser.add_argument("--resolution", type=float, default=1.0, help="Louvain resolution of the offline backend. Higher values find smaller communities")
+    args = vars(parser.parse_args())
+    # fmt: on
+
     # # Neo4j
     settings = get_settings()
     URI = f"bolt://{settings.SERVER_HOST}:7687"
@@ -79,5 +260,10 @@ if __name__ == "__main__":
 
     
     with GraphDatabase.driver(URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
-        with driver.session(database="neo4j") as session:
-            session.execute_write(handle_clusters)
\ No newline at end of file
+        apply_schema_sync(driver)
+        if args["backend"] == "offline":
+            create_clusters_offline(driver, args["batch_size"], args["resolution"])
+        else:
+            with driver.session(database="neo4j") as session:
+                session.execute_write(handle_clusters)
+            precompute_community_edges(driver)
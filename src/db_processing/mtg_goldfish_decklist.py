@@ -1,84 +1,312 @@
 import asyncio
 import argparse
+import hashlib
 import json
-from utils.db_processing import chunk_iterable, get_settings
-from neo4j import AsyncGraphDatabase, AsyncManagedTransaction, AsyncSession
+import math
+import os
+import sys
+import time
+from collections import Counter
+from itertools import combinations
+from typing import Iterable, Iterator
+from utils.db_processing import chunk_iterable, get_settings, write_chunks
+from utils.admin_import import get_column, read_csv, write_csv
+from utils.schema import apply_schema
+from neo4j import AsyncDriver, AsyncGraphDatabase, AsyncManagedTransaction, AsyncSession
 from codetiming import Timer
 
 from utils.card import get_formatted_card
 
 
-def load_data(file_name: str) -> list:
+def load_data(file_name: str) -> dict[str, list[str]]:
+    """ Loads the decklists of a scraped file, keyed by "<category>/<deck>" """
     base_url = "data/mtg_goldfish/"
     with open(base_url + file_name, "r") as f:
         data = json.load(f)
 
-    decks = []
+    decks = {}
     for category in data:
         for deck in data[category]:
             cards = data[category][deck]
             cards = [get_formatted_card(card[1])[0] for card in cards]
-            decks.append(cards)
+            decks[f"{category}/{deck}"] = cards
     
     return decks
 
-# Modified to take multiple relationships in a single transaction
+
+async def resolve_card_names(tx: AsyncManagedTransaction, names: list[str]) -> dict[str, str]:
+    """ Maps decklist card names to the scryfall_id of their card, using the unique name_front index """
+    # Decklist names are formatted like name_front, so they never need to be matched against full_name
+    query = """
+    UNWIND $names AS name
+    MATCH (c:Card {name_front: name})
+    RETURN name, c.scryfall_id AS scryfall_id
+    """
+    response = await tx.run(query, names=names)
+    return {record["name"]: record["scryfall_id"] for record in await response.data()}
+
+
+async def get_decks(tx: AsyncManagedTransaction, source: str) -> dict[str, dict]:
+    """ Gets the decks recorded by the previous ingest of a source """
+    query = """
+    MATCH (d:Deck {source: $source})
+    RETURN d.key AS key, d.hash AS hash, d.cards AS cards
+    """
+    response = await tx.run(query, source=source)
+    return {record["key"]: record for record in await response.data()}
+
+
+async def update_decks(tx: AsyncManagedTransaction, source: str, added: list[dict], removed: list[dict]):
+    query = """
+    UNWIND $removed AS deck
+    MATCH (d:Deck {source: $source, key: deck.key})
+    DELETE d
+    """
+    await tx.run(query, source=source, removed=removed)
+
+    query = """
+    UNWIND $added AS deck
+    MERGE (d:Deck {source: $source, key: deck.key})
+    SET d.hash = deck.hash, d.cards = deck.cards
+    """
+    await tx.run(query, source=source, added=added)
+
+
+async def get_decklist_state(tx: AsyncManagedTransaction) -> dict:
+    """ Gets whether any CONNECTED edge exists, and whether the last ingest recorded its decks (None if no ingest did) """
+    query = """
+    OPTIONAL MATCH (v:IngestVersion {name: 'decklists'})
+    RETURN v.complete AS complete, EXISTS { MATCH ()-[:CONNECTED]->() } AS has_edges
+    """
+    response = await tx.run(query)
+    return (await response.data())[0]
+
+
+async def set_decklist_state(tx: AsyncManagedTransaction, complete: bool):
+    """ Marks the edges as matching the recorded decks, or as being written without them """
+    query = """
+    MERGE (v:IngestVersion {name: 'decklists'})
+    SET v.complete = $complete, v.version = timestamp()
+    """
+    await tx.run(query, complete=complete)
+
+
 async def create_or_update_relationships(tx: AsyncManagedTransaction, pairs: list):
+    """
+    Adds the (scryfall_id_a, scryfall_id_b, delta) pairs to the sync of their CONNECTED edges.
+    Edges left without any deck are deleted, and both cards of every pair are labeled Dirty for `set_relationships`
+    """
+    # Pairs are in canonical order, so the directed MERGE finds the edge written by an earlier run instead of creating a second one.
+    # Edges written by the undirected MERGE of older ingests point either way, `ingest_data` rebuilds them before merging onto them
     query = """
     UNWIND $pairs AS pair
-    MATCH (a:Card), (b:Card)
-    WHERE (a.name_front = pair[0] OR a.full_name = pair[0])
-        AND (b.name_front = pair[1] OR b.full_name = pair[1])
-    MERGE (a)-[r:CONNECTED]-(b)
-    ON CREATE SET r.sync = 1
-    ON MATCH SET r.sync = r.sync + 1
+    MATCH (a:Card {scryfall_id: pair[0]})
+    MATCH (b:Card {scryfall_id: pair[1]})
+    MERGE (a)-[r:CONNECTED]->(b)
+    ON CREATE SET r.sync = pair[2]
+    ON MATCH SET r.sync = r.sync + pair[2]
+    SET a:Dirty, b:Dirty
+    WITH r
+    WHERE r.sync <= 0
+    DELETE r
     """
     await tx.run(query, pairs=pairs)
 
 
-async def get_unique_pairs_in_deck(deck):
-    pairs = []
-    # Iterate through each unique pair in the list
-    for i in range(len(deck)):
-        for j in range(i + 1, len(deck)):
-            pairs.append([deck[i], deck[j]])
-    return pairs
+async def clear_relationships(session: AsyncSession):
+    """ Deletes every CONNECTED edge and recorded deck, in batches of their own transactions """
+    for query in [
+        "MATCH ()-[r:CONNECTED]->() CALL { WITH r DELETE r } IN TRANSACTIONS OF 10000 ROWS",
+        "MATCH (d:Deck) CALL { WITH d DELETE d } IN TRANSACTIONS OF 10000 ROWS",
+    ]:
+        await session.run(query)
+
+
+def get_unique_pairs_in_deck(deck: list[str]) -> Iterator[tuple[str, str]]:
+    """ Yields every pair of distinct cards in the deck once, in canonical (a, b) order with a < b """
+    return combinations(sorted({card for card in deck if card}), 2)
+
+
+def count_pairs(decks: Iterable[list[str]]) -> Counter:
+    """ Counts the number of decks each pair of cards appears in """
+    counts = Counter()
+    for deck in decks:
+        counts.update(get_unique_pairs_in_deck(deck))
+    return counts
 
 
+def get_deck_record(key: str, deck: list[str], scryfall_ids: dict[str, str]) -> dict:
+    """ Resolves a deck to its sorted, distinct scryfall ids and hashes them """
+    cards = sorted({scryfall_ids[name] for name in deck if name in scryfall_ids})
+    return {"key": key, "hash": hashlib.sha256("\n".join(cards).encode()).hexdigest(), "cards": cards}
+
+
+def diff_decks(old: dict[str, dict], new: dict[str, dict]) -> tuple[list[dict], list[dict]]:
+    """ Returns the decks to add and to remove. A changed deck is removed in its old version and added in its new one """
+    added = [deck for key, deck in new.items() if key not in old or old[key]["hash"] != deck["hash"]]
+    removed = [deck for key, deck in old.items() if key not in new or new[key]["hash"] != deck["hash"]]
+    return added, removed
+
+
+def count_pair_deltas(added: list[dict], removed: list[dict]) -> Counter:
+    """ Counts the change in sync of every pair, dropping the pairs that did not change """
+    deltas = count_pairs(deck["cards"] for deck in added)
+    deltas.subtract(count_pairs(deck["cards"] for deck in removed))
+    return Counter({pair: delta for pair, delta in deltas.items() if delta})
+
+
+def write_unresolved_names(path: str, names: Iterable[str]) -> None:
+    with open(path, "w") as f:
+        f.writelines(f"{name}\n" for name in sorted(names))
+
+
+async def ingest_data(
+    driver: AsyncDriver,
+    sources: dict[str, dict[str, list[str]]],
+    chunksize: int = 10_000,
+    retries: int = 3,
+    report_path: str | None = None,
+    full: bool = False,
+) -> dict:
+    """
+    Applies the decks that were added, removed or changed in each source since its last ingest to the CONNECTED edges.
+    With `full`, every edge and recorded deck is deleted first and all decks are ingested again.
+
+    A delta is only correct against edges that match the recorded decks, so the ingest falls back to `full` when edges
+    exist that no completed ingest recorded: edges of an interrupted run, or of an ingest from before decks were recorded
+    """
+    print("Resolving card names...")
+    names = {name for decks in sources.values() for deck in decks.values() for name in deck if name}
+    with Timer(name="resolve names"):
+        async with driver.session(database="neo4j") as session:
+            scryfall_ids = await session.execute_read(resolve_card_names, list(names))
+    unresolved = names - scryfall_ids.keys()
+    print(f"Resolved {len(scryfall_ids)} of {len(names)} card names")
+    if report_path:
+        write_unresolved_names(report_path, unresolved)
+        print(f"Wrote {len(unresolved)} unresolved card names to {report_path}")
+
+    async with driver.session(database="neo4j") as session:
+        state = await session.execute_read(get_decklist_state)
+    if not full and state["has_edges"] and not state["complete"]:
+        reason = "the last ingest did not finish" if state["complete"] is False else "they were ingested before decks were recorded"
+        print(f"CONNECTED edges do not match the recorded decks, {reason}. Rebuilding every edge")
+        full = True
+
+    if full:
+        print("Clearing relationships...")
+        async with driver.session(database="neo4j") as session:
+            await clear_relationships(session)
+
+    print("Diffing decks...")
+    changes = {}
+    async with driver.session(database="neo4j") as session:
+        for source, decks in sources.items():
+            old = {} if full else await session.execute_read(get_decks, source)
+            new = {key: get_deck_record(key, deck, scryfall_ids) for key, deck in decks.items()}
+            changes[source] = diff_decks(old, new)
+            print(f"{source}: {len(changes[source][0])} decks to add, {len(changes[source][1])} to remove")
+
+    # Deltas of every source are counted together, so a pair changed by several decks is written once
+    with Timer(name="count pairs"):
+        deltas = Counter()
+        for added, removed in changes.values():
+            deltas.update(count_pair_deltas(added, removed))
+    print(f"Counted {len(deltas)} changed pairs")
 
-async def ingest_data(session: AsyncSession, data: dict):
-    chunked_data = chunk_iterable(data, CHUNKSIZE)
     print("Ingesting data...")
+    # Until the decks are recorded, a rerun cannot diff against them and rebuilds the edges instead
+    async with driver.session(database="neo4j") as session:
+        await session.execute_write(set_decklist_state, False)
+    pairs = ([a, b, delta] for (a, b), delta in deltas.items() if delta)
+    # Merging edges on top of shared nodes concurrently can deadlock, so the chunks are written one at a time
     with Timer(name="ingest"):
-        for idx, chunk in enumerate(chunked_data):
-            # Awaiting each chunk in a loop isn't ideal, but it's easiest this way when working with graphs!
-            # Merging edges on top of nodes concurrently can lead to race conditions. Neo4j doesn't allow this,
-            # and prevents the user from merging relationships on nodes that might not exist yet, for good reason.
-            try:
-                unique_pairs = []
-                for deck in chunk:
-                    unique_pairs.extend(await get_unique_pairs_in_deck(deck))
+        stats = await write_chunks(driver, create_or_update_relationships, chunk_iterable(pairs, chunksize), concurrency=1, retries=retries)
+    print(f"Wrote {stats['written']} edges in {stats['elapsed']:.2f}s ({stats['per_second']:.0f} edges/sec)")
+
+    if stats["failed_chunks"]:
+        # Some chunks were committed, so the edges match neither the previous decks nor the new ones
+        print(f"Failed chunks: {stats['failed_chunks']}. Decks were not recorded, the next run rebuilds every edge")
+    else:
+        async with driver.session(database="neo4j") as session:
+            for source, (added, removed) in changes.items():
+                await session.execute_write(update_decks, source, added, removed)
+            await session.execute_write(set_decklist_state, True)
 
-                await session.execute_write(create_or_update_relationships, unique_pairs)
-                print(f"Processed chunk {idx + 1}")
+    stats["unresolved"] = len(unresolved)
+    stats["decks"] = {source: {"added": len(added), "removed": len(removed)} for source, (added, removed) in changes.items()}
+    return stats
+
+
+def export_csv(sources: dict[str, dict[str, list[str]]], directory: str, report_path: str | None = None) -> dict:
+    """
+    Writes the CONNECTED edges, the decks and the decklist ingest marker to neo4j-admin import CSVs in `directory`,
+    next to the `cards.csv` exported by `scryfall_bulk_data_injest.py`. Card names are resolved against that file,
+    which gets a total_recurrences column, and `sync` and `dynamicWeight` are computed like `set_relationships` does
+    """
+    cards_path = os.path.join(directory, "cards.csv")
+    header, rows = read_csv(cards_path)
+    id_column, name_column = get_column(header, "scryfall_id"), get_column(header, "name_front")
+    scryfall_ids = {row[name_column]: row[id_column] for row in rows}
 
-            except Exception as e:
-                print(f"{e}: Failed to ingest chunk #{idx + 1}")
+    names = {name for decks in sources.values() for deck in decks.values() for name in deck if name}
+    unresolved = names - scryfall_ids.keys()
+    print(f"Resolved {len(names) - len(unresolved)} of {len(names)} card names")
+    if report_path:
+        write_unresolved_names(report_path, unresolved)
 
+    decks = {source: [get_deck_record(key, deck, scryfall_ids) for key, deck in source_decks.items()] for source, source_decks in sources.items()}
+    counts = count_pairs(deck["cards"] for source_decks in decks.values() for deck in source_decks)
+    totals = Counter()
+    for (a, b), sync in counts.items():
+        totals[a] += sync
+        totals[b] += sync
 
-async def main(metagame_data: dict, custom_data: dict):
+    edges = write_csv(
+        os.path.join(directory, "connected.csv"),
+        [":START_ID(Card)", ":END_ID(Card)", ":TYPE", "sync:long", "dynamicWeight:double"],
+        ([a, b, "CONNECTED", sync, sync / math.sqrt(totals[a] + totals[b])] for (a, b), sync in counts.items()),
+    )
+    write_csv(
+        os.path.join(directory, "decks.csv"),
+        [":ID(Deck)", "source", "key", "hash", "cards:string[]", ":LABEL"],
+        ([f"{source}/{deck['key']}", source, deck["key"], deck["hash"], deck["cards"], "Deck"] for source, source_decks in decks.items() for deck in source_decks),
+    )
+
+    # A database imported from these files holds the edges of exactly these decks, like one after a completed ingest
+    write_csv(
+        os.path.join(directory, "ingest_versions.csv"),
+        [":ID(IngestVersion)", "name", "complete:boolean", "version:long", ":LABEL"],
+        [["decklists", "decklists", True, int(time.time() * 1000), "IngestVersion"]],
+    )
+
+    # Replace the total_recurrences of a previous export
+    if any(column.split(":")[0] == "total_recurrences" for column in header):
+        total_column = get_column(header, "total_recurrences")
+        header = header[:total_column] + header[total_column + 1:]
+        rows = [row[:total_column] + row[total_column + 1:] for row in rows]
+    write_csv(cards_path, header + ["total_recurrences:long"], (row + [totals.get(row[id_column])] for row in rows))
+
+    return {"edges": edges, "decks": sum(len(source_decks) for source_decks in decks.values()), "unresolved": len(unresolved)}
+
+
+async def main(sources: dict[str, dict[str, list[str]]]):
     async with AsyncGraphDatabase.driver(URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
-        async with driver.session(database="neo4j") as session:
-            print("Ingesting metagame data")
-            await ingest_data(session, metagame_data)
-            print("Ingesting custom data")
-            await ingest_data(session, custom_data)
+        await apply_schema(driver)
+
+        print(f"Ingesting {', '.join(sources)} data")
+        stats = await ingest_data(driver, sources, CHUNKSIZE, RETRIES, REPORT_PATH, FULL)
+    return stats
 
 
 if __name__ == "__main__":
     # fmt: off
     parser = argparse.ArgumentParser("Load MTG Goldfish decklists into Neo4j")
-    parser.add_argument("--chunksize", type=int, default=100, help="Size of each chunk to break the dataset into before processing")
+    parser.add_argument("--chunksize", type=int, default=10_000, help="Number of distinct card pairs written per transaction")
+    parser.add_argument("--retries", type=int, default=3, help="Number of times a failed chunk is retried before it is reported")
+    parser.add_argument("--unresolved-report", type=str, default="data/mtg_goldfish/unresolved_names.txt", help="File the decklist card names without a matching card are written to")
+    parser.add_argument("--export-csv", type=str, default=None, help="Write the edges to neo4j-admin import CSVs in this directory, next to the exported cards.csv, instead of ingesting them")
+    parser.add_argument("--full", action="store_true", help="Delete every CONNECTED edge and ingest all decks again instead of applying the changed decks")
     args = vars(parser.parse_args())
     # fmt: on
 
@@ -88,12 +316,23 @@ if __name__ == "__main__":
     NEO4J_USER = settings.NEO4J_USER
     NEO4J_PASSWORD = settings.NEO4J_PASSWORD
     CHUNKSIZE = args["chunksize"]
+    RETRIES = args["retries"]
+    REPORT_PATH = args["unresolved_report"]
+    FULL = args["full"]
 
-    metagame_data = load_data("metagame.json")
-    custom_data = load_data("custom.json")
+    sources = {
+        "metagame": load_data("metagame.json"),
+        "custom": load_data("custom.json"),
+    }
 
-    if metagame_data and custom_data:
+    if all(sources.values()) and args["export_csv"]:
+        with Timer(name="export csv"):
+            stats = export_csv(sources, args["export_csv"], REPORT_PATH)
+        print(f"Exported {stats['edges']} edges and {stats['decks']} decks to {args['export_csv']}")
+    elif all(sources.values()):
         # Use uvloop for potential performance gains
         import uvloop
         uvloop.install()
-        asyncio.run(main(metagame_data, custom_data))
\ No newline at end of file
+        stats = asyncio.run(main(sources))
+        if stats["failed_chunks"]:
+            sys.exit(1)
\ No newline at end of file
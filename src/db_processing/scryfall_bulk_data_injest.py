@@ -3,60 +3,117 @@ import asyncio
 import os
 import sys
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
 
+import ijson
 from codetiming import Timer
 from neo4j import AsyncGraphDatabase, AsyncManagedTransaction, AsyncSession
 
-from utils.card import get_formatted_card, get_fromatted_types
+from utils.card import get_color_mask, get_formatted_card, get_fromatted_types, get_legality_mask
 
 sys.path.insert(1, os.path.realpath(Path(__file__).resolve().parents[1]))
-from schemas.ingest.mtg_card import MtgCard
-from utils.request import fetch_url
-from utils.db_processing import chunk_iterable, get_settings
+from schemas.ingest.mtg_card import MtgCard, mtg_cards_adapter
+from utils.request import download_file, fetch_url
+from utils.db_processing import chunk_iterable, get_settings, map_bounded, write_chunks
+from utils.admin_import import write_csv
+from utils.schema import apply_schema
 from schemas.api.mtg_card import mtg_card_legalities_list
 
 
 # Custom types
 JsonBlob = dict[str, Any]
 
+def drop_none(data: list[JsonBlob]) -> list[JsonBlob]:
+    return [{key: value for key, value in item.items() if value is not None} for item in data]
+
+
 @Timer(name="pydantic validator")
 def validate(
     data: list[JsonBlob],
     exclude_none: bool = False,
 ) -> list[JsonBlob]:
     try:
-        validated_data = [MtgCard(**item).model_dump(exclude_none=exclude_none) for item in data]
-        return validated_data
+        validated_data = mtg_cards_adapter.validate_python(data)
+        return drop_none(validated_data) if exclude_none else validated_data
+    except Exception as e:
+        print(e)
+        raise Exception("Failed to validate data")
+
+
+@Timer(name="pydantic validator")
+def validate_json(
+    raw: bytes,
+    exclude_none: bool = False,
+) -> list[JsonBlob]:
+    """ Validates a raw JSON array of cards without parsing it into Python objects first """
+    try:
+        validated_data = mtg_cards_adapter.validate_json(raw)
+        return drop_none(validated_data) if exclude_none else validated_data
     except Exception as e:
         print(e)
         raise Exception("Failed to validate data")
     
     
 
-def get_scryfall_bulk_data(url):
+def download_scryfall_bulk_data(url: str, path: str) -> str:
+    """ Downloads the oracle_cards dump to `path` """
     response = fetch_url(url)
 
     for obj in response['data']:
         if obj['type'] == 'oracle_cards':
-            return fetch_url(obj['download_uri'])
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            return download_file(obj['download_uri'], path)
+
+    raise Exception("No oracle_cards entry in the Scryfall bulk data")
+
+
+def iter_scryfall_bulk_data(path: str) -> Iterator[JsonBlob]:
+    """ Parses the cards of a bulk data file one at a time """
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", use_float=True)
+
+
+def load_card_chunks(path: str, chunksize: int, limit: int = 0, workers: int = 0, whole_file: bool = False) -> Iterator[list[JsonBlob]]:
+    """
+    Parses, validates and preprocesses the cards of a bulk data file as a generator chain.
+    Only a few chunks of cards are in memory at a time, whatever the size of the file.
+    With `workers` > 1 the chunks are validated and preprocessed in parallel worker processes.
+    With `whole_file` the raw file is validated in one pass instead, which is faster but holds the whole dump in memory
+    """
+    if whole_file:
+        with open(path, "rb") as f:
+            cards = validate_json(f.read(), exclude_none=True)
+        if limit > 0:
+            cards = cards[:limit]
+        yield from map(preprocess_card_data, chunk_iterable(cards, chunksize))
+        return
+
+    cards = iter_scryfall_bulk_data(path)
+    if limit > 0:
+        cards = islice(cards, limit)
+    chunks = chunk_iterable(cards, chunksize)
+
+    if workers <= 1:
+        yield from map(process_chunk, chunks)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from map_bounded(executor, process_chunk, chunks, max_pending=workers * 2)
 
 
 # --- Async functions ---
 
 
-async def create_indexes_and_constraints(session: AsyncSession) -> None:
-    queries = [
-        # constraints
-        "CREATE CONSTRAINT name_front IF NOT EXISTS FOR (c:Card) REQUIRE c.name_front IS UNIQUE",
-        "CREATE CONSTRAINT scryfall_id IF NOT EXISTS FOR (c:Card) REQUIRE c.scryfall_id IS UNIQUE",
-        
-        # indexes
-        "CREATE INDEX price_usd IF NOT EXISTS FOR (c:Card) ON (c.price_usd) ",
-        ]
-    for query in queries:
-         await session.run(query)
+async def set_ingest_version(session: AsyncSession) -> None:
+    # Bump the marker the API polls to know when to reload its card catalog
+    query = """
+    MERGE (v:IngestVersion {name: 'cards'})
+    SET v.version = timestamp()
+    """
+    await session.run(query)
 
 
 async def build_query(tx: AsyncManagedTransaction, data: list[JsonBlob]) -> None:
@@ -74,6 +131,7 @@ async def build_query(tx: AsyncManagedTransaction, data: list[JsonBlob]) -> None
             c.types = record.types,
 
             c.colors = record.colors,
+            c.color_mask = record.color_mask,
             c.cmc = record.cmc,
             c.keywords = record.keywords,
             c.rarity = record.rarity,
@@ -106,11 +164,55 @@ async def build_query(tx: AsyncManagedTransaction, data: list[JsonBlob]) -> None
             c.legality_paupercommander = record.legalities.paupercommander,
             c.legality_duel = record.legalities.duel,
             c.legality_oldschool = record.legalities.oldschool,
-            c.legality_premodern = record.legalities.premodern
+            c.legality_premodern = record.legalities.premodern,
+            c.legality_mask = record.legality_mask
         RETURN c
         """
     await tx.run(query, data=data)
 
+# neo4j-admin import column of each Card property written by `build_query`, with the path to its value in a preprocessed card
+CARD_CSV_COLUMNS = {
+    "scryfall_id:ID(Card)": ("id",),
+    "full_name": ("name",),
+    "name_front": ("name_front",),
+    "name_back": ("name_back",),
+    "oracle_texts:string[]": ("oracle_texts",),
+    "types:string[]": ("types",),
+    "colors:string[]": ("colors",),
+    "cmc:double": ("cmc",),
+    "keywords:string[]": ("keywords",),
+    "rarity": ("rarity",),
+    "img_uris_small:string[]": ("image_uris", "small"),
+    "img_uris_normal:string[]": ("image_uris", "normal"),
+    "price_usd:double": ("prices", "usd"),
+    "price_usd_foil:double": ("prices", "usd_foil"),
+    "price_eur:double": ("prices", "eur"),
+    "price_tix:double": ("prices", "tix"),
+    **{f"legality_{legality}:boolean": ("legalities", legality) for legality in mtg_card_legalities_list},
+    "legality_mask:long": ("legality_mask",),
+    "color_mask:long": ("color_mask",),
+}
+
+
+def get_card_csv_row(record: JsonBlob) -> list:
+    row = []
+    for keys in CARD_CSV_COLUMNS.values():
+        value = record
+        for key in keys:
+            value = value.get(key) if value else None
+        row.append(value)
+    return row + ["Card"]
+
+
+def export_csv(path: str, directory: str, chunksize: int = 2_000, limit: int = 0, workers: int = 0, whole_file: bool = False) -> int:
+    """ Writes the cards to `<directory>/cards.csv` for neo4j-admin import, returning the number of cards """
+    # Cards are keyed on the unique name_front like in `build_query`, where the last card with a name overwrites the others
+    rows = {}
+    for chunk in load_card_chunks(path, chunksize, limit, workers, whole_file):
+        for record in chunk:
+            rows[record["name_front"]] = get_card_csv_row(record)
+    return write_csv(os.path.join(directory, "cards.csv"), list(CARD_CSV_COLUMNS) + [":LABEL"], rows.values())
+
 def set_faces_data(card: MtgCard) -> list[dict]:
     d = {
         "image_uris": {
@@ -148,72 +250,87 @@ def set_legalities(record: MtgCard):
         legalities[legality] = record['legalities'][legality] == "legal"
     return legalities
 
-def preprocess_card_data(data: list[MtgCard]) -> list[MtgCard]:
-    idx_to_delete = []
+def preprocess_card(record: MtgCard) -> MtgCard:
+    # Format the card names
+    formatted_names = get_formatted_card(record['name'])
+    record['name_front'] = formatted_names[0]
+    record['name_back'] = formatted_names[1]
+    
+    # Format the card types
+    record['types'] = get_fromatted_types(record['type_line'])
+    
+    # Get the faces data (image URIs and oracle texts)
+    faces_data = set_faces_data(record)
+    record['image_uris'] = faces_data['image_uris']
+    record['oracle_texts'] = faces_data['oracle_texts']
+
+    # Set the legalities
+    record['legalities'] = set_legalities(record)
 
+    # Pack the legalities and colors into bitmasks, so the suggestion filters are a single bitwise test per card
+    record['legality_mask'] = get_legality_mask(legality for legality, legal in record['legalities'].items() if legal)
+    record['color_mask'] = get_color_mask(record.get('colors'))
+    return record
+
+def iter_preprocessed_card_data(data: Iterable[MtgCard]) -> Iterator[MtgCard]:
+    """ Preprocesses cards in a single pass, skipping the ones with the layout "art_series" """
     for record in data:
-        # Set cards with the layout "art_series" to be deleted
         if record['layout'] == "art_series":
-            idx_to_delete.append(data.index(record))
             continue
-        
-        # Format the card names
-        formatted_names = get_formatted_card(record['name'])
-        record['name_front'] = formatted_names[0]
-        record['name_back'] = formatted_names[1]
-        
-        # Format the card types
-        record['types'] = get_fromatted_types(record['type_line'])
-        
-        # Get the faces data (image URIs and oracle texts)
-        faces_data = set_faces_data(record)
-        record['image_uris'] = faces_data['image_uris']
-        record['oracle_texts'] = faces_data['oracle_texts']
-
-        # Set the legalities
-        record['legalities'] = set_legalities(record)
-    
-    # Delete the cards with the layout "art_series"
-    for idx in reversed(idx_to_delete):
-        del data[idx]
-    
-    return data
+        yield preprocess_card(record)
+
+def preprocess_card_data(data: Iterable[MtgCard]) -> list[MtgCard]:
+    return list(iter_preprocessed_card_data(data))
 
-async def main(data: list[JsonBlob]) -> None:
+def process_chunk(chunk: list[JsonBlob]) -> list[JsonBlob]:
+    """ Validates and preprocesses a chunk of raw cards. Module level so it can run in a worker process """
+    return preprocess_card_data(validate(chunk, exclude_none=True))
+
+async def main(path: str) -> None:
     async with AsyncGraphDatabase.driver(URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+        # Create indexes and constraints
+        await apply_schema(driver)
+
+        # Ingest the data into Neo4j. Card MERGEs are keyed on the unique name_front, so chunks never
+        # conflict and can be written concurrently while the next chunk is being processed
+        print("Ingesting data...")
+        with Timer(name="ingest"):
+            stats = await write_chunks(
+                driver,
+                build_query,
+                load_card_chunks(path, CHUNKSIZE, LIMIT, WORKERS, WHOLE_FILE),
+                concurrency=CONCURRENCY,
+                retries=RETRIES,
+            )
+        print(f"Ingested {stats['written']} cards at {stats['per_second']:.0f} cards/sec")
+        if stats["failed_chunks"]:
+            print(f"Failed chunks: {stats['failed_chunks']}")
+
         async with driver.session(database="neo4j") as session:
-            # Create indexes and constraints
-            await create_indexes_and_constraints(session)
-            # Ingest the data into Neo4j
-            print("Processing data...")
-            validated_data = validate(data, exclude_none=True)
-            processed_data = preprocess_card_data(validated_data)
-            
-            # Break the data into chunks
-            chunked_data = chunk_iterable(processed_data, CHUNKSIZE)
-            print("Ingesting data...")
-            with Timer(name="ingest"):
-                for idx, chunk in enumerate(chunked_data):
-                    # Awaiting each chunk in a loop isn't ideal, but it's easiest this way when working with graphs!
-                    # Merging edges on top of nodes concurrently can lead to race conditions. Neo4j doesn't allow this,
-                    # and prevents the user from merging relationships on nodes that might not exist yet, for good reason.
-                    try:
-                        await session.execute_write(build_query, chunk)
-                        print(f"Processed chunk #{idx + 1}")
-                    except Exception as e:
-                        print(f"{e}: Failed to ingest chunk #{idx + 1}")
+            await set_ingest_version(session)
 
 
 if __name__ == "__main__":
     # fmt: off
     parser = argparse.ArgumentParser("Build a graph of MTG cards from Scryfall Bulk Data")
     parser.add_argument("--limit", type=int, default=0, help="Limit the size of the dataset to load for testing purposes")
-    parser.add_argument("--chunksize", type=int, default=10_000, help="Size of each chunk to break the dataset into before processing")
+    parser.add_argument("--chunksize", type=int, default=2_000, help="Size of each chunk to break the dataset into before processing")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of chunks written at the same time")
+    parser.add_argument("--retries", type=int, default=3, help="Number of times a failed chunk is retried")
+    parser.add_argument("--workers", type=int, default=0, help="Validate and preprocess chunks in this many worker processes")
+    parser.add_argument("--whole-file", action="store_true", help="Validate the raw file in one pass. Faster, but holds the whole dump in memory")
+    parser.add_argument("--file", type=str, default=None, help="Ingest a local oracle_cards bulk data file instead of downloading it")
+    parser.add_argument("--export-csv", type=str, default=None, help="Write the cards to a neo4j-admin import CSV in this directory instead of ingesting them")
+    parser.add_argument("--download-path", type=str, default="data/scryfall/oracle_cards.json", help="Where to save the downloaded bulk data")
     args = vars(parser.parse_args())
     # fmt: on
 
     LIMIT = args["limit"]
     CHUNKSIZE = args["chunksize"]
+    CONCURRENCY = args["concurrency"]
+    RETRIES = args["retries"]
+    WORKERS = args["workers"]
+    WHOLE_FILE = args["whole_file"]
     SCRYFALL_BULK_DATA_URL = "https://api.scryfall.com/bulk-data"
 
     # # Neo4j
@@ -223,13 +340,16 @@ if __name__ == "__main__":
     NEO4J_PASSWORD = settings.NEO4J_PASSWORD
     
 
-    data = list(get_scryfall_bulk_data(SCRYFALL_BULK_DATA_URL))
-    if LIMIT > 0:
-        data = data[:LIMIT]
+    path = args["file"] or download_scryfall_bulk_data(SCRYFALL_BULK_DATA_URL, args["download_path"])
+
+    if args["export_csv"]:
+        with Timer(name="export csv"):
+            count = export_csv(path, args["export_csv"], CHUNKSIZE, LIMIT, WORKERS, WHOLE_FILE)
+        print(f"Exported {count} cards to {args['export_csv']}")
+        sys.exit()
 
-    if data:
-        # Neo4j async uses uvloop under the hood, so we can gain marginal performance improvement by using it too
-        import uvloop
+    # Neo4j async uses uvloop under the hood, so we can gain marginal performance improvement by using it too
+    import uvloop
 
-        uvloop.install()
-        asyncio.run(main(data))
\ No newline at end of file
+    uvloop.install()
+    asyncio.run(main(path))
\ No newline at end of file
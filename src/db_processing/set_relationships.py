@@ -1,43 +1,123 @@
+import argparse
+import time
+from utils.db_processing import chunk_iterable, get_settings
+from utils.schema import apply_schema_sync
+from neo4j import Driver, GraphDatabase, ManagedTransaction, Session
 
-from utils.db_processing import get_settings
-from neo4j import GraphDatabase, ManagedTransaction
 
-def set_relationships(tx: ManagedTransaction):
-    # Delete all relationships that target themselves
+def get_dirty_card_ids(tx: ManagedTransaction) -> list[str]:
+    """ Gets the cards whose CONNECTED edges changed since the last run, see `mtg_goldfish_decklist.create_or_update_relationships` """
     query = """
-    MATCH (n)-[r]-(n)
-    DELETE r
+    MATCH (c:Card:Dirty)
+    RETURN c.scryfall_id AS scryfall_id
     """
-    tx.run(query)
+    return [record["scryfall_id"] for record in tx.run(query)]
 
-    # Set total_recurrences property on Card nodes
+
+def mark_all_cards_dirty(session: Session):
     query = """
-    MATCH (c:Card)-[r:CONNECTED]-(:Card)
+    MATCH (c:Card)
+    CALL { WITH c SET c:Dirty } IN TRANSACTIONS OF 10000 ROWS
+    """
+    session.run(query).consume()
+
+
+def set_total_recurrences(tx: ManagedTransaction, scryfall_ids: list[str]):
+    # Delete the relationships that target themselves, then sum the sync of the remaining edges of each card
+    query = """
+    UNWIND $scryfall_ids AS scryfall_id
+    MATCH (c:Card {scryfall_id: scryfall_id})
+    OPTIONAL MATCH (c)-[loop:CONNECTED]->(c)
+    DELETE loop
+    WITH DISTINCT c
+    OPTIONAL MATCH (c)-[r:CONNECTED]-(:Card)
     WITH c, SUM(r.sync) AS totalSync
     SET c.total_recurrences = totalSync
     """
-    tx.run(query)
+    tx.run(query, scryfall_ids=scryfall_ids).consume()
+
 
-    # Set dynamicWeight based on square root scaling
-    # Perform query by periodic iteration
+def set_dynamic_weights(tx: ManagedTransaction, scryfall_ids: list[str]) -> int:
+    """ Sets the dynamicWeight of every edge of the cards, returning the number of edges updated """
+    # Set dynamicWeight based on square root scaling.
+    # An edge between two dirty cards is only updated from its start node, so each edge is visited once
     query = """
-    CALL apoc.periodic.iterate(
-        "MATCH (c:Card)-[r:CONNECTED]-(other:Card) RETURN c, r, other",
-        "SET r.dynamicWeight = r.sync * 1.0 / sqrt(c.total_recurrences + other.total_recurrences)",
-    {batchSize: 1000, parallel: true}
-    )
+    UNWIND $scryfall_ids AS scryfall_id
+    MATCH (c:Card {scryfall_id: scryfall_id})-[r:CONNECTED]-(other:Card)
+    WHERE startNode(r) = c OR NOT other:Dirty
+    SET r.dynamicWeight = r.sync * 1.0 / sqrt(c.total_recurrences + other.total_recurrences)
+    RETURN count(r) AS edges
     """
-    tx.run(query)
+    return tx.run(query, scryfall_ids=scryfall_ids).single()["edges"]
+
+
+def clear_dirty(tx: ManagedTransaction, scryfall_ids: list[str]):
+    query = """
+    UNWIND $scryfall_ids AS scryfall_id
+    MATCH (c:Card {scryfall_id: scryfall_id})
+    REMOVE c:Dirty
+    """
+    tx.run(query, scryfall_ids=scryfall_ids).consume()
+
+
+def set_relationships_version(tx: ManagedTransaction):
+    # Bump the marker the API polls to know when to reload its suggestion engine with the new weights
+    query = """
+    MERGE (v:IngestVersion {name: 'relationships'})
+    SET v.version = timestamp()
+    """
+    tx.run(query).consume()
+
+
+def set_relationships(driver: Driver, batch_size: int = 1000, full: bool = False) -> dict:
+    """
+    Recomputes `total_recurrences` and `dynamicWeight` around the Dirty cards, in batches of `batch_size` cards
+    that are each committed in their own transaction. With `full`, every card is recomputed
+    """
+    with driver.session(database="neo4j") as session:
+        if full:
+            mark_all_cards_dirty(session)
+        scryfall_ids = session.execute_read(get_dirty_card_ids)
+        print(f"Recomputing {len(scryfall_ids)} cards")
+
+        # Every total has to be up to date before the weights that depend on it are computed
+        for idx, batch in enumerate(chunk_iterable(scryfall_ids, batch_size)):
+            session.execute_write(set_total_recurrences, batch)
+            print(f"Set total recurrences of batch #{idx + 1}")
+
+        edges = 0
+        start = time.perf_counter()
+        for idx, batch in enumerate(chunk_iterable(scryfall_ids, batch_size)):
+            edges += session.execute_write(set_dynamic_weights, batch)
+            print(f"Set dynamic weights of batch #{idx + 1}")
+        elapsed = time.perf_counter() - start
+
+        for batch in chunk_iterable(scryfall_ids, batch_size):
+            session.execute_write(clear_dirty, batch)
+
+        if scryfall_ids:
+            session.execute_write(set_relationships_version)
+
+    stats = {"cards": len(scryfall_ids), "edges": edges, "elapsed": elapsed, "per_second": edges / elapsed if elapsed else 0.0}
+    print(f"Updated {edges} edges in {elapsed:.2f}s ({stats['per_second']:.0f} edges/sec)")
+    return stats
 
 
 if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser("Recompute the total recurrences of cards and the dynamic weights of their edges")
+    parser.add_argument("--full", action="store_true", help="Recompute every card instead of the ones changed by the last decklist ingest")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of cards recomputed per transaction")
+    args = vars(parser.parse_args())
+    # fmt: on
+
     # # Neo4j
     settings = get_settings()
     URI = f"bolt://{settings.SERVER_HOST}:7687"
     NEO4J_USER = settings.NEO4J_USER
     NEO4J_PASSWORD = settings.NEO4J_PASSWORD
 
-    
+
     with GraphDatabase.driver(URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
-        with driver.session(database="neo4j") as session:
-            session.execute_write(set_relationships)
\ No newline at end of file
+        apply_schema_sync(driver)
+        set_relationships(driver, args["batch_size"], args["full"])
@@ -1,33 +1,17 @@
+from typing import Annotated
 from uuid import UUID
-from typing import Any
-from pydantic import AnyHttpUrl
+from pydantic import AfterValidator, StringConstraints
 
 
-class UUID4str(str):
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+# Pydantic v2 annotated types: they stay plain strings, so validated data does not need to be dumped again
 
-    @classmethod
-    def validate(cls, value: Any, field: Any) -> str:
-        # Validate that the value is a valid UUID4
-        try:
-            uuid_obj = UUID(value, version=4)
-        except ValueError:
-            raise ValueError(f"'{value}' is not a valid UUID4")
-        return str(uuid_obj)
-    
+def _normalize_uuid(value: str) -> str:
+    # UUID accepts upper case, braces, urn: prefixes and unhyphenated hex, and raises ValueError otherwise
+    return str(UUID(value))
 
-class URLstr(str):
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
 
-    @classmethod
-    def validate(cls, value: Any, field: Any) -> str:
-        # Validate that the value is a valid AnyHttpUrl
-        try:
-            url_obj = AnyHttpUrl(value)
-        except ValueError:
-            raise ValueError(f"'{value}' is not a valid URL")
-        return str(url_obj)
\ No newline at end of file
+# A UUID string, normalized to its lowercase hyphenated form
+UUID4str = Annotated[str, StringConstraints(strip_whitespace=True), AfterValidator(_normalize_uuid)]
+
+# An absolute http(s) URL, checked inside pydantic-core without calling back into Python for every value
+URLstr = Annotated[str, StringConstraints(strip_whitespace=True, pattern=r"^https?://[^\s/?#]+[^\s]*$")]
@@ -0,0 +1,35 @@
+from typing import Annotated, Literal, Optional, Union
+from pydantic import BaseModel, Field
+from schemas import UUID4str
+from schemas.api.mtg_card import RequestUpdateCard, RequestUpdateCardCount, ResponseCardInCollection, ResponseCardNode
+
+
+class BatchUpdateCollection(BaseModel):
+    op: Literal["update_collection"]
+    cards: list[RequestUpdateCardCount]
+
+class BatchAddCardsToPool(BaseModel):
+    op: Literal["add_cards_to_pool"]
+    pool_id: str
+    cards: list[RequestUpdateCard]
+
+class BatchIgnoreCardsInPool(BaseModel):
+    op: Literal["ignore_cards_in_pool"]
+    pool_id: str
+    cards: list[UUID4str]
+
+class BatchRemoveCardsFromPool(BaseModel):
+    op: Literal["remove_cards_from_pool"]
+    pool_id: str
+    cards: list[UUID4str]
+
+RequestBatchOperation = Annotated[
+    Union[BatchUpdateCollection, BatchAddCardsToPool, BatchIgnoreCardsInPool, BatchRemoveCardsFromPool],
+    Field(discriminator="op"),
+]
+
+
+class ResponseBatchOperation(BaseModel):
+    op: str
+    pool_id: Optional[str] = None
+    cards: list[ResponseCardInCollection] | list[ResponseCardNode]
@@ -1,5 +1,5 @@
 from typing import List, Literal, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class CardFilters(BaseModel):
     max_price: Optional[float] = None
@@ -31,4 +31,7 @@ class CardFilters(BaseModel):
 
 class RequestCardSuggestions(BaseModel):
     from_collection: bool
-    filters: Optional[CardFilters] = None
\ No newline at end of file
+    filters: Optional[CardFilters] = None
+    limit: int = Field(default=200, ge=1, le=1000)
+    offset: int = Field(default=0, ge=0)
+    compact: bool = False
\ No newline at end of file
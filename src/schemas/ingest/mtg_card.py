@@ -1,16 +1,19 @@
-from pydantic import BaseModel, Field, model_validator
-from typing import List, Optional
-from typing import List, Optional
+from pydantic import AfterValidator, Field, TypeAdapter
+from typing import Annotated, List, Optional
+from typing_extensions import TypedDict
 
 from schemas import URLstr, UUID4str
 
-class MtgCardPrices(BaseModel):
+# The ingest schema is made of TypedDicts rather than BaseModels: validating a card then produces
+# plain dicts directly, without building and dumping a model instance for every card in the dump
+
+class MtgCardPrices(TypedDict):
     usd: Optional[float]
     usd_foil: Optional[float]
     eur: Optional[float]
     tix: Optional[float]
 
-class MtgCardLegalities(BaseModel):
+class MtgCardLegalities(TypedDict):
     standard: Optional[str]
     future:Optional[str]
     historic:Optional[str]
@@ -33,35 +36,35 @@ class MtgCardLegalities(BaseModel):
     oldschool:Optional[str]
     premodern:Optional[str]
 
-class MtgImageUris(BaseModel):
+class MtgImageUris(TypedDict):
     small: URLstr
     normal: URLstr
 
-class CardFace(BaseModel):
-    image_uris: Optional[MtgImageUris] = None
+class CardFace(TypedDict):
+    image_uris: Annotated[Optional[MtgImageUris], Field(default=None)]
     oracle_text: str
 
-class MtgCard(BaseModel):
+class MtgCard(TypedDict):
     name: str
     id: UUID4str
-    oracle_text: Optional[str] = None
+    oracle_text: Annotated[Optional[str], Field(default=None)]
     prices: MtgCardPrices
-    colors: List[str] = Field(default_factory=list)
+    colors: Annotated[List[str], Field(default_factory=list)]
     cmc: float
     keywords: List[str]
     legalities: MtgCardLegalities
     rarity: str
     type_line: str
-    image_uris: Optional[MtgImageUris] = None
-    card_faces: Optional[List[CardFace]] = None
+    image_uris: Annotated[Optional[MtgImageUris], Field(default=None)]
+    card_faces: Annotated[Optional[List[CardFace]], Field(default=None)]
     layout: str
 
-    class Config:
-        extra = 'ignore'
+
+def validate_image_uris(card: MtgCard) -> MtgCard:
+    if not card["image_uris"] and not card["card_faces"]:
+        raise ValueError("Either 'image_uris' or 'card_faces' must be provided.")
+    return card
 
 
-    @model_validator(mode='after')
-    def validate_image_uris(self):
-        if not self.image_uris and not self.card_faces:
-            raise ValueError("Either 'image_uris' or 'card_faces' must be provided.")
-        return self
\ No newline at end of file
+# Validates a list of raw Scryfall cards into plain dicts, extra keys are ignored
+mtg_cards_adapter = TypeAdapter(list[Annotated[MtgCard, AfterValidator(validate_image_uris)]])
@@ -0,0 +1,87 @@
+import asyncio
+import uuid
+import pytest
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from api.service.batch import run_batch
+from schemas.api.batch import RequestBatchOperation
+from tests.fakes import FakeTransaction
+
+
+class CardStore(FakeTransaction):
+    """ Resolves cards against an in-memory list and records the mutation queries in order """
+    def __init__(self, nodes, pools):
+        super().__init__(self.handle)
+        self.by_id = {node["scryfall_id"]: node for node in nodes}
+        self.by_name = {node["name_front"]: node for node in nodes}
+        self.pools = pools
+        self.lookups = 0
+        self.mutations = []
+
+    def handle(self, query, parameters):
+        if "scryfall_ids" in parameters:
+            self.lookups += 1
+            return [{"node": self.by_id[i]} for i in parameters["scryfall_ids"] if i in self.by_id]
+        if "names" in parameters:
+            self.lookups += 1
+            return [{"node": self.by_name[n]} for n in parameters["names"] if n in self.by_name]
+        if "cards" in parameters:
+            self.mutations.append(("collection", [card["node"]["scryfall_id"] for card in parameters["cards"]]))
+            return [{"node": card["node"], "number_owned": card["update_amount"]} for card in parameters["cards"]]
+        # Pool mutations check ownership in the same query
+        if parameters["pool_id"] not in self.pools:
+            return [{"owned": False, "nodes": []}]
+        self.mutations.append((parameters["pool_id"], parameters["card_ids"]))
+        return [{"owned": True, "nodes": [self.by_id[i] for i in parameters["card_ids"]]}]
+
+
+operations_adapter = TypeAdapter(list[RequestBatchOperation])
+
+
+def make_nodes(n):
+    return [{"scryfall_id": str(uuid.uuid4()), "name_front": f"CARD {i}"} for i in range(n)]
+
+
+def test_run_batch_resolves_cards_once_and_keeps_order():
+    nodes = make_nodes(4)
+    ids = [node["scryfall_id"] for node in nodes]
+    tx = CardStore(nodes, pools={"pool_a", "pool_b"})
+    operations = operations_adapter.validate_python([
+        {"op": "update_collection", "cards": [{"name": "card 0", "update_amount": 2}, {"scryfall_id": ids[1], "update_amount": 1}]},
+        {"op": "add_cards_to_pool", "pool_id": "pool_a", "cards": [{"name": "card 2"}, {"scryfall_id": ids[3]}]},
+        {"op": "ignore_cards_in_pool", "pool_id": "pool_b", "cards": [ids[0]]},
+        {"op": "remove_cards_from_pool", "pool_id": "pool_a", "cards": [ids[2]]},
+    ])
+
+    results = asyncio.run(run_batch(tx, "user", operations))
+
+    # One id and one name lookup for all operations
+    assert tx.lookups == 2
+    assert tx.mutations == [
+        ("collection", [ids[0], ids[1]]),
+        ("pool_a", [ids[2], ids[3]]),
+        ("pool_b", [ids[0]]),
+        ("pool_a", [ids[2]]),
+    ]
+    assert [(result["op"], result["pool_id"]) for result in results] == [
+        ("update_collection", None),
+        ("add_cards_to_pool", "pool_a"),
+        ("ignore_cards_in_pool", "pool_b"),
+        ("remove_cards_from_pool", "pool_a"),
+    ]
+    assert results[0]["cards"][0]["number_owned"] == 2
+
+
+def test_run_batch_rejects_pools_of_other_users():
+    tx = CardStore(make_nodes(1), pools={"pool_a"})
+    operations = operations_adapter.validate_python([
+        {"op": "ignore_cards_in_pool", "pool_id": "pool_a", "cards": []},
+        {"op": "ignore_cards_in_pool", "pool_id": "other", "cards": []},
+    ])
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(run_batch(tx, "user", operations))
+
+    # The query on the other user's pool changes nothing, and raising rolls back the batch transaction
+    assert excinfo.value.status_code == 401
+    assert tx.mutations == [("pool_a", [])]
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+import uuid
+import pytest
+from fastapi import HTTPException
+from api.card_catalog import CardCatalog
+from api.service.card import get_cards
+from schemas.api.mtg_card import RequestUpdateCardCount
+from tests.fakes import FakeDriver, FakeTransaction
+
+
+def resolve_cards(nodes):
+    """ Resolves the id and name batches against an in-memory card list """
+    by_id = {node["scryfall_id"]: node for node in nodes}
+    by_name = {node["name_front"]: node for node in nodes}
+
+    def handle(query, parameters):
+        if "scryfall_ids" in parameters:
+            return [{"node": by_id[i]} for i in parameters["scryfall_ids"] if i in by_id]
+        return [{"node": by_name[n]} for n in parameters["names"] if n in by_name]
+    return handle
+
+
+def make_nodes(n):
+    return [{"scryfall_id": str(uuid.uuid4()), "name_front": f"CARD {i}"} for i in range(n)]
+
+
+def make_requests(nodes):
+    # Half of the cards by id and half by name
+    return [
+        RequestUpdateCardCount(scryfall_id=node["scryfall_id"], update_amount=1) if i % 2
+        else RequestUpdateCardCount(name=f"card {i}", update_amount=1)
+        for i, node in enumerate(nodes)
+    ]
+
+
+def test_get_cards_resolves_ids_and_names():
+    nodes = make_nodes(4)
+    result = asyncio.run(get_cards(FakeTransaction(resolve_cards(nodes)), make_requests(nodes)))
+    assert [card["node"] for card in result] == nodes
+
+
+def test_get_cards_reports_missing_cards():
+    nodes = make_nodes(2)
+    cards = make_requests(nodes) + [RequestUpdateCardCount(name="Unknown Card", number_owned=1)]
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(get_cards(FakeTransaction(resolve_cards(nodes)), cards))
+
+    assert excinfo.value.status_code == 404
+    assert excinfo.value.detail["error"] == "Card not found"
+    assert [card["name_front"] for card in excinfo.value.detail["missing_cards"]] == ["UNKNOWN CARD"]
+
+
+def test_get_cards_resolves_large_batches_in_two_queries():
+    nodes = make_nodes(2_000)
+    tx = FakeTransaction(resolve_cards(nodes))
+    result = asyncio.run(get_cards(tx, make_requests(nodes)))
+
+    # One query per identifier kind, joined back in request order
+    assert len(tx.queries) == 2
+    assert [card["node"] for card in result] == nodes
+
+
+def test_get_cards_reads_through_the_catalog():
+    nodes = make_nodes(4)
+    catalog = CardCatalog()
+    catalog.build(nodes[:2])
+    tx = FakeTransaction(resolve_cards(nodes))
+
+    result = asyncio.run(get_cards(tx, make_requests(nodes), catalog))
+    assert [card["node"] for card in result] == nodes
+    assert len(tx.queries) == 2
+
+    # The cards read from the database were added to the catalog
+    result = asyncio.run(get_cards(tx, make_requests(nodes), catalog))
+    assert [card["node"] for card in result] == nodes
+    assert len(tx.queries) == 2
+    assert len(catalog) == 4
+
+
+@pytest.mark.benchmark
+def test_get_cards_scales_linearly():
+    timings = {}
+    for n in [2_000, 20_000]:
+        nodes = make_nodes(n)
+        tx, cards = FakeTransaction(resolve_cards(nodes)), make_requests(nodes)
+        start = time.perf_counter()
+        asyncio.run(get_cards(tx, cards))
+        timings[n] = time.perf_counter() - start
+        print(f"get_cards: {n} cards in {timings[n] * 1000:.1f}ms")
+
+    # 10x the cards should take about 10x the time, far from the 100x of a nested loop
+    assert timings[20_000] < timings[2_000] * 30
+
+
+def test_get_cards_adds_read_through_cards_in_one_snapshot():
+    nodes = make_nodes(2_000)
+    catalog = CardCatalog()
+    published = []
+    catalog.add_many = lambda nodes: published.append(CardCatalog.add_many(catalog, nodes))
+
+    asyncio.run(get_cards(FakeTransaction(resolve_cards(nodes)), make_requests(nodes), catalog))
+
+    # One copy of the catalog per batch of ids and per batch of names, not one per card
+    assert len(published) == 2
+    assert len(catalog) == 2_000
+    assert catalog.get_by_id(nodes[-1]["scryfall_id"]) == nodes[-1]
+
+
+def test_catalog_publishes_whole_snapshots():
+    catalog = CardCatalog()
+    catalog.build([{"scryfall_id": "a", "name_front": "A", "cmc": 1.0}])
+    snapshot = catalog._snapshot
+
+    # A card with new fields and a rebuild with other fields each publish a new snapshot, leaving the old one as it was
+    catalog.add({"scryfall_id": "b", "name_front": "B", "rarity": "rare"})
+    assert catalog.get_by_id("b") == {"scryfall_id": "b", "name_front": "B", "rarity": "rare"}
+    assert catalog.get_by_id("a") == {"scryfall_id": "a", "name_front": "A", "cmc": 1.0}
+    catalog.build([{"scryfall_id": "a", "name_front": "A", "types": ["Land"]}], version=2)
+    assert catalog.get_by_name("A") == {"scryfall_id": "a", "name_front": "A", "types": ["Land"]}
+    assert catalog.version == 2
+
+    assert snapshot.fields == ("cmc", "name_front", "scryfall_id")
+    assert len(snapshot.records) == 1 and "b" not in snapshot.by_id
+
+
+def test_catalog_reload_is_not_lost_to_a_concurrent_add():
+    catalog = CardCatalog()
+    catalog.build([{"scryfall_id": "a", "name_front": "A"}], version=1)
+    building, release = threading.Event(), threading.Event()
+
+    def build_snapshot(nodes, version=None):
+        building.set()
+        release.wait()
+        return CardCatalog.build_snapshot(nodes, version)
+
+    catalog.build_snapshot = build_snapshot
+
+    async def reload_while_adding():
+        load = asyncio.create_task(catalog.load(FakeDriver(lambda query, parameters: [{"node": {"scryfall_id": "b", "name_front": "B"}}]), version=2))
+        await asyncio.to_thread(building.wait)
+        # A read-through add on the event loop while the new snapshot is built in the worker thread
+        catalog.add({"scryfall_id": "c", "name_front": "C"})
+        release.set()
+        await load
+
+    asyncio.run(reload_while_adding())
+    assert catalog.version == 2
+    assert catalog.get_by_id("b") == {"scryfall_id": "b", "name_front": "B"}
+
+
+@pytest.mark.parametrize("scryfall_id", [
+    "782252ea-998b-4f6c-8f2a-6a1f0b0e1d2c",
+    "782252EA-998B-4F6C-8F2A-6A1F0B0E1D2C",
+    "782252ea998b4f6c8f2a6a1f0b0e1d2c",
+    " 782252ea-998b-4f6c-8f2a-6a1f0b0e1d2c ",
+])
+def test_request_card_normalizes_uuid(scryfall_id):
+    card = RequestUpdateCardCount(scryfall_id=scryfall_id, update_amount=1)
+    assert card.scryfall_id == "782252ea-998b-4f6c-8f2a-6a1f0b0e1d2c"
+
+
+def test_request_card_rejects_invalid_uuid():
+    with pytest.raises(ValueError):
+        RequestUpdateCardCount(scryfall_id="not-a-uuid", update_amount=1)
@@ -0,0 +1,31 @@
+import asyncio
+from api.service.suggestions import get_card_clusters_from_collection
+from tests.fakes import FakeTransaction
+
+
+def make_community(community_id, owned, card_ids, edges):
+    return {
+        "community_id": community_id,
+        "nodes": [{"scryfall_id": card_id} for card_id in owned],
+        "card_ids": card_ids,
+        "edge_src": [card_ids.index(a) for a, _, _ in edges],
+        "edge_dst": [card_ids.index(b) for _, b, _ in edges],
+        "edge_weights": [weight for _, _, weight in edges],
+    }
+
+
+def test_get_card_clusters_averages_owned_edges():
+    card_ids = ["a", "b", "c", "d"]
+    edges = [("a", "b", 1.0), ("b", "c", 3.0), ("c", "d", 100.0)]
+    communities = [
+        make_community(1, ["a", "b", "c"], card_ids, edges),
+        make_community(2, ["x", "y"], ["x", "y"], [("x", "y", 5.0)]),
+        # No edge between owned cards, so no synergy to rank it by
+        make_community(3, ["a", "d"], card_ids, edges),
+        make_community(4, ["a", "b"], card_ids, []),
+    ]
+
+    result = asyncio.run(get_card_clusters_from_collection(FakeTransaction(lambda query, parameters: communities), "uid"))
+
+    assert [(community["community_id"], community["average_synergy"]) for community in result] == [(2, 5.0), (1, 2.0)]
+    assert result[1]["nodes"] == [{"scryfall_id": "a"}, {"scryfall_id": "b"}, {"scryfall_id": "c"}]
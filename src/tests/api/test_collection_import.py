@@ -0,0 +1,106 @@
+import asyncio
+import uuid
+import pytest
+from api.service.collection import import_collection
+from tests.fakes import FakeDriver
+from utils.collection_import import CsvLineParser, InvalidLine, iter_lines, parse_text_line
+
+
+class CollectionStore(FakeDriver):
+    """ Resolves cards against an in-memory list and keeps the chunks written to the collection """
+    def __init__(self, nodes):
+        super().__init__(self.handle)
+        self.by_id = {node["scryfall_id"]: node for node in nodes}
+        self.by_name = {node["name_front"]: node for node in nodes}
+        self.chunks = []
+
+    def handle(self, query, parameters):
+        if "names" in parameters:
+            return [{"node": self.by_name[n]} for n in parameters["names"] if n in self.by_name]
+        if "scryfall_ids" in parameters:
+            return [{"node": self.by_id[i]} for i in parameters["scryfall_ids"] if i in self.by_id]
+        self.chunks.append({card["node"]["name_front"]: card["update_amount"] or card["number_owned"] for card in parameters["cards"]})
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def collect_lines(*chunks: bytes) -> list[str]:
+    async def collect():
+        return [line async for line in iter_lines(stream(*chunks))]
+    return asyncio.run(collect())
+
+
+def test_iter_lines_splits_across_chunks():
+    # The BOM is dropped, and a multi-byte character split between chunks is decoded once complete
+    data = "﻿4 Lightning Bolt\r\n2 Æther Vial\n1 Sol Ring".encode()
+    split = data.index("Æ".encode()) + 1
+    assert collect_lines(data[:5], data[5:split], data[split:]) == ["4 Lightning Bolt", "2 Æther Vial", "1 Sol Ring"]
+
+
+def test_parse_text_line():
+    assert parse_text_line("4 Lightning Bolt") == {"name": "Lightning Bolt", "quantity": 4}
+    assert parse_text_line("4x Lightning Bolt") == {"name": "Lightning Bolt", "quantity": 4}
+    assert parse_text_line("SB: 2 Duress") == {"name": "Duress", "quantity": 2}
+    assert parse_text_line("1 Llanowar Elves (DAR) 168") == {"name": "Llanowar Elves", "quantity": 1}
+    assert parse_text_line("1 Sol Ring (C21) 263 *F*") == {"name": "Sol Ring", "quantity": 1}
+    assert parse_text_line("1 Fire // Ice") == {"name": "Fire // Ice", "quantity": 1}
+    assert parse_text_line("Sideboard") is None
+    assert parse_text_line("// comment") is None
+    assert parse_text_line("") is None
+    with pytest.raises(InvalidLine):
+        parse_text_line("Lightning Bolt")
+
+
+def test_csv_line_parser():
+    parse = CsvLineParser()
+    assert parse('"Count","Tradelist Count","Name","Edition"') is None
+    assert parse('3,0,"Fire // Ice","Apocalypse"') == {"name": "Fire // Ice", "quantity": 3}
+    with pytest.raises(InvalidLine):
+        parse('three,0,"Sol Ring","Commander"')
+
+    parse = CsvLineParser()
+    parse("Name,Quantity,Scryfall ID")
+    assert parse("Sol Ring,1,abc") == {"scryfall_id": "abc", "quantity": 1}
+    assert parse("Sol Ring,1,") == {"name": "Sol Ring", "quantity": 1}
+
+    with pytest.raises(ValueError):
+        CsvLineParser()("Name,Edition")
+
+
+def make_nodes(n):
+    return [{"scryfall_id": str(uuid.uuid4()), "name_front": f"CARD {i}"} for i in range(n)]
+
+
+async def lines(*values):
+    for value in values:
+        yield value
+
+
+def test_import_collection_writes_chunks():
+    nodes = make_nodes(5)
+    collection = CollectionStore(nodes)
+    body = lines("4 Card 0", "2 Card 1", "1 Card 2", "not a card line", "1 Unknown Card", "3 Card 3", "2 Card 0", "1 Card 4")
+
+    summary = asyncio.run(import_collection(collection.session(), "user", body, "text", chunksize=3))
+
+    # Card 0 is written in two chunks, since it appears again after the first chunk was written.
+    # The unknown card takes a place in the second chunk, but is not written
+    assert collection.chunks == [{"CARD 0": 4, "CARD 1": 2, "CARD 2": 1}, {"CARD 3": 3, "CARD 0": 2}, {"CARD 4": 1}]
+    assert summary["imported"] == 13
+    assert summary["chunks"] == 3
+    assert summary["missing_cards"] == ["UNKNOWN CARD"]
+    assert summary["invalid_lines"] == [4]
+
+
+def test_import_collection_sets_quantities_once():
+    nodes = make_nodes(2)
+    collection = CollectionStore(nodes)
+    body = lines("Quantity,Name,Scryfall ID", f"1,,{nodes[1]['scryfall_id']}", "2,Card 0,", "1,Card 0,", "1,Card 9,not-an-id")
+
+    summary = asyncio.run(import_collection(collection.session(), "user", body, "csv", set_quantity=True, chunksize=1))
+
+    assert collection.chunks == [{"CARD 1": 1}, {"CARD 0": 3}]
+    assert summary["missing_cards"] == ["not-an-id"]
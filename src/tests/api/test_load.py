@@ -0,0 +1,51 @@
+import asyncio
+import httpx
+from api.main import app
+from config.settings import get_firebase_user_from_token
+from tests.fakes import FakeDriver
+
+QUERY_LATENCY = 0.02
+REQUESTS_PER_RUN = 48
+
+
+async def slow_query(query, parameters):
+    await asyncio.sleep(QUERY_LATENCY)
+    return []
+
+
+async def send_requests(concurrency: int) -> None:
+    """ Sends `REQUESTS_PER_RUN` requests, `concurrency` at a time """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get_pools():
+            async with semaphore:
+                response = await client.get("/pool/")
+                assert response.status_code == 200
+
+        await asyncio.gather(*[get_pools() for _ in range(REQUESTS_PER_RUN)])
+
+
+def run_with_driver(concurrency: int) -> FakeDriver:
+    driver = app.driver = FakeDriver(slow_query)
+    app.dependency_overrides[get_firebase_user_from_token] = lambda: {"uid": "test_user_id"}
+    try:
+        asyncio.run(send_requests(concurrency))
+    finally:
+        app.dependency_overrides.clear()
+        del app.driver
+    return driver
+
+
+def test_each_request_opens_its_own_session():
+    driver = run_with_driver(1)
+    assert driver.sessions == REQUESTS_PER_RUN
+    assert driver.max_active == 1
+
+
+def test_concurrent_requests_do_not_wait_on_a_shared_session():
+    # A session has a single connection, so transactions only overlap when requests have their own sessions
+    driver = run_with_driver(8)
+    assert driver.sessions == REQUESTS_PER_RUN
+    assert driver.max_active > 1
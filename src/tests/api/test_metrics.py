@@ -0,0 +1,99 @@
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from api.metrics import Histogram, InstrumentedSession, Metrics, MetricsMiddleware, run_query
+from api.service.pool import add_card_ids_to_pool, delete_pool, get_cards_in_pool, ignore_cards_in_pool, remove_cards_from_pool
+from tests.fakes import FakeDriver, FakeTransaction
+
+
+def handle_query(query, parameters):
+    if "pool_id" in parameters:
+        # Every pool query is anchored on an owned pool and returns its nodes
+        return [{"owned": True, "nodes": [{"scryfall_id": card_id} for card_id in parameters.get("card_ids", [])]}]
+    return [{"n": i} for i in range(parameters.get("n", 0))]
+
+
+async def get_three_cards(tx, n):
+    response = await run_query(tx, "three cards", "MATCH (c:Card) RETURN c LIMIT $n", n=n)
+    return await response.data()
+
+
+async def get_one_card(tx):
+    response = await run_query(tx, "one card", "MATCH (c:Card) RETURN c LIMIT 1", n=1)
+    return await response.single()
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, '/pool/"x"')
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/pool/\\"x\\"",le="0.1"} 1',
+        'latency_seconds_bucket{route="/pool/\\"x\\"",le="1.0"} 3',
+        'latency_seconds_bucket{route="/pool/\\"x\\"",le="+Inf"} 4',
+        'latency_seconds_sum{route="/pool/\\"x\\""} 6.05',
+        'latency_seconds_count{route="/pool/\\"x\\""} 4',
+    ]
+
+
+def test_queries_are_recorded_under_their_name():
+    metrics = Metrics(enabled=True)
+    session = InstrumentedSession(FakeDriver(handle_query).session(), metrics)
+
+    assert len(asyncio.run(session.execute_read(get_three_cards, 3))) == 3
+    assert asyncio.run(session.execute_read(get_one_card)) == {"n": 0}
+
+    assert metrics.query_duration.count("three cards") == 1
+    assert metrics.query_duration.count("one card") == 1
+    assert metrics.session_wait.count() == 2
+    text = metrics.render()
+    assert 'neo4j_query_records_sum{query="three cards"} 3' in text
+    assert 'neo4j_query_records_bucket{query="one card",le="1"} 1' in text
+
+
+def test_query_name_is_not_sent_without_metrics():
+    tx = FakeTransaction(handle_query)
+    asyncio.run(get_three_cards(tx, 3))
+    assert [parameters for _, parameters in tx.queries] == [{"n": 3}]
+
+
+def test_pool_queries_sharing_a_helper_have_their_own_names():
+    metrics = Metrics(enabled=True)
+    session = InstrumentedSession(FakeDriver(handle_query).session(), metrics)
+
+    asyncio.run(session.execute_read(get_cards_in_pool, "user", "pool"))
+    for operation in (add_card_ids_to_pool, ignore_cards_in_pool, remove_cards_from_pool):
+        asyncio.run(session.execute_write(operation, "user", "pool", ["a"]))
+    asyncio.run(session.execute_write(delete_pool, "user", "pool"))
+
+    for name in ("get_cards_in_pool", "add_card_ids_to_pool", "ignore_cards_in_pool", "remove_cards_from_pool", "delete_pool"):
+        assert metrics.query_duration.count(name) == 1
+    assert metrics.query_duration.count("unnamed") == 0
+
+
+def test_middleware_labels_requests_by_route():
+    metrics = Metrics(enabled=True)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get("/pool/{pool_id}")
+    async def get_pool(pool_id: str):
+        return {"pool_id": pool_id}
+
+    client = TestClient(app)
+    client.get("/pool/a")
+    client.get("/pool/b")
+    client.get("/missing")
+
+    assert metrics.request_duration.count("GET", "/pool/{pool_id}", 200) == 2
+    assert metrics.request_duration.count("GET", "unmatched", 404) == 1
+
+
+def test_metrics_endpoint_is_disabled_by_default():
+    from api.main import app
+
+    assert not app.metrics.enabled
+    assert TestClient(app).get("/metrics").status_code == 404
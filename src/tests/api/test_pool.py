@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from api.service.pool import add_card_ids_to_pool, delete_pool, get_cards_in_pool
+from tests.fakes import FakeTransaction
+
+
+def own_pools(pools):
+    """ Answers the ownership anchored pool queries """
+    def handle(query, parameters):
+        cards = pools.get((parameters["uid"], parameters["pool_id"]))
+        if cards is None:
+            # An unowned pool keeps the OPTIONAL MATCH row, unless the subquery eliminates it
+            return [] if "DETACH DELETE" in query else [{"owned": False, "nodes": []}]
+        return [{"owned": True, "nodes": [{"scryfall_id": card_id} for card_id in parameters.get("card_ids", cards)]}]
+    return handle
+
+
+@pytest.mark.parametrize("operation, args", [
+    (get_cards_in_pool, ()),
+    (add_card_ids_to_pool, (["a"],)),
+    (delete_pool, ()),
+])
+def test_pool_operations_check_ownership_in_one_query(operation, args):
+    tx = FakeTransaction(own_pools({("user", "pool"): ["a", "b"]}))
+    asyncio.run(operation(tx, "user", "pool", *args))
+    assert len(tx.queries) == 1
+    assert "(:User {uid: $uid})-[:HAS]->(p:Pool {pool_id: $pool_id})" in tx.queries[0][0]
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(operation(tx, "other", "pool", *args))
+    assert excinfo.value.status_code == 401
+    assert len(tx.queries) == 2
+
+
+def test_empty_pool_is_not_an_ownership_error():
+    tx = FakeTransaction(own_pools({("user", "pool"): []}))
+    assert asyncio.run(get_cards_in_pool(tx, "user", "pool")) == []
+    assert asyncio.run(get_cards_in_pool(FakeTransaction(own_pools({("user", "pool"): ["a"]})), "user", "pool")) == [{"node": {"scryfall_id": "a"}}]
@@ -0,0 +1,18 @@
+import asyncio
+import json
+from config.database import stream_ndjson
+from tests.fakes import FakeDriver
+
+
+def test_stream_ndjson_writes_one_line_per_record():
+    records = [
+        {"scryfall_id": "a", "name": "Card A", "img_uri": "https://example.com/a.jpg", "sync_score": 2.0},
+        {"scryfall_id": "b", "name": "Card B", "img_uri": "https://example.com/b.jpg", "sync_score": 1.0},
+    ]
+
+    async def collect():
+        return [line async for line in stream_ndjson(FakeDriver(lambda query, parameters: records), "RETURN 1", {})]
+
+    lines = asyncio.run(collect())
+    assert all(line.endswith("\n") for line in lines)
+    assert [json.loads(line) for line in lines] == records
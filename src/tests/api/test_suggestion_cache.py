@@ -0,0 +1,59 @@
+import asyncio
+from api.service.suggestions import get_card_suggestions
+from api.suggestion_cache import SuggestionCache
+from schemas.api.pool_suggestions import CardFilters, RequestCardSuggestions
+from tests.fakes import FakeTransaction
+
+params = RequestCardSuggestions(from_collection=False, filters=CardFilters(legalities=[], preserve_colors=False))
+
+
+class VersionedPool(FakeTransaction):
+    """ Answers the version query with `versions` and counts the suggestion queries """
+    def __init__(self, versions):
+        super().__init__(self.handle)
+        self.versions = versions
+        self.suggestion_queries = 0
+
+    def handle(self, query, parameters):
+        if "pool_version" in query:
+            return [self.versions]
+        self.suggestion_queries += 1
+        return [{"node": {"scryfall_id": "a"}, "sync_score": 1.0}]
+
+
+def test_cache_hits_and_misses():
+    cache = SuggestionCache(maxsize=10, ttl=60)
+    key = cache.key("user", "pool", {"pool_version": 1, "collection_version": 1}, params)
+    assert cache.get(key) is None
+    cache.set(key, [])
+    assert cache.get(key) == []
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_invalidation():
+    cache = SuggestionCache(maxsize=10, ttl=60)
+    versions = {"pool_version": 0, "collection_version": 0}
+    cache.set(cache.key("user", "pool_a", versions, params), [1])
+    cache.set(cache.key("user", "pool_b", versions, params), [2])
+    cache.set(cache.key("other", "pool_c", versions, params), [3])
+
+    cache.invalidate_pool("pool_a")
+    assert cache.stats()["size"] == 2
+    cache.invalidate_user("user")
+    assert cache.stats()["size"] == 1
+    assert cache.get(cache.key("other", "pool_c", versions, params)) == [3]
+
+
+def test_suggestions_are_recomputed_after_a_mutation():
+    cache = SuggestionCache(maxsize=10, ttl=60)
+    tx = VersionedPool({"pool_version": 0, "collection_version": 0})
+
+    asyncio.run(get_card_suggestions(tx, "user", "pool", params, cache=cache))
+    asyncio.run(get_card_suggestions(tx, "user", "pool", params, cache=cache))
+    assert tx.suggestion_queries == 1
+
+    # A write bumped the pool version, the cached entry must not be served
+    tx.versions = {"pool_version": 1, "collection_version": 0}
+    asyncio.run(get_card_suggestions(tx, "user", "pool", params, cache=cache))
+    assert tx.suggestion_queries == 2
@@ -0,0 +1,132 @@
+import asyncio
+import numpy as np
+from api.suggestion_engine import SuggestionEngine
+from schemas.api.mtg_card import mtg_card_legalities_list
+from schemas.api.pool_suggestions import CardFilters
+from tests.fakes import FakeDriver
+from utils.card import get_color_mask, get_legality_mask
+
+
+def make_card(scryfall_id, name_front=None, price_usd=1.0, colors=None, legal=True):
+    return {
+        "scryfall_id": scryfall_id,
+        "name_front": name_front or scryfall_id.upper(),
+        "price_usd": price_usd,
+        "color_mask": get_color_mask(colors),
+        "legality_mask": get_legality_mask(mtg_card_legalities_list if legal else []),
+    }
+
+
+no_filters = CardFilters(legalities=[], ignore_basic_lands=False, preserve_colors=False)
+
+
+def build_engine():
+    cards = [
+        make_card("pool_a", colors=["R"]),
+        make_card("pool_b", colors=["G"]),
+        make_card("owned", colors=["R"]),
+        make_card("expensive", price_usd=50.0),
+        make_card("blue", colors=["U"]),
+        make_card("forest", name_front="FOREST"),
+        make_card("banned", legal=False),
+        make_card("ignored"),
+        make_card("unconnected"),
+    ]
+    edges = [
+        ("pool_a", "owned", 1.0),
+        ("owned", "pool_b", 0.5),
+        ("pool_a", "expensive", 3.0),
+        ("blue", "pool_b", 2.0),
+        ("pool_a", "forest", 0.1),
+        ("banned", "pool_a", 0.2),
+        ("pool_b", "ignored", 5.0),
+        ("pool_a", "pool_b", 9.0),
+    ]
+    engine = SuggestionEngine()
+    engine.build(cards, edges)
+    return engine
+
+
+def test_suggest_ranks_by_summed_weight():
+    engine = build_engine()
+    result = engine.suggest(["pool_a", "pool_b"], ["ignored"], ["owned"], False, no_filters)
+    assert [scryfall_id for scryfall_id, _ in result] == ["expensive", "blue", "banned", "forest"]
+    assert result[0][1] == 3.0
+
+    result = engine.suggest(["pool_a", "pool_b"], ["ignored"], ["owned"], True, no_filters)
+    assert result == [("owned", 1.5)]
+
+
+def test_suggest_filters():
+    engine = build_engine()
+    filters = CardFilters(max_price=10.0, legalities=["modern"], ignore_basic_lands=True, preserve_colors=True)
+    result = engine.suggest(["pool_a", "pool_b"], [], [], False, filters)
+    assert [scryfall_id for scryfall_id, _ in result] == ["ignored", "owned"]
+
+
+def test_suggest_empty_pool():
+    engine = build_engine()
+    assert engine.suggest([], [], [], False, no_filters) == []
+
+
+def test_suggest_large_pool_matches_reference_scores():
+    rng = np.random.default_rng(0)
+    n_cards, n_edges = 2_000, 20_000
+    cards = [make_card(str(i)) for i in range(n_cards)]
+    pairs = rng.integers(0, n_cards, size=(n_edges, 2)).tolist()
+    # Whole weights are summed exactly in float32, so scores can be compared for equality
+    weights = rng.integers(1, 5, size=n_edges).tolist()
+    edges = [(str(a), str(b), float(weight)) for (a, b), weight in zip(pairs, weights)]
+    engine = SuggestionEngine()
+    engine.build(cards, edges)
+
+    pool = {str(i) for i in range(250)}
+    reference = {}
+    for a, b, weight in edges:
+        if a in pool:
+            reference[b] = reference.get(b, 0.0) + weight
+        if b in pool:
+            reference[a] = reference.get(a, 0.0) + weight
+    reference = {scryfall_id: score for scryfall_id, score in reference.items() if scryfall_id not in pool}
+
+    result = engine.suggest(sorted(pool), [], [], False, no_filters)
+    assert len(result) == 200
+    assert all(reference[scryfall_id] == score for scryfall_id, score in result)
+    assert [score for _, score in result] == sorted(reference.values(), reverse=True)[:200]
+
+
+class SynergyGraph(FakeDriver):
+    """ Keeps the cards, edges and ingest markers the engine loads from in memory """
+    def __init__(self, cards, edges):
+        super().__init__(self.handle)
+        self.cards = cards
+        self.edges = edges
+        self.versions = {}
+        self.loads = 0
+
+    def handle(self, query, parameters):
+        if "IngestVersion" in query:
+            return [{"version": self.versions.get(name)} for name in parameters["names"]]
+        if "CONNECTED" in query:
+            self.loads += 1
+            return [{"a": a, "b": b, "weight": weight} for a, b, weight in self.edges]
+        return self.cards
+
+
+def test_refresh_reloads_when_an_ingest_marker_changes():
+    driver = SynergyGraph([make_card("a"), make_card("b")], [("a", "b", 1.0)])
+    engine = SuggestionEngine()
+    asyncio.run(engine.refresh(driver))
+    assert engine.suggest(["a"], [], [], False, no_filters) == [("b", 1.0)]
+
+    # Nothing changed
+    asyncio.run(engine.refresh(driver))
+    assert driver.loads == 1
+
+    # set_relationships recomputed the weights, and a new card was connected by the decklist ingest
+    driver.cards.append(make_card("c"))
+    driver.edges = [("a", "b", 0.5), ("a", "c", 2.0)]
+    driver.versions = {"decklists": 1, "relationships": 2}
+    asyncio.run(engine.refresh(driver))
+    assert driver.loads == 2
+    assert engine.suggest(["a"], [], [], False, no_filters) == [("c", 2.0), ("b", 0.5)]
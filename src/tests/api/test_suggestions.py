@@ -0,0 +1,72 @@
+import asyncio
+from api.card_catalog import CardCatalog
+from api.service.suggestions import CYPHER_SUGGESTIONS_QUERIES, get_card_suggestions, get_cypher_card_suggestions_query, get_db_hits, hydrate_card_suggestions
+from schemas.api.pool_suggestions import CardFilters, RequestCardSuggestions
+from tests.fakes import FakeResult, FakeSummary, FakeTransaction
+
+
+PROFILE = {
+    "operatorType": "ProduceResults@neo4j",
+    "dbHits": 0,
+    "children": [
+        {"operatorType": "Expand(All)@neo4j", "dbHits": 120, "children": [{"operatorType": "NodeUniqueIndexSeek@neo4j", "dbHits": 2, "children": []}]},
+    ],
+}
+
+
+def handle_query(query, parameters):
+    if "pool_version" in query:
+        return [{"pool_version": 0, "collection_version": 0}]
+    return FakeResult([{"node": {"scryfall_id": "a"}, "sync_score": 1.0}], FakeSummary(profile=PROFILE, result_available_after=3))
+
+
+def suggestion_queries(tx) -> list[str]:
+    return [query for query, _ in tx.queries if "pool_version" not in query]
+
+
+def get_query(**filters) -> tuple[str, dict]:
+    params = RequestCardSuggestions(from_collection=False, filters=CardFilters(**{"legalities": [], **filters}))
+    return asyncio.run(get_cypher_card_suggestions_query(FakeTransaction(handle_query), "user", "pool", params))
+
+
+def test_filters_are_parameters_of_a_single_query():
+    query, parameters = get_query()
+    filtered_query, filtered_parameters = get_query(max_price=5.0, legalities=["modern", "legacy"], ignore_basic_lands=False, preserve_colors=False)
+
+    assert query == filtered_query == CYPHER_SUGGESTIONS_QUERIES[False]
+    assert parameters["max_price"] is None and parameters["legality_mask"] == 0
+    assert filtered_parameters["max_price"] == 5.0
+    assert filtered_parameters["legality_mask"] == (1 << 7) | (1 << 8)
+    assert not filtered_parameters["ignore_basic_lands"] and not filtered_parameters["preserve_colors"]
+
+
+def test_profile_mode_logs_db_hits(capsys):
+    tx = FakeTransaction(handle_query)
+    params = RequestCardSuggestions(from_collection=True, filters=CardFilters(legalities=[]))
+
+    asyncio.run(get_card_suggestions(tx, "user", "pool", params))
+    assert not suggestion_queries(tx)[0].startswith("PROFILE")
+
+    result = asyncio.run(get_card_suggestions(tx, "user", "pool", params, profile=True))
+    assert result == [{"node": {"scryfall_id": "a"}, "sync_score": 1.0}]
+    assert suggestion_queries(tx)[1] == "PROFILE " + CYPHER_SUGGESTIONS_QUERIES[False]
+    assert "PROFILE cypher: 122 db hits, 1 rows" in capsys.readouterr().out
+
+
+def test_get_db_hits_of_empty_profile():
+    assert get_db_hits({}) == 0
+
+
+def test_hydrate_compact_suggestions_without_images():
+    catalog = CardCatalog()
+    catalog.build([
+        {"scryfall_id": "a", "name_front": "A", "full_name": "A", "img_uris_normal": ["https://img/a"]},
+        {"scryfall_id": "b", "name_front": "B", "full_name": "B", "img_uris_normal": None},
+    ])
+    params = RequestCardSuggestions(from_collection=False, compact=True)
+
+    # Like the Cypher projection, a card without image URIs gets a null img_uri
+    assert hydrate_card_suggestions([("a", 2.0), ("b", 1.0)], params, catalog) == [
+        {"scryfall_id": "a", "name": "A", "img_uri": "https://img/a", "sync_score": 2.0},
+        {"scryfall_id": "b", "name": "B", "img_uri": None, "sync_score": 1.0},
+    ]
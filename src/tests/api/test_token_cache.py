@@ -0,0 +1,142 @@
+import asyncio
+import time
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from google.auth import crypt, jwt
+from firebase_admin import auth
+from api.token_cache import TokenCache, fetch_firebase_keys
+from config.settings import get_firebase_user_from_token
+
+# The signature check compares exp to the real clock, the cache and the mock key set to `keys.now`
+NOW = int(time.time())
+PROJECT_ID = "test-project"
+
+
+class MockKeySet:
+    """ Signs and verifies tokens with a local RSA key, standing in for the Firebase public keys """
+
+    def __init__(self):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        self.signer = crypt.RSASigner.from_string(private_pem, key_id="kid-1")
+        self.keys = {"kid-1": key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)}
+        self.now = NOW
+        self.verifications = 0
+        self.fetches = 0
+
+    def token(self, uid: str, exp: int) -> str:
+        payload = {"sub": uid, "aud": PROJECT_ID, "iat": NOW - 60, "exp": exp}
+        return jwt.encode(self.signer, payload).decode()
+
+    def verify(self, token: str) -> dict:
+        self.verifications += 1
+        claims = jwt.decode(token, certs=self.keys, audience=PROJECT_ID, verify=True)
+        if claims["exp"] <= self.now:
+            raise ValueError("Token expired")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def fetch_keys(self) -> dict:
+        self.fetches += 1
+        return self.keys
+
+
+@pytest.fixture(scope="module")
+def keys() -> MockKeySet:
+    return MockKeySet()
+
+
+def make_cache(keys: MockKeySet, maxsize: int = 10, max_ttl: float = 600) -> TokenCache:
+    keys.verifications = 0
+    keys.now = NOW
+    return TokenCache(maxsize, max_ttl, verify=keys.verify, fetch_keys=keys.fetch_keys, timer=lambda: keys.now)
+
+
+def test_verified_tokens_are_cached(keys):
+    cache = make_cache(keys)
+    token = keys.token("user", NOW + 3600)
+
+    for _ in range(3):
+        assert asyncio.run(cache.get_user(token))["uid"] == "user"
+    assert keys.verifications == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.key(token) != token
+
+
+def test_entries_expire_with_the_token(keys):
+    cache = make_cache(keys)
+    token = keys.token("user", NOW + 100)
+    asyncio.run(cache.get_user(token))
+
+    keys.now = NOW + 99
+    assert cache.get(token) is not None
+    # Once the token expires it is verified again, and rejected
+    keys.now = NOW + 100
+    assert cache.get(token) is None
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get_user(token))
+
+
+def test_entries_expire_after_max_ttl(keys):
+    cache = make_cache(keys, max_ttl=60)
+    token = keys.token("user", NOW + 3600)
+    asyncio.run(cache.get_user(token))
+
+    keys.now = NOW + 60
+    asyncio.run(cache.get_user(token))
+    assert keys.verifications == 2
+
+
+def test_invalid_tokens_are_not_cached(keys):
+    cache = make_cache(keys)
+    token = keys.token("user", NOW + 3600)
+    forged = token[:-4] + ("AAAA" if not token.endswith("AAAA") else "BBBB")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            asyncio.run(cache.get_user(forged))
+    assert keys.verifications == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_token_is_evicted(keys):
+    cache = make_cache(keys, maxsize=2)
+    a, b, c = (keys.token(uid, NOW + 3600) for uid in "abc")
+    for token in (a, b, a, c):
+        asyncio.run(cache.get_user(token))
+
+    assert cache.get(a) is not None
+    assert cache.get(b) is None
+
+
+def test_prefetch_keys(keys):
+    cache = make_cache(keys)
+    keys.fetches = 0
+    asyncio.run(cache.prefetch_keys())
+    assert keys.fetches == 1
+    assert cache.stats()["key_fetches"] == 1
+
+
+def test_fetch_keys_without_private_firebase_api(monkeypatch):
+    # firebase_admin does not expose the verifier's HTTP session publicly, so it may be gone in another release
+    monkeypatch.delattr(auth, "_get_client")
+    assert fetch_firebase_keys() is None
+
+    cache = TokenCache(10, 600, verify=lambda token: {}, fetch_keys=fetch_firebase_keys)
+    asyncio.run(cache.prefetch_keys())
+    assert cache.stats()["key_fetches"] == 0
+
+
+def test_dependency_rejects_missing_and_invalid_tokens(keys):
+    cache = make_cache(keys)
+    token = keys.token("user", NOW + 3600)
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    assert asyncio.run(get_firebase_user_from_token(credentials, cache))["uid"] == "user"
+    for credentials in (None, HTTPAuthorizationCredentials(scheme="Bearer", credentials="not a token")):
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(get_firebase_user_from_token(credentials, cache))
+        assert e.value.status_code == 401
@@ -0,0 +1,106 @@
+import numpy as np
+from db_processing.create_clusters import create_clusters_offline, get_community_edges
+from tests.fakes import FakeSyncDriver
+from utils.louvain import build_csr, louvain, modularity
+
+
+class CommunityGraph(FakeSyncDriver):
+    """ Answers the edge query with `edges` and keeps the communities written in memory """
+
+    def __init__(self, edges):
+        super().__init__(self.handle)
+        self.edges = edges
+        self.cleared = False
+        self.communities = []
+        self.membership_batches = []
+        self.community_edges = []
+
+    def handle(self, query, parameters):
+        if "RETURN a.scryfall_id" in query:
+            return [{"a": a, "b": b, "weight": weight} for a, b, weight in self.edges]
+        if "community_ids" in parameters:
+            self.communities.extend(parameters["community_ids"])
+        elif "communities" in parameters:
+            self.community_edges.extend(parameters["communities"])
+        elif "cards" in parameters:
+            self.membership_batches.append(parameters["cards"])
+        elif "DETACH DELETE" in query:
+            self.cleared = True
+
+
+def get_two_cliques_edges(size: int = 5) -> list[tuple[str, str, float]]:
+    """ Two cliques of strongly connected cards, joined by a single weak edge """
+    edges = []
+    for prefix in "ab":
+        for i in range(size):
+            for j in range(i + 1, size):
+                edges.append((f"{prefix}{i}", f"{prefix}{j}", 1.0))
+    edges.append(("a0", "b0", 0.1))
+    return edges
+
+
+def test_louvain_separates_cliques():
+    edges = get_two_cliques_edges()
+    ids = sorted({card for a, b, _ in edges for card in (a, b)})
+    index = {card: i for i, card in enumerate(ids)}
+    src = np.array([index[a] for a, _, _ in edges])
+    dst = np.array([index[b] for _, b, _ in edges])
+    weights = np.array([weight for _, _, weight in edges])
+
+    indptr, indices, csr_weights = build_csr(len(ids), src, dst, weights)
+    labels = louvain(indptr, indices, csr_weights)
+
+    communities = {card: labels[index[card]] for card in ids}
+    assert len(set(labels)) == 2
+    assert len({communities[f"a{i}"] for i in range(5)}) == 1
+    assert len({communities[f"b{i}"] for i in range(5)}) == 1
+    assert modularity(indptr, indices, csr_weights, labels) > modularity(indptr, indices, csr_weights, np.zeros(len(ids), dtype=np.int64))
+
+
+def test_louvain_recovers_planted_partition():
+    rng = np.random.default_rng(1)
+    n, k = 2_000, 20
+    groups = np.arange(n) % k
+    a = rng.integers(0, n, 40_000)
+    # Most edges stay inside the group of their first card
+    b = np.where(rng.random(a.size) < 0.8, (a + k * rng.integers(1, n // k, a.size)) % n, rng.integers(0, n, a.size))
+    keep = a != b
+    indptr, indices, weights = build_csr(n, a[keep], b[keep], rng.random(keep.sum()))
+
+    labels = louvain(indptr, indices, weights)
+
+    assert modularity(indptr, indices, weights, labels) >= modularity(indptr, indices, weights, groups) - 0.01
+
+
+def test_create_clusters_offline_writes_in_batches():
+    driver = CommunityGraph(get_two_cliques_edges())
+    stats = create_clusters_offline(driver, batch_size=4)
+
+    assert driver.cleared
+    assert stats["communities"] == 2
+    assert sorted(driver.communities) == [0, 1]
+    assert [len(batch) for batch in driver.membership_batches] == [4, 4, 2]
+
+    memberships = dict(card for batch in driver.membership_batches for card in batch)
+    assert len(memberships) == 10
+    assert memberships["a1"] == memberships["a4"] != memberships["b2"]
+
+    # Both cliques keep their 10 inner edges, the weak edge between them is dropped
+    assert sorted(len(community["edge_weights"]) for community in driver.community_edges) == [10, 10]
+    for community in driver.community_edges:
+        assert all(memberships[card_id] == community["id"] for card_id in community["card_ids"])
+
+
+def test_get_community_edges_indexes_members():
+    ids = ["a", "b", "c", "d", "e"]
+    labels = np.array([1, 0, 1, 0, 2])
+    src = np.array([0, 1, 2, 0, 4])
+    dst = np.array([2, 3, 1, 1, 0])
+    weights = np.array([0.5, 0.25, 1.0, 2.0, 3.0])
+
+    communities = get_community_edges(ids, src, dst, weights, labels)
+
+    assert communities == [
+        {"label": 0, "card_ids": ["b", "d"], "edge_src": [0], "edge_dst": [1], "edge_weights": [0.25]},
+        {"label": 1, "card_ids": ["a", "c"], "edge_src": [0], "edge_dst": [1], "edge_weights": [0.5]},
+    ]
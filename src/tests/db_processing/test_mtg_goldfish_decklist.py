@@ -0,0 +1,224 @@
+import asyncio
+import math
+from db_processing.mtg_goldfish_decklist import count_pairs, export_csv, get_unique_pairs_in_deck, ingest_data
+from tests.fakes import FakeDriver
+from utils.admin_import import read_csv, write_csv
+
+
+class DecklistGraph(FakeDriver):
+    """ Keeps the edges and decks the ingest writes in memory """
+
+    def __init__(self, cards):
+        super().__init__(self.handle)
+        self.cards = cards
+        self.edges = {}
+        self.decks = {}
+        self.dirty = set()
+        self.writes = 0
+        self.complete = None
+        self.fail_writes = False
+
+    def handle(self, query, parameters):
+        if "IngestVersion" in query:
+            if "complete" in parameters:
+                self.complete = parameters["complete"]
+                return
+            return [{"complete": self.complete, "has_edges": bool(self.edges)}]
+
+        if "names" in parameters:
+            return [{"name": name, "scryfall_id": self.cards[name]} for name in parameters["names"] if name in self.cards]
+
+        if "pairs" in parameters:
+            if self.fail_writes:
+                raise RuntimeError("write failed")
+            for a, b, delta in parameters["pairs"]:
+                self.writes += 1
+                self.edges[(a, b)] = self.edges.get((a, b), 0) + delta
+                if self.edges[(a, b)] <= 0:
+                    del self.edges[(a, b)]
+                self.dirty.update((a, b))
+            return
+
+        if "source" not in parameters:
+            # clear_relationships
+            if "CONNECTED" in query:
+                self.edges.clear()
+            else:
+                self.decks.clear()
+            return
+
+        source = parameters["source"]
+        if "removed" in parameters:
+            for deck in parameters["removed"]:
+                self.decks.pop((source, deck["key"]), None)
+        elif "added" in parameters:
+            for deck in parameters["added"]:
+                self.decks[(source, deck["key"])] = deck
+        else:
+            return [deck for (deck_source, _), deck in self.decks.items() if deck_source == source]
+
+
+def test_get_unique_pairs_in_deck_is_canonical():
+    pairs = list(get_unique_pairs_in_deck(["C", "A", "B", "A"]))
+    assert pairs == [("A", "B"), ("A", "C"), ("B", "C")]
+
+
+def test_get_unique_pairs_in_deck_skips_missing_names():
+    assert list(get_unique_pairs_in_deck(["A", None, "B"])) == [("A", "B")]
+
+
+def test_count_pairs_merges_decks():
+    decks = [["A", "B", "C"], ["C", "B"], ["B", "A"], ["D"]]
+    counts = count_pairs(decks)
+    assert counts == {("A", "B"): 2, ("A", "C"): 1, ("B", "C"): 2}
+
+
+def test_ingest_data_writes_each_pair_once():
+    driver = DecklistGraph({"A": "id-a", "B": "id-b", "C": "id-c"})
+    decks = {f"deck-{i}": ["A", "B", "C"] for i in range(500)}
+    decks["other"] = ["C", "A"]
+    stats = asyncio.run(ingest_data(driver, {"metagame": decks}, chunksize=2))
+
+    assert driver.edges == {("id-a", "id-b"): 500, ("id-a", "id-c"): 501, ("id-b", "id-c"): 500}
+    assert driver.writes == 3
+    assert stats["written"] == 3
+    assert stats["failed_chunks"] == []
+
+
+def test_ingest_data_reports_unresolved_names(tmp_path):
+    # Pairs are ordered by scryfall_id once resolved, not by name
+    driver = DecklistGraph({"A": "id-z", "B": "id-y"})
+    report_path = tmp_path / "unresolved_names.txt"
+    stats = asyncio.run(ingest_data(driver, {"metagame": {"deck": ["A", "B", "UNKNOWN", "MISSING"]}}, report_path=str(report_path)))
+
+    assert driver.edges == {("id-y", "id-z"): 1}
+    assert stats["unresolved"] == 2
+    assert report_path.read_text() == "MISSING\nUNKNOWN\n"
+
+
+def test_ingest_data_applies_deck_deltas():
+    driver = DecklistGraph({"A": "id-a", "B": "id-b", "C": "id-c", "D": "id-d"})
+    metagame = {"kept": ["A", "B"], "changed": ["A", "B", "C"], "removed": ["C", "D"]}
+    custom = {"custom": ["A", "B"]}
+    asyncio.run(ingest_data(driver, {"metagame": metagame, "custom": custom}))
+    assert driver.edges == {("id-a", "id-b"): 3, ("id-a", "id-c"): 1, ("id-b", "id-c"): 1, ("id-c", "id-d"): 1}
+
+    driver.writes = 0
+    driver.dirty.clear()
+    metagame = {"kept": ["A", "B"], "changed": ["A", "D"], "added": ["B", "D"]}
+    stats = asyncio.run(ingest_data(driver, {"metagame": metagame, "custom": custom}))
+
+    # Only pairs of the changed, added and removed decks are written, and edges without any deck are deleted
+    assert driver.edges == {("id-a", "id-b"): 2, ("id-a", "id-d"): 1, ("id-b", "id-d"): 1}
+    assert driver.writes == 6
+    assert driver.dirty == {"id-a", "id-b", "id-c", "id-d"}
+    assert stats["decks"] == {"metagame": {"added": 2, "removed": 2}, "custom": {"added": 0, "removed": 0}}
+
+    # Running again without changes writes nothing
+    driver.writes = 0
+    asyncio.run(ingest_data(driver, {"metagame": metagame, "custom": custom}))
+    assert driver.writes == 0
+
+
+def test_ingest_data_rebuilds_edges_without_recorded_decks():
+    # Edges of an ingest that predates the Deck nodes
+    driver = DecklistGraph({"A": "id-a", "B": "id-b", "C": "id-c"})
+    driver.edges = {("id-a", "id-b"): 5, ("id-a", "id-c"): 2}
+    asyncio.run(ingest_data(driver, {"metagame": {"deck": ["A", "B", "C"]}}))
+
+    assert driver.edges == {("id-a", "id-b"): 1, ("id-a", "id-c"): 1, ("id-b", "id-c"): 1}
+    assert driver.complete is True
+
+
+def test_ingest_data_rebuilds_edges_of_either_direction():
+    # Older ingests merged edges without a direction, so they may point from the higher scryfall_id to the lower one
+    driver = DecklistGraph({"A": "id-a", "B": "id-b"})
+    driver.edges = {("id-b", "id-a"): 5}
+    asyncio.run(ingest_data(driver, {"metagame": {"deck": ["A", "B"]}}))
+
+    # No parallel edge splits the sync of the pair
+    assert driver.edges == {("id-a", "id-b"): 1}
+
+
+def test_ingest_data_rebuilds_edges_after_a_failed_run():
+    driver = DecklistGraph({"A": "id-a", "B": "id-b", "C": "id-c"})
+    asyncio.run(ingest_data(driver, {"metagame": {"one": ["A", "B"]}}))
+
+    driver.fail_writes = True
+    stats = asyncio.run(ingest_data(driver, {"metagame": {"one": ["A", "B"], "two": ["A", "C"]}}, retries=0))
+    assert stats["failed_chunks"]
+    assert driver.complete is False
+    # The decks of the failed run are not recorded
+    assert list(driver.decks) == [("metagame", "one")]
+
+    # Pretend the failed run committed part of its chunks
+    driver.fail_writes = False
+    driver.edges[("id-a", "id-c")] = 1
+    asyncio.run(ingest_data(driver, {"metagame": {"one": ["A", "B"], "two": ["A", "C"]}}))
+    assert driver.edges == {("id-a", "id-b"): 1, ("id-a", "id-c"): 1}
+    assert driver.complete is True
+
+
+def test_export_csv(tmp_path):
+    write_csv(
+        str(tmp_path / "cards.csv"),
+        ["scryfall_id:ID(Card)", "name_front", ":LABEL"],
+        [["id-a", "A", "Card"], ["id-b", "B", "Card"], ["id-c", "C", "Card"], ["id-d", "D", "Card"]],
+    )
+    sources = {"metagame": {"one": ["A", "B", "C"], "two": ["B", "A", "UNKNOWN"]}, "custom": {"one": ["C", "B"]}}
+
+    stats = export_csv(sources, str(tmp_path))
+    # Exporting again replaces the total_recurrences column instead of adding a second one
+    stats = export_csv(sources, str(tmp_path))
+    assert stats == {"edges": 3, "decks": 3, "unresolved": 1}
+
+    header, rows = read_csv(str(tmp_path / "connected.csv"))
+    assert header == [":START_ID(Card)", ":END_ID(Card)", ":TYPE", "sync:long", "dynamicWeight:double"]
+    edges = {(row[0], row[1]): (int(row[3]), float(row[4])) for row in rows}
+    # Totals: a = 3, b = 4, c = 3
+    assert edges == {
+        ("id-a", "id-b"): (2, 2 / math.sqrt(7)),
+        ("id-a", "id-c"): (1, 1 / math.sqrt(6)),
+        ("id-b", "id-c"): (2, 2 / math.sqrt(7)),
+    }
+
+    header, rows = read_csv(str(tmp_path / "cards.csv"))
+    assert header == ["scryfall_id:ID(Card)", "name_front", ":LABEL", "total_recurrences:long"]
+    assert [row[3] for row in rows] == ["3", "4", "3", ""]
+
+    header, rows = read_csv(str(tmp_path / "decks.csv"))
+    assert [row[0] for row in rows] == ["metagame/one", "metagame/two", "custom/one"]
+    assert rows[1][4] == "id-a|id-b"
+
+    header, rows = read_csv(str(tmp_path / "ingest_versions.csv"))
+    assert [dict(zip(header, row))[column] for row in rows for column in ("name", "complete:boolean")] == ["decklists", "true"]
+
+
+def import_csv(directory) -> DecklistGraph:
+    """ Loads the exported CSVs into a fake database, like neo4j-admin database import """
+    _, rows = read_csv(str(directory / "cards.csv"))
+    driver = DecklistGraph({row[1]: row[0] for row in rows})
+    _, rows = read_csv(str(directory / "connected.csv"))
+    driver.edges = {(row[0], row[1]): int(row[3]) for row in rows}
+    _, rows = read_csv(str(directory / "decks.csv"))
+    driver.decks = {(row[1], row[2]): {"key": row[2], "hash": row[3], "cards": row[4].split("|")} for row in rows}
+    header, rows = read_csv(str(directory / "ingest_versions.csv"))
+    driver.complete = rows[0][header.index("complete:boolean")] == "true"
+    return driver
+
+
+def test_ingest_data_applies_deltas_on_top_of_an_import(tmp_path):
+    write_csv(
+        str(tmp_path / "cards.csv"),
+        ["scryfall_id:ID(Card)", "name_front", ":LABEL"],
+        [["id-a", "A", "Card"], ["id-b", "B", "Card"], ["id-c", "C", "Card"]],
+    )
+    export_csv({"metagame": {"one": ["A", "B"], "two": ["A", "C"]}}, str(tmp_path))
+    driver = import_csv(tmp_path)
+
+    stats = asyncio.run(ingest_data(driver, {"metagame": {"one": ["A", "B"], "two": ["A", "B", "C"]}}))
+
+    # Only the changed deck is written, the imported edges are kept instead of rebuilt
+    assert driver.edges == {("id-a", "id-b"): 2, ("id-a", "id-c"): 1, ("id-b", "id-c"): 1}
+    assert driver.writes == 2
+    assert stats["decks"] == {"metagame": {"added": 1, "removed": 1}}
@@ -0,0 +1,70 @@
+import asyncio
+from tests.fakes import FakeDriver, FakeResult, FakeSummary
+from utils.schema import SCHEMA, SCHEMA_VERSION, apply_schema, check_label_scans, find_label_scans
+
+
+class SchemaStore(FakeDriver):
+    """ Keeps the schema version marker and the statements run in memory, and plans every query with `plans` """
+
+    def __init__(self, version=None, plans=None):
+        super().__init__(self.handle)
+        self.version = version
+        self.statements = []
+        self.plans = plans
+
+    def handle(self, query, parameters):
+        if query.startswith("EXPLAIN"):
+            return FakeResult(summary=FakeSummary(plan=self.plans(query)))
+        if "RETURN v.version" in query:
+            return [{"version": self.version}]
+        if "SET v.version" in query:
+            self.version = parameters["version"]
+        else:
+            self.statements.append(query)
+
+
+def test_apply_schema_runs_once_per_version():
+    driver = SchemaStore()
+    assert asyncio.run(apply_schema(driver))
+    assert driver.statements == SCHEMA
+    assert driver.version == SCHEMA_VERSION
+
+    assert not asyncio.run(apply_schema(driver))
+    assert len(driver.statements) == len(SCHEMA)
+
+    assert asyncio.run(apply_schema(driver, force=True))
+    assert len(driver.statements) == 2 * len(SCHEMA)
+
+
+def test_schema_statements_are_idempotent():
+    assert all("IF NOT EXISTS" in query or query.startswith("DROP") and "IF EXISTS" in query for query in SCHEMA)
+    # Boolean legality flags are not indexed, the suggestion filters test legality_mask
+    assert not any(query.startswith("CREATE") and "legality_" in query for query in SCHEMA)
+
+
+def test_find_label_scans_in_nested_plan():
+    plan = {
+        "operatorType": "ProduceResults@neo4j",
+        "children": [{
+            "operatorType": "CartesianProduct@neo4j",
+            "children": [
+                {"operatorType": "NodeUniqueIndexSeek@neo4j", "args": {"Details": "UNIQUE u:User(uid) WHERE uid = $uid"}, "children": []},
+                {"operatorType": "NodeByLabelScan@neo4j", "args": {"Details": "c:Card"}, "children": []},
+            ],
+        }],
+    }
+    assert find_label_scans(plan) == ["NodeByLabelScan@neo4j c:Card"]
+    assert find_label_scans({"operatorType": "AllNodesScan@neo4j", "children": []}) == ["AllNodesScan@neo4j"]
+
+
+def test_check_label_scans_flags_scanned_queries():
+    def plans(query):
+        operator = "NodeByLabelScan@neo4j" if "full_name" in query else "NodeIndexSeek@neo4j"
+        return {"operatorType": operator, "args": {"Details": "c:Card"}, "children": []}
+
+    queries = {
+        "by id": ("MATCH (c:Card {scryfall_id: $id}) RETURN c", {"id": ""}),
+        "by name": ("MATCH (c:Card {full_name: $name}) RETURN c", {"name": ""}),
+    }
+    flagged = asyncio.run(check_label_scans(SchemaStore(plans=plans), queries))
+    assert flagged == {"by name": ["NodeByLabelScan@neo4j c:Card"]}
@@ -1,5 +1,11 @@
+import copy
+import json
+import time
 import uuid
-from db_processing.scryfall_bulk_data_injest import set_faces_data, set_legalities, preprocess_card_data
+from concurrent.futures import ProcessPoolExecutor
+from db_processing.scryfall_bulk_data_injest import set_faces_data, set_legalities, preprocess_card_data, load_card_chunks, validate, export_csv
+from utils.admin_import import get_column, read_csv
+from utils.db_processing import chunk_iterable, map_bounded
 from utils.card import get_formatted_card, get_fromatted_types
 from schemas.api.mtg_card import mtg_card_legalities_list 
 import pytest
@@ -118,4 +124,155 @@ sample_data = [
         'type_line': 'Creature',
         'legalities': {}
     }
-]
\ No newline at end of file
+]
+
+
+def make_scryfall_card(i: int, layout: str = "normal") -> dict:
+    """ Builds a card in the format of the Scryfall oracle_cards bulk data """
+    return {
+        "object": "card",
+        "id": str(uuid.uuid4()),
+        "name": f"Sample Card {i}",
+        "layout": layout,
+        "oracle_text": "Draw a card.",
+        "prices": {"usd": "0.25", "usd_foil": None, "eur": "0.20", "tix": None},
+        "colors": ["U"],
+        "cmc": 2.0,
+        "keywords": [],
+        "legalities": {legality: "legal" for legality in mtg_card_legalities_list},
+        "rarity": "common",
+        "type_line": "Instant",
+        "image_uris": {
+            "small": f"https://cards.scryfall.io/small/{i}.jpg",
+            "normal": f"https://cards.scryfall.io/normal/{i}.jpg",
+        },
+    }
+
+
+def test_load_card_chunks_from_local_file(tmp_path):
+    cards = [make_scryfall_card(i) for i in range(25)]
+    cards[3]["layout"] = "art_series"
+    path = tmp_path / "oracle_cards.json"
+    path.write_text(json.dumps(cards))
+
+    chunks = list(load_card_chunks(str(path), chunksize=10))
+
+    assert [len(chunk) for chunk in chunks] == [9, 10, 5]
+    record = chunks[0][0]
+    assert record["name_front"] == "SAMPLE CARD 0"
+    assert record["types"] == ["Instant"]
+    assert record["image_uris"]["normal"] == ["https://cards.scryfall.io/normal/0.jpg"]
+    assert record["legalities"]["modern"] is True
+    assert record["prices"]["usd"] == 0.25
+
+
+def test_load_card_chunks_whole_file(tmp_path):
+    path = tmp_path / "oracle_cards.json"
+    path.write_text(json.dumps([make_scryfall_card(i) for i in range(25)]))
+
+    streamed = [card for chunk in load_card_chunks(str(path), chunksize=10) for card in chunk]
+    whole_file = [card for chunk in load_card_chunks(str(path), chunksize=10, whole_file=True) for card in chunk]
+    assert whole_file == streamed
+
+
+def test_validate_rejects_cards_without_images():
+    card = make_scryfall_card(0)
+    del card["image_uris"]
+    with pytest.raises(Exception) as excinfo:
+        validate([card])
+    assert str(excinfo.value) == "Failed to validate data"
+
+
+def test_load_card_chunks_limit(tmp_path):
+    path = tmp_path / "oracle_cards.json"
+    path.write_text(json.dumps([make_scryfall_card(i) for i in range(25)]))
+
+    assert sum(len(chunk) for chunk in load_card_chunks(str(path), chunksize=10, limit=12)) == 12
+
+
+def test_preprocess_card_data_skips_art_series():
+    cards = [make_scryfall_card(i, layout="art_series" if i % 3 == 0 else "normal") for i in range(9)]
+    result = preprocess_card_data(cards)
+    assert [card["name_front"] for card in result] == [f"SAMPLE CARD {i}" for i in range(9) if i % 3]
+
+
+def test_preprocess_card_data_sets_masks():
+    card = make_scryfall_card(0)
+    card["colors"] = ["W", "G"]
+    card["legalities"]["modern"] = "banned"
+    [result] = preprocess_card_data([card])
+
+    assert result["color_mask"] == 0b10001
+    assert result["legality_mask"] == (1 << len(mtg_card_legalities_list)) - 1 - (1 << mtg_card_legalities_list.index("modern"))
+
+
+def test_load_card_chunks_with_worker_processes(tmp_path):
+    path = tmp_path / "oracle_cards.json"
+    path.write_text(json.dumps([make_scryfall_card(i) for i in range(25)]))
+
+    serial = [card["name_front"] for chunk in load_card_chunks(str(path), chunksize=10) for card in chunk]
+    parallel = [card["name_front"] for chunk in load_card_chunks(str(path), chunksize=10, workers=2) for card in chunk]
+    assert parallel == serial
+
+
+def test_preprocess_in_process_pool_matches_serial():
+    """ Preprocessing chunks in a process pool yields the same cards, in the same order, as a single serial pass """
+    n_cards, chunksize = 500, 100
+
+    data = [make_scryfall_card(i, layout="art_series" if i % 50 == 0 else "normal") for i in range(n_cards)]
+
+    # Preprocessing updates the cards in place, so each run gets its own copy
+    serial = preprocess_card_data(copy.deepcopy(data))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        chunks = chunk_iterable(copy.deepcopy(data), chunksize)
+        parallel = [card for chunk in map_bounded(executor, preprocess_card_data, chunks, max_pending=4) for card in chunk]
+
+    assert len(serial) == n_cards - n_cards // 50
+    assert parallel == serial
+
+
+@pytest.mark.benchmark
+def test_preprocess_benchmark():
+    """ Compares serial and process pool preprocessing of a synthetic 100k card dump """
+    n_cards, chunksize = 100_000, 5_000
+
+    def synthetic_dump():
+        return (make_scryfall_card(i, layout="art_series" if i % 50 == 0 else "normal") for i in range(n_cards))
+
+    data = list(synthetic_dump())
+    start = time.perf_counter()
+    serial = preprocess_card_data(data)
+    serial_time = time.perf_counter() - start
+
+    chunks = list(chunk_iterable(synthetic_dump(), chunksize))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        parallel = [card for chunk in map_bounded(executor, preprocess_card_data, chunks, max_pending=8) for card in chunk]
+    parallel_time = time.perf_counter() - start
+
+    print(f"preprocessed {n_cards} cards: serial {serial_time:.2f}s, process pool {parallel_time:.2f}s")
+    assert len(serial) == len(parallel) == n_cards - n_cards // 50
+
+
+def test_export_csv(tmp_path):
+    cards = [make_scryfall_card(i) for i in range(3)]
+    cards[1]["oracle_text"] = "Scry 1; draw a card."
+    path = tmp_path / "oracle_cards.json"
+    path.write_text(json.dumps(cards))
+
+    assert export_csv(str(path), str(tmp_path / "import"), chunksize=2) == 3
+
+    header, rows = read_csv(str(tmp_path / "import" / "cards.csv"))
+    assert header[0] == "scryfall_id:ID(Card)"
+    assert header[-1] == ":LABEL"
+    row = dict(zip(header, rows[1]))
+    assert row["scryfall_id:ID(Card)"] == cards[1]["id"]
+    assert row["name_front"] == "SAMPLE CARD 1"
+    assert row["name_back"] == ""
+    assert row["oracle_texts:string[]"] == "Scry 1; draw a card."
+    assert row["price_usd:double"] == "0.25"
+    assert row["price_tix:double"] == ""
+    assert row["legality_modern:boolean"] == "true"
+    assert row["color_mask:long"] == "2"
+    assert row[":LABEL"] == "Card"
+    assert [row[get_column(header, "name_front")] for row in rows] == ["SAMPLE CARD 0", "SAMPLE CARD 1", "SAMPLE CARD 2"]
@@ -0,0 +1,65 @@
+from db_processing.set_relationships import set_relationships
+from tests.fakes import FakeSyncDriver
+
+
+class RelationshipGraph(FakeSyncDriver):
+    """ Keeps the Dirty cards in memory and records the batches each recomputation ran on """
+
+    def __init__(self, cards, dirty):
+        super().__init__(self.handle)
+        self.cards = cards
+        self.dirty = set(dirty)
+        self.calls = []
+        self.version_bumps = 0
+
+    def handle(self, query, parameters):
+        if "MATCH (c:Card:Dirty)" in query:
+            return [{"scryfall_id": scryfall_id} for scryfall_id in sorted(self.dirty)]
+        if "IngestVersion" in query:
+            self.version_bumps += 1
+            return
+        if "SET c:Dirty" in query:
+            self.dirty = set(self.cards)
+            return
+
+        scryfall_ids = parameters["scryfall_ids"]
+        if "total_recurrences = totalSync" in query:
+            self.calls.append(("totals", scryfall_ids))
+        elif "dynamicWeight" in query:
+            self.calls.append(("weights", scryfall_ids))
+            return [{"edges": 10 * len(scryfall_ids)}]
+        elif "REMOVE c:Dirty" in query:
+            self.dirty -= set(scryfall_ids)
+
+
+def test_set_relationships_only_recomputes_dirty_cards():
+    driver = RelationshipGraph(["a", "b", "c", "d", "e"], ["b", "c", "e"])
+    stats = set_relationships(driver, batch_size=2)
+
+    # Every total is set before any weight, and each batch is its own transaction, followed by the version bump
+    assert driver.calls == [
+        ("totals", ["b", "c"]),
+        ("totals", ["e"]),
+        ("weights", ["b", "c"]),
+        ("weights", ["e"]),
+    ]
+    assert driver.write_transactions == 7
+    assert driver.version_bumps == 1
+    assert driver.dirty == set()
+    assert stats["cards"] == 3
+    assert stats["edges"] == 30
+
+
+def test_set_relationships_full_recomputes_every_card():
+    driver = RelationshipGraph(["a", "b", "c"], [])
+    stats = set_relationships(driver, batch_size=10, full=True)
+
+    assert driver.calls == [("totals", ["a", "b", "c"]), ("weights", ["a", "b", "c"])]
+    assert driver.dirty == set()
+    assert stats["cards"] == 3
+
+
+def test_set_relationships_without_dirty_cards_keeps_the_version():
+    driver = RelationshipGraph(["a", "b"], [])
+    set_relationships(driver)
+    assert driver.version_bumps == 0
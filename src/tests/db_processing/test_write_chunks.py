@@ -0,0 +1,37 @@
+import asyncio
+from tests.fakes import FakeDriver
+from utils.db_processing import write_chunks
+
+
+def test_write_chunks_writes_concurrently():
+    written = []
+
+    async def write(tx, chunk):
+        await asyncio.sleep(0.01)
+        written.extend(chunk)
+
+    driver = FakeDriver()
+    chunks = ([i * 10 + j for j in range(10)] for i in range(20))
+    stats = asyncio.run(write_chunks(driver, write, chunks, concurrency=4))
+
+    assert sorted(written) == list(range(200))
+    assert stats["written"] == 200
+    assert stats["failed_chunks"] == []
+    assert driver.max_active == 4
+
+
+def test_write_chunks_retries_failed_chunks():
+    attempts = {}
+
+    async def flaky_write(tx, chunk):
+        attempts[chunk[0]] = attempts.get(chunk[0], 0) + 1
+        if chunk[0] == 1 and attempts[1] < 3:
+            raise Exception("Transient failure")
+        if chunk[0] == 2:
+            raise Exception("Permanent failure")
+
+    stats = asyncio.run(write_chunks(FakeDriver(), flaky_write, [[0], [1], [2]], concurrency=2, retries=2, backoff=0.001))
+
+    assert attempts == {0: 1, 1: 3, 2: 3}
+    assert stats["written"] == 2
+    assert stats["failed_chunks"] == [3]
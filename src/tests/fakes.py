@@ -0,0 +1,170 @@
+import asyncio
+import inspect
+
+
+class FakeRecord(dict):
+    """ A record of a fake result, indexed by key like a driver record """
+
+    def data(self, *keys):
+        return {key: self[key] for key in keys} if keys else dict(self)
+
+
+class FakeSummary:
+    def __init__(self, profile=None, plan=None, result_available_after=0):
+        self.profile = profile
+        self.plan = plan
+        self.result_available_after = result_available_after
+
+
+class FakeResult:
+    """ The records of one query, read in any of the ways the async driver allows """
+
+    def __init__(self, records=(), summary=None):
+        self.records = list(records)
+        self.summary = summary or FakeSummary()
+
+    async def data(self, *keys):
+        return [FakeRecord(record).data(*keys) for record in self.records] if keys else self.records
+
+    async def single(self, strict=False):
+        return self.records[0] if self.records else None
+
+    async def consume(self):
+        return self.summary
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self.records:
+            yield FakeRecord(record)
+
+
+def as_result(records, result_class=FakeResult):
+    """ A handler returns the records of the query, a result when it needs a summary, or None when it writes only """
+    if isinstance(records, result_class):
+        return records
+    return result_class(records or ())
+
+
+class FakeTransaction:
+    """
+    Routes every query to `handler(query, parameters)` and records the queries it ran.
+    The handler may be a coroutine function, to stand in for a slow query.
+    """
+
+    def __init__(self, handler, queries=None):
+        self.handler = handler
+        self.queries = [] if queries is None else queries
+
+    async def run(self, query, parameters=None, **kwparameters):
+        parameters = {**(parameters or {}), **kwparameters}
+        self.queries.append((query, parameters))
+        records = self.handler(query, parameters)
+        if inspect.isawaitable(records):
+            records = await records
+        return as_result(records)
+
+
+class FakeSession:
+    """ One connection, so the transactions of a session run one at a time """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def run(self, query, parameters=None, **kwparameters):
+        return await FakeTransaction(self.driver.handler, self.driver.queries).run(query, parameters, **kwparameters)
+
+    async def _execute(self, transaction_function, args, kwargs):
+        async with self._lock:
+            self.driver.active += 1
+            self.driver.max_active = max(self.driver.max_active, self.driver.active)
+            try:
+                return await transaction_function(FakeTransaction(self.driver.handler, self.driver.queries), *args, **kwargs)
+            finally:
+                self.driver.active -= 1
+
+    async def execute_read(self, transaction_function, *args, **kwargs):
+        self.driver.read_transactions += 1
+        return await self._execute(transaction_function, args, kwargs)
+
+    async def execute_write(self, transaction_function, *args, **kwargs):
+        self.driver.write_transactions += 1
+        return await self._execute(transaction_function, args, kwargs)
+
+
+class FakeDriver:
+    """ Stand-in for the async Neo4j driver, answering every query of its sessions with `handler` """
+
+    def __init__(self, handler=lambda query, parameters: None):
+        self.handler = handler
+        self.queries = []
+        self.sessions = 0
+        self.read_transactions = 0
+        self.write_transactions = 0
+        self.active = 0
+        self.max_active = 0
+
+    def session(self, **kwargs):
+        self.sessions += 1
+        return FakeSession(self)
+
+
+class FakeSyncResult(FakeResult):
+    """ The records of one query, read in any of the ways the sync driver allows """
+
+    def data(self, *keys):
+        return [FakeRecord(record).data(*keys) for record in self.records] if keys else self.records
+
+    def single(self, strict=False):
+        return self.records[0] if self.records else None
+
+    def consume(self):
+        return self.summary
+
+    def __iter__(self):
+        return (FakeRecord(record) for record in self.records)
+
+
+class FakeSyncTransaction(FakeTransaction):
+    def run(self, query, parameters=None, **kwparameters):
+        parameters = {**(parameters or {}), **kwparameters}
+        self.queries.append((query, parameters))
+        return as_result(self.handler(query, parameters), FakeSyncResult)
+
+
+class FakeSyncSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def run(self, query, parameters=None, **kwparameters):
+        return FakeSyncTransaction(self.driver.handler, self.driver.queries).run(query, parameters, **kwparameters)
+
+    def execute_read(self, transaction_function, *args, **kwargs):
+        self.driver.read_transactions += 1
+        return transaction_function(FakeSyncTransaction(self.driver.handler, self.driver.queries), *args, **kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        self.driver.write_transactions += 1
+        return transaction_function(FakeSyncTransaction(self.driver.handler, self.driver.queries), *args, **kwargs)
+
+
+class FakeSyncDriver(FakeDriver):
+    """ Stand-in for the sync Neo4j driver, used by the offline processing scripts """
+
+    def session(self, **kwargs):
+        self.sessions += 1
+        return FakeSyncSession(self)
@@ -0,0 +1,52 @@
+import csv
+import os
+from typing import Any, Iterable
+
+# Helpers to write the CSV files read by `neo4j-admin database import full`, see README.md
+
+# Passed to neo4j-admin as --array-delimiter. Oracle texts contain ";", the default.
+# They also contain line breaks, which csv.writer quotes as multi-line fields, so the import also needs --multiline-fields=true
+ARRAY_DELIMITER = "|"
+
+
+def format_csv_value(value: Any) -> str:
+    """ Formats a property value as neo4j-admin reads it. Missing values are left empty, so no property is created """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        values = [format_csv_value(item) for item in value]
+        if any(ARRAY_DELIMITER in item for item in values):
+            raise ValueError(f"Array value contains the array delimiter {ARRAY_DELIMITER!r}: {value}")
+        return ARRAY_DELIMITER.join(values)
+    return str(value)
+
+
+def write_csv(path: str, header: list[str], rows: Iterable[Iterable[Any]]) -> int:
+    """ Writes a CSV file with its header on the first line, returning the number of rows written """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([format_csv_value(value) for value in row])
+            count += 1
+    return count
+
+
+def read_csv(path: str) -> tuple[list[str], list[list[str]]]:
+    """ Reads a CSV file written by `write_csv`, returning its header and raw rows """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, list(reader)
+
+
+def get_column(header: list[str], name: str) -> int:
+    """ Finds a column by its property name, ignoring its neo4j-admin type, e.g. "scryfall_id" for "scryfall_id:ID(Card)" """
+    for i, column in enumerate(header):
+        if column.split(":")[0] == name:
+            return i
+    raise ValueError(f"No {name} column in {header}")
@@ -1,5 +1,16 @@
 import re
 import unicodedata
+from typing import Iterable
+from schemas.api.mtg_card import mtg_card_legalities_list
+
+BASIC_LANDS = ['PLAINS', 'ISLAND', 'SWAMP', 'MOUNTAIN', 'FOREST']
+
+# Bit position of each color in a color mask, in WUBRG order
+COLOR_BITS = {color: 1 << i for i, color in enumerate("WUBRG")}
+ALL_COLORS_MASK = (1 << len(COLOR_BITS)) - 1
+
+# Bit position of each format in a legality mask, in the order of `mtg_card_legalities_list`
+LEGALITY_BITS = {legality: 1 << i for i, legality in enumerate(mtg_card_legalities_list)}
 
 def get_fromatted_types(text: str) -> list[str]:
     return re.split(r' // | — ', text)
@@ -16,4 +27,18 @@ def get_formatted_card(cardName: str | None) -> list[str]:
     if " // " in cardName:
         return cardName.split(" // ")
     else:
-        return [cardName, None]
\ No newline at end of file
+        return [cardName, None]
+
+def get_color_mask(colors: list[str] | None) -> int:
+    """ Packs a list of colors into a WUBRG bitmask """
+    mask = 0
+    for color in colors or []:
+        mask |= COLOR_BITS.get(color, 0)
+    return mask
+
+def get_legality_mask(legalities: Iterable[str]) -> int:
+    """ Packs the formats a card is legal in into a bitmask """
+    mask = 0
+    for legality in legalities:
+        mask |= LEGALITY_BITS[legality]
+    return mask
@@ -0,0 +1,84 @@
+import codecs
+import csv
+import re
+from collections.abc import AsyncIterable, AsyncIterator
+
+# "4 Lightning Bolt", "4x Lightning Bolt", "SB: 2 Duress" (MTGO) or "1 Llanowar Elves (DAR) 168 *F*" (Arena, Moxfield)
+TEXT_LINE_PATTERN = re.compile(r"^(?:SB:\s*)?(\d+)\s*x?\s+(.+?)(?:\s+\([A-Za-z0-9]+\)(?:\s+[\w-]+)?)?(?:\s+\*[A-Z]+\*)?\s*$")
+TEXT_SECTION_HEADERS = {"deck", "sideboard", "commander", "companion", "maybeboard"}
+
+# Column names used by the collection exports of common deck building sites
+CSV_QUANTITY_COLUMNS = {"count", "quantity", "qty", "amount"}
+CSV_NAME_COLUMNS = {"name", "card name", "card"}
+CSV_SCRYFALL_ID_COLUMNS = {"scryfall id", "scryfall_id", "scryfallid"}
+
+
+class InvalidLine(ValueError):
+    pass
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """ Splits a stream of UTF-8 bytes into lines as they arrive, without buffering more than one line """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+def parse_text_line(line: str) -> dict | None:
+    """ Parses an MTGO or Arena decklist line into a card entry. Returns None for blank lines, comments and section headers """
+    line = line.strip()
+    if not line or line.startswith("//") or line.lower().rstrip(":") in TEXT_SECTION_HEADERS:
+        return None
+
+    match = TEXT_LINE_PATTERN.match(line)
+    if not match:
+        raise InvalidLine(line)
+    return {"name": match.group(2), "quantity": int(match.group(1))}
+
+
+class CsvLineParser:
+    """ Parses a CSV collection export line by line, finding the quantity, name and Scryfall id columns from its header """
+
+    def __init__(self):
+        self.quantity = None
+        self.name = None
+        self.scryfall_id = None
+
+    def parse_header(self, row: list[str]) -> None:
+        columns = [column.strip().lower() for column in row]
+        find = lambda names: next((i for i, column in enumerate(columns) if column in names), None)
+        self.quantity, self.name, self.scryfall_id = find(CSV_QUANTITY_COLUMNS), find(CSV_NAME_COLUMNS), find(CSV_SCRYFALL_ID_COLUMNS)
+        if self.quantity is None or (self.name is None and self.scryfall_id is None):
+            raise ValueError(f"The CSV header needs a quantity column and a name or Scryfall id column: {row}")
+
+    def __call__(self, line: str) -> dict | None:
+        if not line.strip():
+            return None
+        row = next(csv.reader([line]))
+        if self.quantity is None:
+            self.parse_header(row)
+            return None
+
+        try:
+            quantity = int(row[self.quantity])
+            scryfall_id = row[self.scryfall_id].strip() if self.scryfall_id is not None else ""
+            name = row[self.name].strip() if self.name is not None else ""
+        except (IndexError, ValueError):
+            raise InvalidLine(line)
+
+        if scryfall_id:
+            return {"scryfall_id": scryfall_id, "quantity": quantity}
+        if name:
+            return {"name": name, "quantity": quantity}
+        raise InvalidLine(line)
+
+
+def get_line_parser(format: str):
+    return CsvLineParser() if format == "csv" else parse_text_line
@@ -1,7 +1,13 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
 from functools import lru_cache
 from dotenv import load_dotenv
 from config.settings import Settings
-from typing import Iterator
+from itertools import islice
+from neo4j import AsyncDriver
+from typing import Any, Awaitable, Callable, Iterable, Iterator
 
 @lru_cache()
 def get_settings():
@@ -9,9 +15,79 @@ def get_settings():
     # Use lru_cache to avoid loading .env file for every request
     return Settings()
 
-def chunk_iterable(item_list: list, chunksize: int) -> Iterator[list]:
+def chunk_iterable(item_list: Iterable, chunksize: int) -> Iterator[list]:
     """
-    Break a large iterable into an iterable of smaller iterables of size `chunksize`
+    Break a large iterable into an iterable of smaller iterables of size `chunksize`.
+    Items are pulled lazily, so generators are never fully loaded into memory
     """
-    for i in range(0, len(item_list), chunksize):
-        yield item_list[i : i + chunksize]
\ No newline at end of file
+    iterator = iter(item_list)
+    while chunk := list(islice(iterator, chunksize)):
+        yield chunk
+
+
+def map_bounded(executor: Executor, fn: Callable, iterable: Iterable, max_pending: int) -> Iterator:
+    """
+    Like `executor.map`, but only submits `max_pending` items ahead of the consumer instead of the whole iterable.
+    Results are yielded in order
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+async def write_chunks(
+    driver: AsyncDriver,
+    transaction_function: Callable[..., Awaitable[Any]],
+    chunks: Iterable[list],
+    concurrency: int = 4,
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> dict:
+    """
+    Writes each chunk with `transaction_function`, using `concurrency` sessions from the driver pool.
+    Chunks are pulled from `chunks` in a worker thread, so producing chunk k+1 overlaps with writing chunk k.
+    A failed chunk is retried `retries` times with exponential backoff before it is reported as failed.
+    Only use this for chunks that cannot conflict with each other, e.g. MERGEs on distinct unique keys
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    stats = {"written": 0, "failed_chunks": []}
+
+    async def produce():
+        iterator = iter(chunks)
+        try:
+            idx = 0
+            while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+                await queue.put((idx, chunk))
+                idx += 1
+        finally:
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def write():
+        async with driver.session(database="neo4j") as session:
+            while (item := await queue.get()) is not None:
+                idx, chunk = item
+                for attempt in range(retries + 1):
+                    try:
+                        await session.execute_write(transaction_function, chunk)
+                        stats["written"] += len(chunk)
+                        print(f"Processed chunk #{idx + 1}")
+                        break
+                    except Exception as e:
+                        if attempt == retries:
+                            print(f"{e}: Failed to ingest chunk #{idx + 1}")
+                            stats["failed_chunks"].append(idx + 1)
+                        else:
+                            delay = backoff * 2 ** attempt
+                            print(f"{e}: Retrying chunk #{idx + 1} in {delay:.1f}s")
+                            await asyncio.sleep(delay)
+
+    start = time.perf_counter()
+    await asyncio.gather(produce(), *[write() for _ in range(concurrency)])
+    stats["elapsed"] = time.perf_counter() - start
+    stats["per_second"] = stats["written"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
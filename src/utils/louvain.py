@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def build_csr(n: int, src: np.ndarray, dst: np.ndarray, weights: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds the symmetric CSR adjacency of an undirected graph from each of its edges stored once.
+    The neighbors of node `i` are `indices[indptr[i]:indptr[i + 1]]` with the matching `weights`
+    """
+    src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    weights = np.concatenate([weights, weights]).astype(np.float64)
+    order = np.argsort(src, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))]).astype(np.int64)
+    return indptr, dst[order].astype(np.int64), weights[order]
+
+
+def modularity(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, labels: np.ndarray, resolution: float = 1.0) -> float:
+    m2 = weights.sum()
+    if not m2:
+        return 0.0
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    internal = np.bincount(labels[rows], weights=weights * (labels[rows] == labels[indices]), minlength=labels.max() + 1)
+    totals = np.bincount(labels[rows], weights=weights, minlength=labels.max() + 1)
+    return float((internal / m2 - resolution * (totals / m2) ** 2).sum())
+
+
+def _move_nodes(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, resolution: float, rng: np.random.Generator) -> tuple[np.ndarray, bool]:
+    """ Moves each node to the neighboring community with the best modularity gain until no move improves it """
+    n = len(indptr) - 1
+    m2 = weights.sum()
+    degrees = np.bincount(np.repeat(np.arange(n), np.diff(indptr)), weights=weights, minlength=n)
+    communities = np.arange(n)
+    totals = degrees.copy()
+    moved_any = False
+
+    moved = True
+    while moved:
+        moved = False
+        for i in rng.permutation(n):
+            start, end = indptr[i], indptr[i + 1]
+            if start == end:
+                continue
+            neighbors = indices[start:end]
+            not_self = neighbors != i
+            neighbor_communities = communities[neighbors[not_self]]
+            if not neighbor_communities.size:
+                continue
+
+            current = communities[i]
+            totals[current] -= degrees[i]
+
+            # Summed edge weight from i into each neighboring community
+            candidates, inverse = np.unique(neighbor_communities, return_inverse=True)
+            links = np.bincount(inverse, weights=weights[start:end][not_self])
+            gains = links - resolution * totals[candidates] * degrees[i] / m2
+
+            own = np.searchsorted(candidates, current)
+            current_gain = gains[own] if own < candidates.size and candidates[own] == current else -resolution * totals[current] * degrees[i] / m2
+            best = np.argmax(gains)
+
+            if gains[best] > current_gain + 1e-12:
+                current = candidates[best]
+                communities[i] = current
+                moved = moved_any = True
+            totals[current] += degrees[i]
+
+    return communities, moved_any
+
+
+def _aggregate(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, communities: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Collapses each community into a single node, summing the weights of the edges between them """
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    keys = communities[rows] * k + communities[indices]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    aggregated_weights = np.bincount(inverse, weights=weights)
+    src, dst = unique_keys // k, unique_keys % k
+    aggregated_indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=k))]).astype(np.int64)
+    return aggregated_indptr, dst, aggregated_weights
+
+
+def louvain(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, resolution: float = 1.0, seed: int | None = 0, max_levels: int = 10) -> np.ndarray:
+    """
+    Louvain community detection on a symmetric CSR graph, see `build_csr`.
+    Returns the community of every node, numbered from 0 in order of first appearance
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.arange(len(indptr) - 1)
+
+    for _ in range(max_levels):
+        communities, moved = _move_nodes(indptr, indices, weights, resolution, rng)
+        if not moved:
+            break
+        unique, communities = np.unique(communities, return_inverse=True)
+        labels = communities[labels]
+        indptr, indices, weights = _aggregate(indptr, indices, weights, communities, len(unique))
+
+    _, first, labels = np.unique(labels, return_index=True, return_inverse=True)
+    # np.unique numbers the communities by their old label, renumber them by their first node
+    return np.argsort(np.argsort(first))[labels]
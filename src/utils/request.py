@@ -8,4 +8,15 @@ def fetch_url(url: str) -> dict:
     # Parse the HTML content
         return response.json()
     else:
-        raise Exception(f"Failed to retrieve the webpage. Status code: {response.status_code}")
\ No newline at end of file
+        raise Exception(f"Failed to retrieve the webpage. Status code: {response.status_code}")
+
+def download_file(url: str, path: str, chunk_size: int = 1 << 20) -> str:
+    """ Streams a file to disk without holding it in memory """
+    with requests.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to download {url}. Status code: {response.status_code}")
+
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    return path
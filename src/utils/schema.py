@@ -0,0 +1,110 @@
+from neo4j import AsyncDriver, Driver
+from schemas.api.mtg_card import mtg_card_legalities_list
+
+# Every constraint and index the API and the db_processing scripts rely on. Statements are idempotent,
+# so bump SCHEMA_VERSION whenever one is added or dropped and every process applies the change on its next start
+SCHEMA_VERSION = 2
+
+CONSTRAINTS = [
+    "CREATE CONSTRAINT name_front IF NOT EXISTS FOR (c:Card) REQUIRE c.name_front IS UNIQUE",
+    "CREATE CONSTRAINT scryfall_id IF NOT EXISTS FOR (c:Card) REQUIRE c.scryfall_id IS UNIQUE",
+    "CREATE CONSTRAINT user_uid IF NOT EXISTS FOR (u:User) REQUIRE u.uid IS UNIQUE",
+    "CREATE CONSTRAINT pool_id IF NOT EXISTS FOR (p:Pool) REQUIRE p.pool_id IS UNIQUE",
+    "CREATE CONSTRAINT card_community_id IF NOT EXISTS FOR (c:CardCommunity) REQUIRE c.id IS UNIQUE",
+    "CREATE CONSTRAINT deck_key IF NOT EXISTS FOR (d:Deck) REQUIRE (d.source, d.key) IS UNIQUE",
+    "CREATE CONSTRAINT ingest_version_name IF NOT EXISTS FOR (v:IngestVersion) REQUIRE v.name IS UNIQUE",
+    "CREATE CONSTRAINT schema_version_name IF NOT EXISTS FOR (v:SchemaVersion) REQUIRE v.name IS UNIQUE",
+]
+
+INDEXES = [
+    "CREATE INDEX price_usd IF NOT EXISTS FOR (c:Card) ON (c.price_usd)",
+]
+
+# Indexes of earlier versions that no query seeks on. The suggestion filters test `legality_mask` instead of the
+# boolean flags, and every index costs a write per card on each ingest
+DROPPED_INDEXES = [
+    "DROP INDEX full_name IF EXISTS",
+    *[f"DROP INDEX legality_{legality} IF EXISTS" for legality in mtg_card_legalities_list],
+]
+
+SCHEMA = CONSTRAINTS + INDEXES + DROPPED_INDEXES
+
+GET_SCHEMA_VERSION_QUERY = """
+OPTIONAL MATCH (v:SchemaVersion {name: 'schema'})
+RETURN v.version AS version
+"""
+
+SET_SCHEMA_VERSION_QUERY = """
+MERGE (v:SchemaVersion {name: 'schema'})
+SET v.version = $version, v.updated_at = datetime()
+"""
+
+
+async def apply_schema(driver: AsyncDriver, force: bool = False) -> bool:
+    """ Creates the missing constraints and indexes, unless the database is already at SCHEMA_VERSION. Returns whether it ran """
+    async with driver.session(database="neo4j") as session:
+        result = await session.run(GET_SCHEMA_VERSION_QUERY)
+        record = await result.single()
+        if not force and (record["version"] or 0) >= SCHEMA_VERSION:
+            return False
+
+        # Schema statements cannot share a transaction with writes, so each runs in its own auto-commit transaction
+        for query in SCHEMA:
+            await (await session.run(query)).consume()
+        await (await session.run(SET_SCHEMA_VERSION_QUERY, version=SCHEMA_VERSION)).consume()
+        print(f"Applied schema version {SCHEMA_VERSION}")
+        return True
+
+
+def apply_schema_sync(driver: Driver, force: bool = False) -> bool:
+    """ `apply_schema` for the scripts using the sync driver """
+    with driver.session(database="neo4j") as session:
+        record = session.run(GET_SCHEMA_VERSION_QUERY).single()
+        if not force and (record["version"] or 0) >= SCHEMA_VERSION:
+            return False
+
+        for query in SCHEMA:
+            session.run(query).consume()
+        session.run(SET_SCHEMA_VERSION_QUERY, version=SCHEMA_VERSION).consume()
+        print(f"Applied schema version {SCHEMA_VERSION}")
+        return True
+
+
+# Operators that read every node of a label, or every node, instead of seeking an index
+SCAN_OPERATORS = ("NodeByLabelScan", "AllNodesScan")
+
+# The lookups the API and the scripts anchor their queries on, with parameters of the right type
+CHECKED_QUERIES = {
+    "user by uid": ("MATCH (u:User {uid: $uid}) RETURN u", {"uid": ""}),
+    "owned pool": ("MATCH (:User {uid: $uid})-[:HAS]->(p:Pool {pool_id: $pool_id}) RETURN p", {"uid": "", "pool_id": ""}),
+    "card by scryfall_id": ("UNWIND $ids AS id MATCH (c:Card {scryfall_id: id}) RETURN c", {"ids": [""]}),
+    "card by name_front": ("UNWIND $names AS name MATCH (c:Card {name_front: name}) RETURN c", {"names": [""]}),
+    "community by id": ("UNWIND $ids AS id MATCH (c:CardCommunity {id: id}) RETURN c", {"ids": [0]}),
+    "deck by key": ("MATCH (d:Deck {source: $source, key: $key}) RETURN d", {"source": "", "key": ""}),
+    "cards under a price": ("MATCH (c:Card) WHERE c.price_usd <= $price RETURN c", {"price": 0.0}),
+}
+
+
+def find_label_scans(plan: dict) -> list[str]:
+    """ Returns the label scan operators of an EXPLAIN plan, e.g. "NodeByLabelScan@neo4j (c:Card)" """
+    scans = []
+    operator = plan.get("operatorType", "")
+    if operator.startswith(SCAN_OPERATORS):
+        details = plan.get("args", {}).get("Details", "")
+        scans.append(f"{operator} {details}".strip())
+    for child in plan.get("children", []):
+        scans += find_label_scans(child)
+    return scans
+
+
+async def check_label_scans(driver: AsyncDriver, queries: dict[str, tuple[str, dict]] = CHECKED_QUERIES) -> dict[str, list[str]]:
+    """ EXPLAINs each query without running it, and returns the ones the planner would answer with a label scan """
+    flagged = {}
+    async with driver.session(database="neo4j", default_access_mode="READ") as session:
+        for name, (query, parameters) in queries.items():
+            result = await session.run("EXPLAIN " + query, parameters)
+            summary = await result.consume()
+            scans = find_label_scans(summary.plan or {})
+            if scans:
+                flagged[name] = scans
+    return flagged